@@ -0,0 +1,207 @@
+import asyncio
+import time
+
+from app.common.codecs import CODECS, get_codec
+from app.common.compression import create_compressor, create_decompressor
+from app.common.decos import log
+from app.common.errors import ReqFieldMissingError, ServerError
+from app.common.framing import FrameDecoder
+from app.common.latency import LatencyTracker
+from app.common.utils import encode_message, is_message
+from app.common.variables import *
+from app.logs.config_client_log import logger
+
+
+@log
+# Функция генерирует запрос о присутствии клиента: предлагаемые форматы кадров, кодеки и сжатие,
+# с acks - запрос подтверждений с отметками времени сервера
+def create_presence(account_name, framings=FRAMINGS, codecs=tuple(CODECS), compressions=COMPRESSIONS, acks=False):
+    presence = {
+        ACTION: PRESENCE,
+        TIME: time.time(),
+        USER: {
+            ACCOUNT_NAME: account_name,
+        },
+        FRAMING: list(framings),
+        CODEC: list(codecs),
+        COMPRESSION: list(compressions),
+    }
+    if acks:
+        presence[ACKS] = True
+    return presence
+
+
+@log
+# Функция разбирает ответ сервера на сообщение о присутствии, возращает 200 если все ОК
+# или генерирует исключение при ошибке.
+def process_response_ans(message):
+    if RESPONSE in message:
+        if message[RESPONSE] == 200:
+            return "200 : OK"
+        elif message[RESPONSE] == 400:
+            raise ServerError(f"400 : {message[ERROR]}")
+    raise ReqFieldMissingError(RESPONSE)
+
+
+# Асинхронный клиент JIM без консоли: подключение с presence, отправка, приём сообщений асинхронным итератором
+# и закрытие. Соединение - один сокет и разборщик кадров без своих потоков, поэтому в одном цикле событий
+# помещаются тысячи клиентов (боты, нагрузочные замеры). Подтверждения сервера (acks) в итератор не попадают,
+# они и полученные сообщения учитываются в latency - его можно передать один на всех клиентов.
+class AsyncClient:
+    __slots__ = (
+        "addr",
+        "port",
+        "name",
+        "acks",
+        "framings",
+        "codecs",
+        "compressions",
+        "reader",
+        "writer",
+        "decoder",
+        "compressor",
+        "latency",
+    )
+
+    def __init__(
+        self,
+        addr,
+        port,
+        name,
+        acks=False,
+        framings=FRAMINGS,
+        codecs=tuple(CODECS),
+        compressions=COMPRESSIONS,
+        latency=None,
+    ):
+        self.addr = addr
+        self.port = port
+        self.name = name
+        # Запрашивать ли подтверждения; после connect - согласовал ли их сервер
+        self.acks = acks
+        self.framings = framings
+        self.codecs = codecs
+        self.compressions = compressions
+        self.reader = None
+        self.writer = None
+        # Разборщик кадров соединения, формат меняется после ответа сервера на presence
+        self.decoder = FrameDecoder()
+        # Сжатие исходящих кадров, если сервер согласовал его в ответе на presence
+        self.compressor = None
+        self.latency = LatencyTracker() if latency is None else latency
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    # Подключение и presence. Возвращает ответ сервера ("200 : OK"), при отказе - ServerError.
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.addr, self.port)
+        # presence уходит в старом формате, согласованные формат кадров и кодек действуют после ответа
+        self.writer.write(
+            encode_message(create_presence(self.name, self.framings, self.codecs, self.compressions, self.acks))
+        )
+        await self.writer.drain()
+        response = await self.read_message()
+        try:
+            answer = process_response_ans(response)
+        except (ServerError, ReqFieldMissingError):
+            await self.abort()
+            raise
+        # Сервер без поддержки кадров и кодеков поля не вернёт, тогда остаёмся на старом формате и JSON
+        self.decoder.framing = response.get(FRAMING, FRAMING_LEGACY)
+        self.decoder.codec = get_codec(response.get(CODEC, CODEC_JSON))
+        self.decoder.decompressor = create_decompressor(response.get(COMPRESSION))
+        self.compressor = create_compressor(response.get(COMPRESSION))
+        self.acks = response.get(ACKS) is True
+        logger.debug(f"Клиент {self.name} подключен к {self.addr}:{self.port}, ответ сервера: {answer}")
+        return answer
+
+    # Сообщение пользователю или в комнату (#имя). Возвращает отправленный словарь.
+    async def send(self, destination, text):
+        message = {ACTION: MESSAGE, SENDER: self.name, DESTINATION: destination, TIME: time.time(), MESSAGE_TEXT: text}
+        await self.send_message(message)
+        return message
+
+    # Несколько сообщений одному получателю одним пакетом
+    async def send_batch(self, destination, texts):
+        messages = [
+            {ACTION: MESSAGE, SENDER: self.name, DESTINATION: destination, TIME: time.time(), MESSAGE_TEXT: text}
+            for text in texts
+        ]
+        await self.send_message({ACTION: BATCH, TIME: time.time(), MESSAGES: messages})
+        return messages
+
+    async def join(self, room):
+        await self.send_message({ACTION: JOIN, TIME: time.time(), ROOM: room})
+
+    async def leave(self, room):
+        await self.send_message({ACTION: LEAVE, TIME: time.time(), ROOM: room})
+
+    # Любой словарь JIM в согласованных формате кадров, кодеке и сжатии. drain ждёт, пока буфер записи
+    # не разгрузится, так что медленный сервер притормаживает отправителя.
+    async def send_message(self, message):
+        frame = encode_message(message, self.decoder.framing, self.decoder.codec)
+        if self.compressor is not None:
+            frame = self.compressor.compress_frame(frame)
+        self.writer.write(frame)
+        await self.writer.drain()
+
+    # Следующее сообщение от сервера: сообщения пользователей, ответы на запросы, ошибки. Подтверждения
+    # учитываются в latency и пропускаются. ConnectionResetError - сервер закрыл соединение.
+    async def receive(self):
+        while True:
+            message = await self.read_message()
+            if message.get(ACTION) == ACK:
+                self.latency.record_ack(message)
+                continue
+            if is_message(message):
+                self.latency.record_delivery(message)
+            return message
+
+    async def read_message(self):
+        message = self.decoder.next_message()
+        while message is None:
+            data = await self.reader.read(READ_CHUNK_SIZE)
+            if not data:
+                raise ConnectionResetError
+            self.decoder.feed(data)
+            message = self.decoder.next_message()
+        return message
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.receive()
+        except (ConnectionError, OSError):
+            raise StopAsyncIteration
+
+    # Выход: сообщение exit серверу и закрытие соединения. Повторный вызов ничего не делает.
+    async def close(self):
+        if not self.connected:
+            return
+        try:
+            await self.send_message({ACTION: EXIT, TIME: time.time(), ACCOUNT_NAME: self.name})
+        except (ConnectionError, OSError):
+            pass
+        await self.abort()
+
+    # Закрытие соединения без exit
+    async def abort(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
@@ -0,0 +1,211 @@
+import asyncio
+import time
+from functools import partial
+from socket import SOMAXCONN
+
+from app.common.utils import *
+from app.common.variables import *
+from app.connection_cls import (BYTES_RECEIVED, BYTES_SENT, SEND_CALLS,
+                                Connection, Relay)
+from app.server_cls import Server
+
+
+# Клиент асинхронного сервера. Вместо сокета - пара потоков asyncio, разбор кадров и ограниченная очередь
+# исходящих данных общие с Connection. Очередь разбирает корутина write_loop.
+class StreamConnection(Connection):
+    __slots__ = ("reader", "writer", "writable", "resumed", "drained")
+
+    def __init__(self, reader, writer, limit=OUTBOX_LIMIT, policy=DEFAULT_OUTBOX_POLICY):
+        super().__init__(None, writer.get_extra_info("peername")[:2], limit, policy)
+        self.reader = reader
+        self.writer = writer
+        # Событие "есть что отправить или пора закрываться" для write_loop
+        self.writable = asyncio.Event()
+        # Событие снятия паузы чтения (политика pause)
+        self.resumed = asyncio.Event()
+        # Событие "часть очереди отправлена" для выдачи журнала недоставленных сообщений
+        self.drained = asyncio.Event()
+
+    def fileno(self):
+        return self.writer.get_extra_info("socket").fileno()
+
+    def enqueue(self, data, sender=None, cache=None):
+        accepted = super().enqueue(data, sender, cache)
+        if accepted:
+            self.writable.set()
+        return accepted
+
+    def resume(self):
+        self.resumed.set()
+
+    def close(self):
+        self.closing = True
+        self.writable.set()
+        self.drained.set()
+
+    def abort(self):
+        self.closing = True
+        self.release_senders()
+        self.outbox.clear()
+        self.out_bytes = 0
+        self.writer.close()
+        self.writable.set()
+        self.drained.set()
+
+    # Пока отправитель приостановлен из-за переполненной очереди получателя, не читаем от него
+    async def wait_resumed(self):
+        while self.blocked_by:
+            self.resumed.clear()
+            await self.resumed.wait()
+
+    # Корутина записи: забирает всё, что накопилось в очереди, и отправляет одним writelines.
+    async def write_loop(self):
+        while True:
+            await self.writable.wait()
+            self.writable.clear()
+            while self.outbox:
+                chunks = list(self.outbox)
+                self.outbox.clear()
+                self.writer.writelines(chunks)
+                self.send_calls += 1
+                await self.writer.drain()
+                self.sent_frames += len(chunks)
+                sent = sum(map(len, chunks))
+                self.out_bytes -= sent
+                SEND_CALLS.inc()
+                BYTES_SENT.inc(sent)
+                self.drained.set()
+                if self.paused_senders and self.out_bytes <= self.limit // 2:
+                    self.release_senders()
+            if self.closing:
+                break
+        self.writer.close()
+
+    # Ждёт отправки очередной части очереди (или закрытия соединения)
+    async def wait_drained(self):
+        if not self.closing:
+            self.drained.clear()
+            await self.drained.wait()
+
+
+# Сервер на asyncio: приём подключений, чтение и запись для каждого клиента выполняются корутинами.
+# Разбор протокола JIM общий с Server (process_client_message / process_message).
+class AsyncServer(Server):
+    __slots__ = ("loop",)
+
+    def __init__(
+        self,
+        bind_addr,
+        port,
+        storage,
+        outbox_limit=OUTBOX_LIMIT,
+        outbox_policy=DEFAULT_OUTBOX_POLICY,
+        message_log=None,
+        compress_threshold=COMPRESSION_THRESHOLD,
+        archive=None,
+        metrics_port=METRICS_PORT,
+    ):
+        super().__init__(
+            bind_addr,
+            port,
+            storage,
+            outbox_limit,
+            outbox_policy,
+            message_log,
+            compress_threshold,
+            archive,
+            metrics_port,
+        )
+        # Множество вместо списка: проверка принадлежности и удаление клиента за O(1)
+        self.clients = set()
+        # Цикл событий потока сервера, создаётся в listen
+        self.loop = None
+
+    def listen(self):
+        self.logger.info("Запуск асинхронной прослушки")
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        # Слушающий сокет уже создан в start(). start_server заново вызывает listen, поэтому очередь
+        # подключений передаём явно, иначе при шквале подключений сработает значение по умолчанию (100).
+        server = await asyncio.start_server(self.handle_client, sock=self.socket, backlog=SOMAXCONN)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        client = StreamConnection(reader, writer, self.outbox_limit, self.outbox_policy)
+        self.logger.info(f"Установлено соединение с ПК {client.getpeername()}")
+        self.clients.add(client)
+        writer_task = asyncio.ensure_future(client.write_loop())
+        route = partial(self.relay_frame, client)
+        try:
+            while not client.closing:
+                await client.wait_resumed()
+                data = await reader.read(READ_CHUNK_SIZE)
+                if not data:
+                    break
+                BYTES_RECEIVED.inc(len(data))
+                self.received = time.time()
+                client.decoder.feed(data)
+                for message in client.decoder.messages(route):
+                    self.process_client_message(message, client)
+                self.dispatch_messages()
+        except Exception as ex:
+            self.logger.debug(ex)
+        finally:
+            self.logger.info(f"Клиент {client.getpeername()} отключился от сервера.")
+            self.clients.discard(client)
+            self.drop_client(client)
+        try:
+            await writer_task
+        except (ConnectionError, OSError):
+            pass
+        if client.replayed:
+            self.confirm_replay(client)
+            self.rewind_replay(client)
+
+    def connections(self):
+        return list(self.clients)
+
+    # Вызов из консоли выполняется циклом событий потока сервера
+    def call_soon(self, func):
+        if self.loop is None:
+            super().call_soon(func)
+        else:
+            self.loop.call_soon_threadsafe(func)
+
+    def close_client(self, client):
+        self.clients.discard(client)
+        client.abort()
+
+    # Выдача журнала идёт отдельной корутиной по мере освобождения очереди клиента
+    def start_replay(self, client, name):
+        idle = not client.replay and not client.replayed
+        super().start_replay(client, name)
+        if idle and client.replay:
+            asyncio.ensure_future(self.replay(client))
+
+    # Очередная порция - когда в очереди не больше половины ограничения. Доставка порций отмечается
+    # в журнале после их отправки, при закрытии соединения неотправленные возвращаются в журнал.
+    async def replay(self, client):
+        while (client.replay or client.replayed) and not client.closing:
+            if client.replay and client.out_bytes <= client.limit // 2:
+                self.refill(client)
+            else:
+                await client.wait_drained()
+            self.confirm_replay(client)
+
+    # Рассылка накопленных сообщений по очередям получателей, отправка не блокирует цикл событий.
+    # Получатели, переполнившие очередь при политике disconnect, отключаются.
+    def dispatch_messages(self):
+        for message, sender in self.messages:
+            self.deliver(message, sender)
+            destination = message.destination if isinstance(message, Relay) else message[DESTINATION]
+            for recipient in self.recipients(destination):
+                if recipient.overflowed and not recipient.closing:
+                    self.logger.warning(f"Очередь клиента {recipient.name} переполнена, соединение разорвано.")
+                    self.drop_client(recipient, abort=True)
+        self.messages.clear()
+        if self.offline is not None:
+            self.offline.sync()
@@ -0,0 +1,75 @@
+# Замер архива сообщений: скорость записи пачками и время поиска первой страницы (20 строк) по словам,
+# отправителю, получателю и периоду в архиве из COUNT сообщений.
+# Запуск из корня проекта: python -m app.benchmarks.bench_archive [число сообщений, по умолчанию 1000000]
+import datetime
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+from app.common.variables import *
+from app.db.archive import MessageArchive
+
+COUNT = 1000000
+BATCH = 50000
+USERS = 10000
+# Словарь: частота слов убывает по закону Ципфа, есть и очень частые, и редкие слова
+WORDS = [f"слово{i}" for i in range(20000)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(WORDS))))
+ROUNDS = 200
+
+
+def populate(archive, count):
+    rnd = random.Random(1)
+    start_time = time.time() - count
+    start = time.perf_counter()
+    for first in range(0, count, BATCH):
+        batch = []
+        for i in range(first, min(first + BATCH, count)):
+            text = " ".join(rnd.choices(WORDS, cum_weights=CUM_WEIGHTS, k=rnd.randint(5, 15)))
+            message = {SENDER: f"user{rnd.randrange(USERS)}", DESTINATION: f"user{rnd.randrange(USERS)}"}
+            message[MESSAGE_TEXT] = text
+            batch.append((start_time + i, message))
+        archive.write_batch(batch)
+    return count / (time.perf_counter() - start)
+
+
+def measure(archive, title, **query):
+    timings = []
+    found = 0
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        rows, _ = archive.search(**query)
+        timings.append(time.perf_counter() - start)
+        found = len(rows)
+    timings.sort()
+    print(
+        f"{title:40}: медиана {timings[len(timings) // 2] * 1000:7.2f} мс, "
+        f"99% {timings[int(len(timings) * 0.99)] * 1000:7.2f} мс, строк {found}"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    with tempfile.TemporaryDirectory() as directory:
+        archive = MessageArchive(os.path.join(directory, "archive.db3"))
+        rate = populate(archive, count)
+        print(f"Записано {count} сообщений, {rate:.0f} сообщений/с")
+        now = time.time()
+        since = datetime.datetime.fromtimestamp(now - count // 2)
+        until = datetime.datetime.fromtimestamp(now - count // 2 + 3600)
+        measure(archive, "частое слово", words=WORDS[0])
+        measure(archive, "редкое слово", words=WORDS[-1])
+        measure(archive, "два слова", words=f"{WORDS[10]} {WORDS[100]}")
+        measure(archive, "отправитель", sender="user42")
+        measure(archive, "отправитель и частое слово", words=WORDS[1], sender="user42")
+        measure(archive, "получатель и редкое слово", words=WORDS[5000], recipient="user42")
+        measure(archive, "период в час", since=since, until=until)
+        measure(archive, "частое слово за час", words=WORDS[0], since=since, until=until)
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
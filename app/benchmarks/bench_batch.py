@@ -0,0 +1,93 @@
+# Замер пакетной обработки: системные вызовы отправки на сообщение при отправке очереди одним sendmsg
+# и по одному кадру, и время сервера на сообщение, пришедшее отдельным кадром и в пакете (action batch).
+# Запуск из корня проекта: python -m app.benchmarks.bench_batch
+import logging
+import socket
+import threading
+import time
+
+import app.connection_cls as connection_cls
+from app.common.utils import encode_message
+from app.common.variables import *
+from app.connection_cls import Connection
+from app.server_cls import Server
+
+BURSTS = (1, 10, 100, 1000)
+MESSAGES = 10000
+SENDMSG = connection_cls.SENDMSG
+
+
+def drain(sock):
+    while sock.recv(1 << 20):
+        pass
+
+
+# Очередь из burst кадров за проход цикла, затем flush. Возвращает вызовы отправки на сообщение и мкс на сообщение.
+def measure_send(burst, sendmsg):
+    connection_cls.SENDMSG = sendmsg
+    server_side, client_side = socket.socketpair()
+    reader = threading.Thread(target=drain, args=(client_side,), daemon=True)
+    reader.start()
+    connection = Connection(server_side, None, limit=1024 ** 3)
+    frame = encode_message(
+        {ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", TIME: time.time(), MESSAGE_TEXT: "x" * 100},
+        FRAMING_LENGTH,
+    )
+    start = time.perf_counter()
+    for _ in range(MESSAGES // burst):
+        for _ in range(burst):
+            connection.enqueue(frame)
+        connection.flush()
+        while connection.outbox:
+            time.sleep(0)
+            connection.flush()
+    elapsed = time.perf_counter() - start
+    server_side.close()
+    reader.join()
+    client_side.close()
+    return connection.send_calls / connection.sent_frames, elapsed / connection.sent_frames * 1e6
+
+
+# Время сервера на сообщение: от принятых байт до очереди получателя
+def measure_receive(batch):
+    logging.getLogger("server").setLevel(logging.ERROR)
+    server = Server("127.0.0.1", DEFAULT_PORT, None, outbox_limit=1024 ** 3)
+    for name in ("test1", "test2"):
+        client = Connection(None, None, server.outbox_limit)
+        client.name = name
+        client.framing = FRAMING_LENGTH
+        server.names[name] = client
+    messages = [
+        {ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", TIME: time.time(), MESSAGE_TEXT: f"{i} " + "x" * 100}
+        for i in range(batch)
+    ]
+    if batch > 1:
+        data = encode_message({ACTION: BATCH, TIME: time.time(), MESSAGES: messages}, FRAMING_LENGTH)
+    else:
+        data = encode_message(messages[0], FRAMING_LENGTH)
+    sender = server.names["test1"]
+    start = time.perf_counter()
+    for _ in range(MESSAGES // batch):
+        sender.decoder.feed(data)
+        for message in sender.decoder:
+            server.process_client_message(message, sender)
+        for message, sender in server.messages:
+            server.deliver(message, sender)
+        server.messages.clear()
+    return (time.perf_counter() - start) / MESSAGES * 1e6
+
+
+def main():
+    print(f"{'кадров за проход':>16} {'send: вызовов':>14} {'мкс':>6} {'sendmsg: вызовов':>17} {'мкс':>6}  (на сообщение)")
+    for burst in BURSTS:
+        single = measure_send(burst, False)
+        coalesced = measure_send(burst, SENDMSG)
+        print(f"{burst:>16} {single[0]:>14.3f} {single[1]:>6.2f} {coalesced[0]:>17.3f} {coalesced[1]:>6.2f}")
+    print()
+    print(f"{'сообщений в кадре':>17} {'мкс/сообщ. на сервере':>22}")
+    for batch in BURSTS:
+        print(f"{batch:>17} {measure_receive(batch):>22.2f}")
+
+
+if __name__ == "__main__":
+    main()
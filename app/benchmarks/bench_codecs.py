@@ -0,0 +1,39 @@
+# Замер кодеков сообщений: размер кадра на проводе и время кодирования/декодирования одного сообщения.
+# Запуск из корня проекта: python -m app.benchmarks.bench_codecs
+import time
+
+from app.common.codecs import CODECS
+from app.common.framing import LENGTH_PREFIX
+from app.common.variables import *
+
+ROUNDS = 100000
+
+STAMP = 1634563200.123456
+MESSAGES = {
+    "presence": {ACTION: PRESENCE, TIME: STAMP, USER: {ACCOUNT_NAME: "test1"}},
+    "короткое": {ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", TIME: STAMP, MESSAGE_TEXT: "Привет!"},
+    "1 КиБ": {ACTION: MESSAGE, SENDER: "test1", DESTINATION: "#room", TIME: STAMP, MESSAGE_TEXT: "x" * 1024},
+}
+
+
+def per_message_ns(func, arg):
+    start = time.perf_counter_ns()
+    for _ in range(ROUNDS):
+        func(arg)
+    return (time.perf_counter_ns() - start) / ROUNDS
+
+
+def main():
+    print(f"{'сообщение':>10} {'кодек':>8} {'байт в кадре':>13} {'encode, нс':>11} {'decode, нс':>11}")
+    for title, message in MESSAGES.items():
+        for codec in CODECS.values():
+            payload = codec.encode(message)
+            assert codec.decode(payload) == message
+            print(
+                f"{title:>10} {codec.name:>8} {len(payload) + LENGTH_PREFIX.size:>13} "
+                f"{per_message_ns(codec.encode, message):>11.0f} {per_message_ns(codec.decode, payload):>11.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
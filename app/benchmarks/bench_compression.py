@@ -0,0 +1,49 @@
+# Замер сжатия кадров для подбора порога (--compress-threshold): степень сжатия и время сжатия/распаковки
+# одного кадра для разных размеров сообщения в режимах deflate и deflate-stream.
+# Запуск из корня проекта: python -m app.benchmarks.bench_compression
+import random
+import time
+
+from app.common.compression import create_compressor, create_decompressor
+from app.common.framing import FrameDecoder
+from app.common.utils import encode_message
+from app.common.variables import *
+
+SIZES = (64, 256, 512, 1024, 4096, 16384)
+FRAMES = 2000
+WORDS = "привет как дела сообщение сервер клиент отправлено получено hello chat message the and of".split()
+
+
+def make_messages(size):
+    rnd = random.Random(size)
+    messages = []
+    for i in range(FRAMES):
+        text = ""
+        while len(text) < size:
+            text += rnd.choice(WORDS) + " "
+        messages.append({ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", TIME: time.time(), MESSAGE_TEXT: text})
+    return [encode_message(message, FRAMING_LENGTH) for message in messages]
+
+
+def main():
+    print(f"{'текст':>6} {'режим':>15} {'байт':>7} {'сжато':>7} {'ratio':>6} {'сжатие, нс':>11} {'распаковка, нс':>15}")
+    for size in SIZES:
+        frames = make_messages(size)
+        raw = sum(map(len, frames)) // FRAMES
+        for mode in COMPRESSIONS:
+            compressor = create_compressor(mode, threshold=0)
+            compressed = [compressor.compress_frame(frame) for frame in frames]
+            decoder = FrameDecoder(FRAMING_LENGTH)
+            decoder.decompressor = create_decompressor(mode)
+            decoder.feed(b"".join(compressed))
+            while decoder.next_frame() is not None:
+                pass
+            decompressor = decoder.decompressor
+            print(
+                f"{size:>6} {mode:>15} {raw:>7} {sum(map(len, compressed)) // FRAMES:>7} {compressor.ratio:>6.2f} "
+                f"{compressor.cpu_ns // FRAMES:>11} {decompressor.cpu_ns // max(decompressor.frames, 1):>15}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Замер рассылки сообщения в комнату: кодирование один раз против кодирования для каждого участника.
+# Запуск из корня проекта: python -m app.benchmarks.bench_fanout
+import logging
+import time
+
+from app.common.utils import encode_message
+from app.common.variables import *
+from app.connection_cls import Connection
+from app.server_cls import Server
+
+ROOM_SIZES = (10, 1000, 10000)
+ROUNDS = 20
+
+
+def make_server(size):
+    logging.getLogger("server").setLevel(logging.ERROR)
+    server = Server("127.0.0.1", DEFAULT_PORT, None, outbox_limit=1024 ** 3)
+    members = set()
+    for i in range(size):
+        member = Connection(None, None, server.outbox_limit, server.outbox_policy)
+        member.name = f"user{i}"
+        member.framing = FRAMINGS[i % len(FRAMINGS)]
+        members.add(member)
+    server.rooms["#bench"] = members
+    return server, members
+
+
+def clear(members):
+    for member in members:
+        member.outbox.clear()
+        member.out_bytes = 0
+
+
+# Прежний способ: отдельное сообщение и отдельное кодирование для каждого участника
+def naive(server, message):
+    for member in server.rooms[message[DESTINATION]]:
+        member.enqueue(encode_message(dict(message, **{DESTINATION: member.name}), member.framing))
+
+
+def measure(func, server, members, message):
+    best = None
+    for _ in range(ROUNDS):
+        clear(members)
+        start = time.perf_counter()
+        func(message)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    message = {ACTION: MESSAGE, SENDER: "bot", DESTINATION: "#bench", TIME: time.time(), MESSAGE_TEXT: "x" * 200}
+    print(f"{'участников':>10} {'по одному, мс':>14} {'один раз, мс':>13} {'мкс/участник':>13} {'ускорение':>10}")
+    for size in ROOM_SIZES:
+        server, members = make_server(size)
+        slow = measure(lambda msg: naive(server, msg), server, members, message)
+        fast = measure(server.process_room_message, server, members, message)
+        frames = {id(frame) for member in members for frame in member.outbox}
+        assert len(frames) == len(FRAMINGS) or size < len(FRAMINGS)
+        print(f"{size:>10} {slow * 1000:>14.3f} {fast * 1000:>13.3f} {fast / size * 1e6:>13.3f} {slow / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Замер задержки сообщения через настоящий сервер на локальном порту: отправитель запрашивает подтверждения
+# (acks) и получает время приёма и постановки в очередь получателя, получатель считает задержку доставки.
+# Сообщения идут по одному (следующее - после подтверждения и доставки предыдущего), отдельно для пересылки
+# исходного кадра и для полного разбора (ключи не в порядке action, from, to - быстрый путь не подходит).
+# Запуск из корня проекта: python -m app.benchmarks.bench_latency [число сообщений, по умолчанию 5000]
+import logging
+import sys
+import time
+from socket import create_connection, socket
+from threading import Thread
+
+from app.common.codecs import get_codec
+from app.common.framing import FrameDecoder
+from app.common.latency import LatencyTracker
+from app.common.utils import get_message, send_message
+from app.common.variables import *
+from app.db.memory_storage import MemoryStorage
+from app.server_cls import Server
+
+COUNT = 5000
+
+
+def free_port():
+    with socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server():
+    logging.getLogger("server").setLevel(logging.ERROR)
+    server = Server("127.0.0.1", free_port(), MemoryStorage())
+    server.open_socket()
+    Thread(target=server.listen, daemon=True).start()
+    return server
+
+
+def connect(port, name, acks):
+    sock = create_connection(("127.0.0.1", port))
+    decoder = FrameDecoder()
+    presence = {ACTION: PRESENCE, TIME: time.time(), USER: {ACCOUNT_NAME: name}, FRAMING: [FRAMING_LENGTH]}
+    if acks:
+        presence[ACKS] = True
+    send_message(sock, presence)
+    response = get_message(sock, decoder)
+    assert not acks or response.get(ACKS) is True
+    decoder.framing = response[FRAMING]
+    decoder.codec = get_codec(response.get(CODEC, CODEC_JSON))
+    return sock, decoder
+
+
+def measure(port, title, relay, count):
+    sender, sender_decoder = connect(port, f"sender-{relay}", True)
+    recipient, recipient_decoder = connect(port, f"recipient-{relay}", False)
+    tracker = LatencyTracker()
+    for i in range(count):
+        if relay:
+            message = {ACTION: MESSAGE, SENDER: f"sender-{relay}", DESTINATION: f"recipient-{relay}"}
+        else:
+            message = {TIME: None, ACTION: MESSAGE, SENDER: f"sender-{relay}", DESTINATION: f"recipient-{relay}"}
+        message[TIME] = time.time()
+        message[MESSAGE_TEXT] = f"сообщение {i}"
+        send_message(sender, message, FRAMING_LENGTH)
+        tracker.record_ack(get_message(sender, sender_decoder))
+        tracker.record_delivery(get_message(recipient, recipient_decoder))
+    sender.close()
+    recipient.close()
+    print(title)
+    for line in tracker.report():
+        print(f"    {line}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    server = start_server()
+    measure(server.port, "Пересылка исходного кадра:", True, count)
+    measure(server.port, "Полный разбор:", False, count)
+
+
+if __name__ == "__main__":
+    main()
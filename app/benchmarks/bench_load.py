@@ -0,0 +1,107 @@
+# Нагрузочный замер: в одном процессе и одном цикле событий работают тысячи пользователей на AsyncClient.
+# Пользователь i пишет пользователю i+1 (последний - первому) с заданной частотой, все запрашивают подтверждения
+# (acks), задержки собираются в общий LatencyTracker. Без --port сервер запускается в потоке этого же процесса
+# на свободном порту; с --addr/--port нагрузка идёт на уже запущенный сервер (в т.ч. asyncio или с воркерами).
+# Запуск из корня проекта: python -m app.benchmarks.bench_load [--users 1000] [--rate 1] [--duration 10]
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from app.async_client_cls import AsyncClient
+from app.benchmarks.bench_latency import start_server
+from app.common.latency import LatencyTracker
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Сколько пользователей подключаются одновременно: очередь accept сервера не бесконечна
+CONNECT_CONCURRENCY = 100
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000, help="Simulated users [default=1000]")
+    parser.add_argument("--rate", type=float, default=1.0, help="Messages per second per user [default=1]")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of sending [default=10]")
+    parser.add_argument("--addr", default="127.0.0.1", help="Server address [default=127.0.0.1]")
+    parser.add_argument("--port", type=int, default=None, help="Server port [default: in-process server]")
+    return parser.parse_args()
+
+
+# Каждый пользователь - два сокета файловых дескрипторов у процесса со встроенным сервером
+def raise_nofile(users):
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, users * 2 + 100)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+
+async def connect(client, semaphore):
+    async with semaphore:
+        await client.connect()
+
+
+async def sender(client, destination, rate, deadline, counts):
+    # Случайный сдвиг, чтобы пользователи не отправляли сообщения одной волной
+    await asyncio.sleep(random.random() / rate)
+    i = 0
+    while time.monotonic() < deadline:
+        await client.send(destination, f"сообщение {i}")
+        counts["sent"] += 1
+        i += 1
+        await asyncio.sleep(1 / rate)
+
+
+async def receiver(client, counts):
+    async for message in client:
+        counts["delivered"] += 1
+
+
+async def run(args):
+    tracker = LatencyTracker()
+    names = [f"user-{i}" for i in range(args.users)]
+    clients = [AsyncClient(args.addr, args.port, name, acks=True, latency=tracker) for name in names]
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    start = time.perf_counter()
+    await asyncio.gather(*(connect(client, semaphore) for client in clients))
+    print(f"Подключено пользователей: {len(clients)} за {time.perf_counter() - start:.2f} с")
+
+    counts = {"sent": 0, "delivered": 0}
+    receivers = [asyncio.ensure_future(receiver(client, counts)) for client in clients]
+    deadline = time.monotonic() + args.duration
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            sender(client, names[(i + 1) % len(names)], args.rate, deadline, counts)
+            for i, client in enumerate(clients)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    # Даём дойти сообщениям, отправленным последними
+    await asyncio.sleep(1)
+    await asyncio.gather(*(client.close() for client in clients))
+    await asyncio.gather(*receivers, return_exceptions=True)
+
+    print(f"Отправлено: {counts['sent']}, доставлено: {counts['delivered']}, за {elapsed:.1f} с")
+    print(f"Пропускная способность: {counts['delivered'] / elapsed:.0f} сообщений/с")
+    for line in tracker.report():
+        print(f"    {line}")
+
+
+def main():
+    args = parse_args()
+    logging.getLogger("client").setLevel(logging.WARNING)
+    raise_nofile(args.users)
+    if args.port is None:
+        args.port = start_server().port
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Замер задержки, которую лог добавляет к обработке сообщения: время вызова logger.info в потоке сервера
+# при выводе в терминал и файл прямо из него (как было) и через очередь с фоновым потоком записи
+# (app.logs.pipeline) с политиками drop и block. Терминал заменён на /dev/null, файл - во временном каталоге.
+# Запуск из корня проекта: python -m app.benchmarks.bench_logging [число записей, по умолчанию 20000]
+import logging
+import logging.handlers
+import os
+import sys
+import tempfile
+import time
+
+from app.common.variables import *
+from app.logs.pipeline import (BatchStreamHandler,
+                               BatchTimedRotatingFileHandler, LogPipeline)
+
+COUNT = 20000
+
+
+def handlers(directory, batch):
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(filename)s %(message)s")
+    terminal = open(os.devnull, "w")
+    path = os.path.join(directory, "server.log")
+    if batch:
+        result = [BatchStreamHandler(terminal), BatchTimedRotatingFileHandler(path, encoding="utf8", when="D")]
+    else:
+        result = [
+            logging.StreamHandler(terminal),
+            logging.handlers.TimedRotatingFileHandler(path, encoding="utf8", when="D"),
+        ]
+    for handler in result:
+        handler.setFormatter(formatter)
+    return result
+
+
+def run(title, count, policy):
+    with tempfile.TemporaryDirectory() as directory:
+        logger = logging.getLogger(f"bench-logging-{policy}")
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        pipeline = None
+        if policy is None:
+            for handler in handlers(directory, False):
+                logger.addHandler(handler)
+        else:
+            pipeline = LogPipeline(handlers(directory, True), policy=policy)
+            logger.addHandler(pipeline)
+        timings = []
+        start = time.perf_counter()
+        for i in range(count):
+            call = time.perf_counter_ns()
+            logger.info(f"Пользователь user{i % 100} не в сети, сообщение сохранено до подключения.")
+            timings.append(time.perf_counter_ns() - call)
+        emitted = time.perf_counter() - start
+        if pipeline is not None:
+            pipeline.flush()
+        total = time.perf_counter() - start
+        timings.sort()
+        dropped = pipeline.dropped if pipeline is not None else 0
+        print(
+            f"{title:28}: вызов медиана {timings[count // 2] / 1000:6.1f} мкс, 99% {timings[count * 99 // 100] / 1000:7.1f} мкс, "
+            f"поток сервера {count / emitted:8.0f} записей/с, вывод {count / total:7.0f} записей/с, отброшено {dropped}"
+        )
+        for handler in list(logger.handlers):
+            handler.close()
+            logger.removeHandler(handler)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    run("вывод в потоке сервера", count, None)
+    run("очередь, block", count, LOG_POLICY_BLOCK)
+    run("очередь, drop", count, LOG_POLICY_DROP)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# Замер обработки сервером сообщения пользователю: полный разбор и повторное кодирование против пересылки
+# исходного кадра (быстрый путь). Время - на одно сообщение, от принятых байт до очереди получателя.
+# Запуск из корня проекта: python -m app.benchmarks.bench_relay
+import logging
+import time
+from functools import partial
+
+from app.common.codecs import CODECS
+from app.common.utils import encode_message
+from app.common.variables import *
+from app.connection_cls import Connection
+from app.server_cls import Server
+
+BATCH = 1000
+ROUNDS = 20
+
+
+def make_server(codec):
+    logging.getLogger("server").setLevel(logging.ERROR)
+    server = Server("127.0.0.1", DEFAULT_PORT, None, outbox_limit=1024 ** 3)
+    for name in ("sender", "recipient"):
+        client = Connection(None, None, server.outbox_limit, server.outbox_policy)
+        client.name = name
+        client.framing = FRAMING_LENGTH
+        client.codec = codec
+        server.names[name] = client
+    return server
+
+
+def run(server, data, fast):
+    sender = server.names["sender"]
+    recipient = server.names["recipient"]
+    recipient.outbox.clear()
+    recipient.out_bytes = 0
+    start = time.perf_counter_ns()
+    sender.decoder.feed(data)
+    route = partial(server.relay_frame, sender) if fast else None
+    for message in sender.decoder.messages(route):
+        server.process_client_message(message, sender)
+    for message, sender in server.messages:
+        server.deliver(message, sender)
+    server.messages.clear()
+    elapsed = time.perf_counter_ns() - start
+    assert len(recipient.outbox) == BATCH
+    return elapsed / BATCH
+
+
+def main():
+    message = {ACTION: MESSAGE, SENDER: "sender", DESTINATION: "recipient", TIME: time.time(), MESSAGE_TEXT: "x" * 100}
+    print(f"{'кодек':>8} {'разбор, нс':>11} {'пересылка, нс':>14} {'ускорение':>10}")
+    for codec in CODECS.values():
+        server = make_server(codec)
+        data = encode_message(message, FRAMING_LENGTH, codec) * BATCH
+        slow = min(run(server, data, False) for _ in range(ROUNDS))
+        fast = min(run(server, data, True) for _ in range(ROUNDS))
+        print(f"{codec.name:>8} {slow:>11.0f} {fast:>14.0f} {slow / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
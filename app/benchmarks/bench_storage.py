@@ -0,0 +1,77 @@
+# Замер записи входов в базу сервера: журнал SQLite по умолчанию и запись в потоке сервера (как было) против
+# WAL с настройками SQLITE_PRAGMAS, сразу и через очередь отложенной записи. Параллельно поток консоли читает
+# список пользователей - видно, ждёт ли чтение записи. Для сравнения - хранилище в памяти (--storage memory).
+# Запуск из корня проекта: python -m app.benchmarks.bench_storage
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from app.common.variables import *
+from app.db.memory_storage import MemoryStorage
+from app.db.server_db import ServerStorage
+
+LOGINS = 2000
+USERS = 500
+
+CONFIGS = (
+    ("журнал по умолчанию, запись сразу", {}, False),
+    ("WAL и настройки, запись сразу", SQLITE_PRAGMAS, False),
+    ("WAL и настройки, отложенная запись", SQLITE_PRAGMAS, True),
+    ("хранилище в памяти", None, False),
+)
+
+
+def run(pragmas, write_behind):
+    with tempfile.TemporaryDirectory() as directory:
+        database = "sqlite:///" + os.path.join(directory, "server.db3")
+        if pragmas is None:
+            storage = MemoryStorage()
+        else:
+            storage = ServerStorage(database=database, write_behind=write_behind, pragmas=pragmas)
+        done = threading.Event()
+        reads = []
+
+        # Консоль администратора: список пользователей, пока идут входы
+        def console():
+            while not done.is_set():
+                start = time.perf_counter()
+                storage.user_list()
+                reads.append(time.perf_counter() - start)
+
+        reader = threading.Thread(target=console)
+        reader.start()
+        start = time.perf_counter()
+        for i in range(LOGINS):
+            name = f"user{i % USERS}"
+            storage.user_login(name, "127.0.0.1", 7000 + i % 1000)
+            storage.user_logout(name)
+        server_time = time.perf_counter() - start
+        storage.flush()
+        total = time.perf_counter() - start
+        done.set()
+        reader.join()
+        storage.close()
+        if isinstance(storage, ServerStorage):
+            storage.Session.remove()
+            storage.database_engine.dispose()
+    return server_time, total, reads
+
+
+def main():
+    print(f"{LOGINS} входов и выходов, {USERS} пользователей")
+    for title, pragmas, write_behind in CONFIGS:
+        # user_login печатает каждый вход, в замере этот вывод не нужен
+        with contextlib.redirect_stdout(io.StringIO()):
+            server_time, total, reads = run(pragmas, write_behind)
+        slowest = max(reads, default=0.0) * 1000
+        print(
+            f"{title:36}: поток сервера {LOGINS / server_time:7.0f} входов/с, с записью в базу "
+            f"{LOGINS / total:6.0f} входов/с; чтений консоли {len(reads):5}, самое долгое {slowest:6.1f} мс"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Замер трассировки вызовов: время одного вызова get_message и send_message без обёртки (JIM_TRACE=off),
+# с обёрткой при выключенном уровне DEBUG, с выборкой 1% и с записью каждого вызова, и для сравнения -
+# прежний декоратор @log, собиравший строку со всеми аргументами при каждом вызове.
+# Лог пишется в память, время диска в замер не входит.
+# Запуск из корня проекта: python -m app.benchmarks.bench_tracing
+import io
+import logging
+import time
+
+from app.common import utils
+from app.common.tracing import trace
+from app.common.variables import *
+
+ROUNDS = 20000
+REPEATS = 5
+
+MESSAGE = {ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", TIME: 1634563200.123456, MESSAGE_TEXT: "Привет!"}
+
+
+# Сокет без сети: send ничего не делает, recv отдаёт одно и то же сообщение
+class FakeSocket:
+    def __init__(self, data):
+        self.data = data
+
+    def send(self, data):
+        return len(data)
+
+    def recv(self, size):
+        return self.data
+
+
+def eager_log(logger):
+    def decorator(func):
+        def log_saver(*args, **kwargs):
+            logger.debug(
+                f"Была вызвана функция {func.__name__} c параметрами {args} , {kwargs}. Вызов из модуля {func.__module__}"
+            )
+            return func(*args, **kwargs)
+
+        return log_saver
+
+    return decorator
+
+
+# Лучшее из REPEATS повторений: фоновые процессы машины только замедляют вызовы
+def per_call_ns(func, *args):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter_ns()
+        for _ in range(ROUNDS):
+            func(*args)
+        elapsed = (time.perf_counter_ns() - start) / ROUNDS
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    logger = logging.getLogger("bench-tracing")
+    logger.propagate = False
+    logger.addHandler(logging.StreamHandler(io.StringIO()))
+    sock = FakeSocket(utils.dump_message(MESSAGE))
+    variants = (
+        ("без обёртки", lambda func: func, logging.DEBUG),
+        ("обёртка, DEBUG выключен", trace(logger=logger), logging.INFO),
+        ("выборка 1%", trace(sample=0.01, logger=logger), logging.DEBUG),
+        ("каждый вызов", trace(logger=logger), logging.DEBUG),
+        ("прежний @log", eager_log(logger), logging.DEBUG),
+    )
+    print(f"{'трассировка':>24} {'get_message, нс':>16} {'send_message, нс':>17}")
+    for title, decorator, level in variants:
+        logger.setLevel(level)
+        # Декорируются исходные функции: в модуле utils они уже обёрнуты по JIM_TRACE
+        get_message = decorator(getattr(utils.get_message, "__wrapped__", utils.get_message))
+        send_message = decorator(getattr(utils.send_message, "__wrapped__", utils.send_message))
+        print(
+            f"{title:>24} {per_call_ns(get_message, sock):>16.0f} {per_call_ns(send_message, sock, MESSAGE):>17.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
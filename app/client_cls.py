@@ -1,43 +1,34 @@
 import argparse
-import json
-import time
-from socket import AF_INET, SOCK_STREAM, socket
+import asyncio
 from threading import Thread
 
-from app.common.decos import log, try_except_wrapper
+from app.async_client_cls import AsyncClient
+from app.common.decos import log
 from app.common.descriptor import Addr, Port
-from app.common.errors import (IncorrectDataRecivedError, ReqFieldMissingError,
-                               ServerError)
+from app.common.errors import IncorrectDataRecivedError, ReqFieldMissingError, ServerError
 from app.common.meta import ClientVerifier
 from app.common.utils import *
 from app.common.variables import *
 from app.logs.config_client_log import logger
 
 
-class ClientThread(Thread):
-    __slots__ = ("func", "logger", "sock", "name")
-
-    def __init__(self, func, logger, sock, name):
-        super().__init__()
-        self.func = func
-        self.logger = logger
-        self.daemon = True
-        self.sock = sock
-        self.name = name
-
-    @try_except_wrapper
-    def run(self):
-        self.func(self.sock, self.name)
-
-
+# Консольный клиент - оболочка над AsyncClient: приём сообщений и команды пользователя - задачи одного цикла
+# событий, строки консоли читает отдельный поток и передаёт в цикл через очередь.
 class Client(metaclass=ClientVerifier):
-    __slots__ = ("_addr", "_port", "name", "logger", "socket", "connected", "listener", "sender", "user_interface")
+    __slots__ = (
+        "_addr",
+        "_port",
+        "name",
+        "logger",
+        "acks",
+        "connection",
+        "lines",
+    )
 
-    TCP = (AF_INET, SOCK_STREAM)
     addr = Addr("_addr")
     port = Port("_port")
 
-    def __init__(self, addr, port, name):
+    def __init__(self, addr, port, name, acks=False):
         # Сообщаем о запуске
         print("Консольный месседжер. Клиентский модуль.")
         self.logger = logger
@@ -49,144 +40,167 @@ class Client(metaclass=ClientVerifier):
         self.logger.info(
             f"Запущен клиент с парамертами: адрес сервера: {self.addr} , порт: {self.port}, имя пользователя: {self.name}"
         )
-        self.connected = False
+        # Запрашивать ли у сервера подтверждения сообщений с отметками времени
+        self.acks = acks
+        self.connection = None
+        # Строки, введённые в консоли (None - конец ввода)
+        self.lines = None
 
     def start(self):
-        self.socket = socket(*self.TCP)
-        self.connect()
+        asyncio.run(self.run())
 
     # Функция выводящяя справку по использованию.
     def print_help(self):
         txt = (
             "=================HELPER===================\n"
             "Поддерживаемые команды:\n"
-            "message - отправить сообщение. Кому и текст будет запрошены отдельно.\n"
+            "message - отправить сообщение. Кому и текст будет запрошены отдельно. Для комнаты - #имя_комнаты\n"
+            "batch - отправить несколько сообщений одним пакетом\n"
+            "join - войти в комнату\n"
+            "leave - выйти из комнаты\n"
+            "latency - задержки сообщений: p50, p99, p999 по участкам пути\n"
             "help - вывести подсказки по командам\n"
             "exit - выход из программы\n"
         )
         print(txt)
 
-    @try_except_wrapper
-    def connect(self):
-        self.socket.connect((self.addr, self.port))
-        self.connected = True
-        send_message(self.socket, self.create_presence())
-        answer = self.process_response_ans(get_message(self.socket))
+    # Подключение, затем приём сообщений и команды пользователя, пока не завершится одно из них:
+    # команда exit или потеря соединения.
+    async def run(self):
+        self.connection = AsyncClient(self.addr, self.port, self.name, self.acks)
+        try:
+            answer = await self.connection.connect()
+        except (OSError, ServerError, ReqFieldMissingError, IncorrectDataRecivedError) as ex:
+            self.logger.critical(f"Не удалось подключиться к серверу: {ex}")
+            print(f"Не удалось подключиться к серверу: {ex}")
+            return
         self.logger.info(f"Установлено соединение с сервером. Ответ сервера: {answer}")
         print(f"Установлено соединение с сервером.")
 
-        # Запускаем клиенский процесс приёма сообщний
-        self.listener = ClientThread(self.message_from_server, self.logger, self.socket, self.name)
-        self.listener.start()
-
-        # Затем запускаем отправку сообщений и взаимодействие с пользователем.
-        self.user_interface = ClientThread(self.user_interactive, self.logger, self.socket, self.name)
-        self.user_interface.start()
+        self.lines = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        Thread(target=self.read_console, args=(loop,), daemon=True).start()
+        tasks = [
+            asyncio.ensure_future(self.message_from_server()),
+            asyncio.ensure_future(self.user_interactive()),
+        ]
         self.logger.debug("Запущены процессы")
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in tasks:
+            task.cancel()
+        await self.connection.close()
 
-        # Watchdog основной цикл, если один из потоков завершён, то значит или потеряно соединение или пользователь
-        # ввёл exit. Поскольку все события обработываются в потоках, достаточно просто завершить цикл.
+    # Поток чтения консоли: input блокирует, поэтому он не в цикле событий
+    def read_console(self, loop):
         while True:
-            time.sleep(1)
-            if self.listener.is_alive() and self.user_interface.is_alive():
-                continue
-            break
+            try:
+                line = input()
+            except (EOFError, KeyboardInterrupt):
+                line = None
+            loop.call_soon_threadsafe(self.lines.put_nowait, line)
+            if line is None:
+                return
+
+    # Строка консоли после приглашения prompt. Конец ввода завершает работу как команда exit.
+    async def ask(self, prompt):
+        print(prompt, end="", flush=True)
+        line = await self.lines.get()
+        return "exit" if line is None else line
 
     @log
-    # Функция создаёт словарь с сообщением о выходе.
-    def create_exit_message(self, account_name):
-        return {ACTION: EXIT, TIME: time.time(), ACCOUNT_NAME: account_name}
+    # Функция запрашивает кому отправить сообщение и само сообщение, и отправляет полученные данные на сервер.
+    async def create_message(self):
+        to = await self.ask("Введите получателя сообщения: ")
+        text = await self.ask("Введите сообщение для отправки: ")
+        message = await self.connection.send(to, text)
+        self.logger.debug(f"Сформирован словарь сообщения: {message}")
+        self.logger.info(f"Отправлено сообщение для пользователя {to}")
 
     @log
-    # Функция запрашивает кому отправить сообщение и само сообщение, и отправляет полученные данные на сервер.
-    def create_message(self, sock, account_name="Guest"):
-        to = input("Введите получателя сообщения: ")
-        message = input("Введите сообщение для отправки: ")
-        message_dict = {
-            ACTION: MESSAGE,
-            SENDER: account_name,
-            DESTINATION: to,
-            TIME: time.time(),
-            MESSAGE_TEXT: message,
-        }
-        self.logger.debug(f"Сформирован словарь сообщения: {message_dict}")
-        try:
-            send_message(sock, message_dict)
-            self.logger.info(f"Отправлено сообщение для пользователя {to}")
-        except:
-            self.logger.critical("Потеряно соединение с сервером.")
-            exit(1)
+    # Функция запрашивает получателя и несколько сообщений (до пустой строки) и отправляет их одним пакетом
+    async def create_batch(self):
+        to = await self.ask("Введите получателя сообщений: ")
+        texts = []
+        while True:
+            text = await self.ask("Введите сообщение (пустая строка - отправить пакет): ")
+            if not text:
+                break
+            texts.append(text)
+        if not texts:
+            return
+        await self.connection.send_batch(to, texts)
+        self.logger.info(f"Отправлен пакет из {len(texts)} сообщений для пользователя {to}")
 
     @log
+    # Функция запрашивает имя комнаты и отправляет запрос на вход в неё или выход (action - join или leave)
+    async def create_room_request(self, action):
+        room = await self.ask("Введите имя комнаты: ")
+        if not room.startswith(ROOM_PREFIX):
+            room = ROOM_PREFIX + room
+        if action == JOIN:
+            await self.connection.join(room)
+        else:
+            await self.connection.leave(room)
+        self.logger.info(f"Отправлен запрос {action} для комнаты {room}")
+
     # Функция взаимодействия с пользователем, запрашивает команды, отправляет сообщения
-    def user_interactive(self, sock, username):
+    async def user_interactive(self):
         self.print_help()
 
         while True:
-            command = input("Введите команду: ")
-            if command == "message":
-                self.create_message(sock, username)
-            elif command == "help":
-                self.print_help()
-
-            elif command == "exit":
-                send_message(sock, self.create_exit_message(username))
-                print("Завершение соединения.")
-                self.logger.info("Завершение работы по команде пользователя.")
-                # Задержка неоходима, чтобы успело уйти сообщение о выходе
-                time.sleep(0.5)
+            command = await self.ask("Введите команду: ")
+            try:
+                if command == "message":
+                    await self.create_message()
+                elif command == BATCH:
+                    await self.create_batch()
+                elif command in (JOIN, LEAVE):
+                    await self.create_room_request(command)
+                elif command == "latency":
+                    self.print_latency()
+                elif command == "help":
+                    self.print_help()
+
+                elif command == "exit":
+                    print("Завершение соединения.")
+                    self.logger.info("Завершение работы по команде пользователя.")
+                    break
+                else:
+                    print("Команда не распознана, попробуйте снова. help - вывести поддерживаемые команды.")
+            except (ConnectionError, OSError):
+                self.logger.critical("Потеряно соединение с сервером.")
                 break
-            else:
-                print("Команда не распознана, попробуйте снова. help - вывести поддерживаемые команды.")
 
-    @log
-    # Функция генерирует запрос о присутствии клиента
-    def create_presence(self):
-        out = {
-            ACTION: PRESENCE,
-            TIME: time.time(),
-            USER: {
-                ACCOUNT_NAME: self.name,
-            },
-        }
-        self.logger.debug(f"Сформировано {PRESENCE} сообщение для пользователя {self.name}")
-        return out
+    # Задержки полученных сообщений и, если сервер присылает подтверждения, своих отправленных
+    def print_latency(self):
+        if not self.connection.acks:
+            print("Сервер не присылает подтверждения: доступна только задержка полученных сообщений.")
+        for line in self.connection.latency.report() or ["Нет данных о задержках."]:
+            print(line)
 
-    @log
-    # Функция разбирает ответ сервера на сообщение о присутствии, возращает 200 если все ОК
-    # или генерирует исключение при ошибке.
-    def process_response_ans(self, message):
-        self.logger.debug(f"Разбор приветственного сообщения от сервера: {message}")
-        if RESPONSE in message:
-            if message[RESPONSE] == 200:
-                return "200 : OK"
-            elif message[RESPONSE] == 400:
-                raise ServerError(f"400 : {message[ERROR]}")
-        raise ReqFieldMissingError(RESPONSE)
-
-    @log
     # Функция - обработчик сообщений других пользователей, поступающих с сервера.
-    def message_from_server(self, sock, my_username):
+    async def message_from_server(self):
         while True:
             try:
-                message = get_message(sock)
-                if (
-                    ACTION in message
-                    and message[ACTION] == MESSAGE
-                    and SENDER in message
-                    and DESTINATION in message
-                    and MESSAGE_TEXT in message
-                    and message[DESTINATION] == my_username
-                ):
-                    print(f"\nПолучено сообщение от пользователя {message[SENDER]}:\n{message[MESSAGE_TEXT]}")
-                    self.logger.info(f"Получено сообщение от пользователя {message[SENDER]}:\n{message[MESSAGE_TEXT]}")
-                else:
-                    self.logger.error(f"Получено некорректное сообщение с сервера: {message}")
+                message = await self.connection.receive()
             except IncorrectDataRecivedError:
                 self.logger.error(f"Не удалось декодировать полученное сообщение.")
-            except (OSError, ConnectionError, ConnectionAbortedError, ConnectionResetError, json.JSONDecodeError):
+                continue
+            except (OSError, ConnectionError):
                 self.logger.critical(f"Потеряно соединение с сервером.")
                 break
+            if is_message(message) and message[DESTINATION] == self.name:
+                print(f"\nПолучено сообщение от пользователя {message[SENDER]}:\n{message[MESSAGE_TEXT]}")
+                self.logger.info(f"Получено сообщение от пользователя {message[SENDER]}:\n{message[MESSAGE_TEXT]}")
+            elif is_message(message) and is_room(message[DESTINATION]):
+                print(f"\n{message[DESTINATION]} {message[SENDER]}:\n{message[MESSAGE_TEXT]}")
+                self.logger.info(f"Получено сообщение в комнате {message[DESTINATION]} от {message[SENDER]}")
+            elif message.get(RESPONSE) == 400:
+                print(f"\nОшибка сервера: {message.get(ERROR)}")
+            elif message.get(RESPONSE) == 200:
+                self.logger.debug("Сервер подтвердил запрос.")
+            else:
+                self.logger.error(f"Получено некорректное сообщение с сервера: {message}")
 
 
 def parse_args():
@@ -195,13 +209,14 @@ def parse_args():
         "addr", nargs="?", type=str, default=DEFAULT_IP_ADDRESS, help="Server address [default=localhost]"
     )
     parser.add_argument("port", nargs="?", type=int, default=DEFAULT_PORT, help="Server port [default=7777]")
+    parser.add_argument("--acks", action="store_true", help="Request server acks with timestamps (latency command)")
     return parser
 
 
 def run():
-    args = parse_args()
+    args = parse_args().parse_args()
 
-    client = Client(args.addr, args.port)
+    client = Client(args.addr, args.port, None, args.acks)
     client.start()
 
 
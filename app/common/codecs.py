@@ -0,0 +1,202 @@
+import json
+import re
+
+from .errors import IncorrectDataRecivedError, MessageEncodeError, NonDictInputError
+from .variables import *
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Кодек сообщений: превращает словарь JIM в байты и обратно. Кодеки регистрируются в CODECS по имени,
+# имя передаётся в presence при согласовании.
+class Codec:
+    __slots__ = ()
+
+    name = None
+    # Кодек даёт произвольные байты (в том числе "\n" и без фигурных скобок), такие сообщения
+    # передаются только кадрами с префиксом длины
+    binary = False
+
+    # Ошибка кодирования значений сообщения - MessageEncodeError
+    def encode(self, message):
+        raise NotImplementedError
+
+    def decode(self, payload):
+        raise NotImplementedError
+
+    # Заголовок маршрутизации сообщения без полного разбора: (отправитель, получатель) для action=message,
+    # или None, если быстро его не прочитать - тогда сообщение разбирается целиком.
+    def route(self, payload):
+        return None
+
+
+class JsonCodec(Codec):
+    __slots__ = ()
+
+    name = CODEC_JSON
+
+    def encode(self, message):
+        if not isinstance(message, dict):
+            raise NonDictInputError
+        try:
+            return json.dumps(message).encode(ENCODING)
+        except (TypeError, ValueError) as ex:
+            raise MessageEncodeError from ex
+
+    def decode(self, payload):
+        message = json.loads(bytes(payload))
+        if not isinstance(message, dict):
+            raise IncorrectDataRecivedError
+        return message
+
+    # Понимает только сообщения, начинающиеся с action, from, to (так их формирует клиент). Имена с
+    # экранированными символами (не ASCII) не разбираются. Если ключ маршрутизации повторяется дальше
+    # в сообщении, json.loads получателя возьмёт последнее значение, поэтому такое сообщение разбирается целиком.
+    def route(self, payload):
+        match = JSON_ROUTE.match(payload)
+        if match is None or JSON_ROUTE_REPEAT.search(payload, match.end()) is not None:
+            return None
+        return match.group(1).decode("ascii"), match.group(2).decode("ascii")
+
+
+JSON_ROUTE = re.compile(
+    rb'\{\s*"action"\s*:\s*"message"\s*,\s*"from"\s*:\s*"([^"\\]*)"\s*,\s*"to"\s*:\s*"([^"\\]*)"'
+)
+# Повтор ключа action, from или to и экранированный печатный символ ASCII (\u0020-\u007e): json.dumps так
+# не пишет, а ключ можно записать экранированными символами. Совпадение внутри текста сообщения только
+# отправляет его на полный разбор.
+JSON_ROUTE_REPEAT = re.compile(rb'"(?:action|from|to)"|\\u00(?:[2-6][0-9a-fA-F]|7[0-9a-eA-E])')
+
+
+# Ключи JIM заменяются короткими целыми, остальные ключи передаются строками как есть
+PACKED_KEYS = {
+    ACTION: 0,
+    TIME: 1,
+    SENDER: 2,
+    DESTINATION: 3,
+    MESSAGE_TEXT: 4,
+    USER: 5,
+    ACCOUNT_NAME: 6,
+    RESPONSE: 7,
+    ERROR: 8,
+    ROOM: 9,
+}
+UNPACKED_KEYS = {number: key for key, number in PACKED_KEYS.items()}
+
+
+# MessagePack с целыми ключами. Вложенные словари (user) упаковываются так же.
+class MsgpackCodec(Codec):
+    __slots__ = ()
+
+    name = CODEC_MSGPACK
+    binary = True
+
+    def encode(self, message):
+        if not isinstance(message, dict):
+            raise NonDictInputError
+        try:
+            return msgpack.packb(pack_keys(message), use_bin_type=True)
+        except (TypeError, ValueError, OverflowError) as ex:
+            raise MessageEncodeError from ex
+
+    def decode(self, payload):
+        try:
+            message = msgpack.unpackb(payload, raw=False, strict_map_key=False)
+        except (ValueError, msgpack.UnpackException) as ex:
+            raise IncorrectDataRecivedError from ex
+        if not isinstance(message, dict):
+            raise IncorrectDataRecivedError
+        return unpack_keys(message)
+
+    # Заголовок: словарь, первыми ключами в котором идут action="message", from и to. Имена длиннее
+    # 31 байта (не fixstr) быстрым путём не разбираются. Как и у JSON, сообщение с повтором ключа
+    # маршрутизации в остальной части словаря разбирается целиком.
+    def route(self, payload):
+        match = MSGPACK_ROUTE.match(payload)
+        if match is None or payload[0] & 0x0F < 3:
+            return None
+        start = match.end()
+        end = start + (payload[start - 1] & 0x1F)
+        # за отправителем - ключ to и строка получателя
+        header = payload[end : end + 2]
+        if len(header) < 2 or header[0] != PACKED_KEYS[DESTINATION] or header[1] & 0xE0 != 0xA0:
+            return None
+        stop = end + 2 + (header[1] & 0x1F)
+        if stop > len(payload) or not self.unique_route(payload[stop:], (payload[0] & 0x0F) - 3):
+            return None
+        try:
+            return str(payload[start:end], ENCODING), str(payload[end + 2 : stop], ENCODING)
+        except UnicodeDecodeError:
+            return None
+
+    # Остальные count пар словаря: ключи читаются, значения пропускаются без создания объектов. Ключ
+    # action, from или to (целым или строкой) или данные после словаря - маршрут быстрым путём не читается.
+    @staticmethod
+    def unique_route(rest, count):
+        unpacker = msgpack.Unpacker(raw=False, strict_map_key=False)
+        unpacker.feed(rest)
+        try:
+            for _ in range(count):
+                key = unpacker.unpack()
+                if UNPACKED_KEYS.get(key, key) in (ACTION, SENDER, DESTINATION):
+                    return False
+                unpacker.skip()
+        except Exception:
+            return False
+        return unpacker.tell() == len(rest)
+
+
+# Начало упакованного сообщения: маркер словаря, action, "message", from и маркер строки отправителя
+MSGPACK_ROUTE = re.compile(
+    rb"[\x80-\x8f]"
+    + re.escape(bytes([PACKED_KEYS[ACTION], 0xA0 | len(MESSAGE)]) + MESSAGE.encode() + bytes([PACKED_KEYS[SENDER]]))
+    + rb"[\xa0-\xbf]",
+    re.DOTALL,
+)
+
+
+def pack_keys(message):
+    return {
+        PACKED_KEYS.get(key, key): pack_keys(value) if isinstance(value, dict) else value
+        for key, value in message.items()
+    }
+
+
+def unpack_keys(message):
+    return {
+        UNPACKED_KEYS.get(key, key): unpack_keys(value) if isinstance(value, dict) else value
+        for key, value in message.items()
+    }
+
+
+# Реестр кодеков по имени
+CODECS = dict()
+
+
+def register_codec(codec):
+    CODECS[codec.name] = codec
+    return codec
+
+
+def get_codec(name):
+    return CODECS.get(name, CODECS[CODEC_JSON])
+
+
+# Выбор кодека по списку, предложенному клиентом: первый известный серверу. Двоичные кодеки допустимы только
+# с кадрами с префиксом длины. Старые клиенты ничего не предлагают и остаются на JSON.
+def choose_codec(offered, framing):
+    if isinstance(offered, (list, tuple)):
+        for name in offered:
+            codec = CODECS.get(name)
+            if codec is not None and (not codec.binary or framing == FRAMING_LENGTH):
+                return name
+    return CODEC_JSON
+
+
+JSON_CODEC = register_codec(JsonCodec())
+# Без пакета msgpack двоичный кодек не регистрируется, клиенты согласуют JSON
+if msgpack is not None:
+    register_codec(MsgpackCodec())
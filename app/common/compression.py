@@ -0,0 +1,114 @@
+import time
+import zlib
+
+from .errors import IncorrectDataRecivedError
+from .variables import *
+
+# Старший бит префикса длины - признак сжатого кадра (длина кадра не больше MAX_FRAME_LENGTH, бит свободен)
+COMPRESSED_FLAG = 0x80000000
+LENGTH_MASK = COMPRESSED_FLAG - 1
+# Сырой deflate без заголовка и контрольной суммы zlib
+WBITS = -15
+PREFIX_SIZE = 4
+
+
+# Выбор сжатия по списку, предложенному клиентом: первый известный серверу режим. Признак сжатия живёт
+# в префиксе длины, поэтому сжатие возможно только с кадрами length. None - без сжатия.
+def choose_compression(offered, framing):
+    if framing != FRAMING_LENGTH or not isinstance(offered, (list, tuple)):
+        return None
+    for mode in offered:
+        if mode in COMPRESSIONS:
+            return mode
+    return None
+
+
+# Сжатие исходящих кадров одного соединения. Кадры короче порога уходят как есть.
+# deflate - каждый кадр сжимается отдельно, deflate-stream - общий контекст сжатия на соединение
+# (повторы между сообщениями тоже сжимаются), кадр завершается Z_SYNC_FLUSH.
+# Счётчики: сколько кадров сжато, байт до и после сжатия, время процессора на сжатие.
+class FrameCompressor:
+    __slots__ = ("mode", "threshold", "level", "context", "frames", "bytes_in", "bytes_out", "cpu_ns")
+
+    def __init__(self, mode, threshold=COMPRESSION_THRESHOLD, level=COMPRESSION_LEVEL):
+        self.mode = mode
+        self.threshold = threshold
+        self.level = level
+        self.context = zlib.compressobj(level, zlib.DEFLATED, WBITS) if mode == COMPRESSION_DEFLATE_STREAM else None
+        self.frames = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_ns = 0
+
+    # Принимает кадр с префиксом длины и возвращает его сжатым или без изменений.
+    # Отдельно сжимаемый кадр, который не стал короче, уходит несжатым. cache - словарь уровень -> результат
+    # на время рассылки одного кадра многим получателям (в комнату): кадр сжимается один раз на уровень.
+    def compress_frame(self, frame, cache=None):
+        size = len(frame) - PREFIX_SIZE
+        if size < self.threshold:
+            return frame
+        data = cache.get(self.level) if cache is not None and self.context is None else None
+        if data is None:
+            start = time.process_time_ns()
+            payload = memoryview(frame)[PREFIX_SIZE:]
+            if self.context is None:
+                context = zlib.compressobj(self.level, zlib.DEFLATED, WBITS)
+                data = context.compress(payload) + context.flush()
+            else:
+                data = self.context.compress(payload) + self.context.flush(zlib.Z_SYNC_FLUSH)
+            if self.context is None and len(data) >= size:
+                data = frame
+            else:
+                data = (len(data) | COMPRESSED_FLAG).to_bytes(PREFIX_SIZE, "big") + data
+            self.cpu_ns += time.process_time_ns() - start
+            if cache is not None and self.context is None:
+                cache[self.level] = data
+        if data is frame:
+            return frame
+        self.frames += 1
+        self.bytes_in += size
+        self.bytes_out += len(data) - PREFIX_SIZE
+        return data
+
+    # Во сколько раз уменьшились сжатые кадры
+    @property
+    def ratio(self):
+        return self.bytes_in / self.bytes_out if self.bytes_out else 1.0
+
+
+# Распаковка входящих кадров. Для deflate-stream контекст общий на соединение.
+class FrameDecompressor:
+    __slots__ = ("mode", "max_length", "context", "frames", "bytes_in", "bytes_out", "cpu_ns")
+
+    def __init__(self, mode, max_length=MAX_FRAME_LENGTH):
+        self.mode = mode
+        self.max_length = max_length
+        self.context = zlib.decompressobj(WBITS) if mode == COMPRESSION_DEFLATE_STREAM else None
+        self.frames = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_ns = 0
+
+    def decompress(self, data):
+        start = time.process_time_ns()
+        context = self.context if self.context is not None else zlib.decompressobj(WBITS)
+        try:
+            payload = context.decompress(data, self.max_length + 1)
+        except zlib.error as ex:
+            raise IncorrectDataRecivedError from ex
+        # Защита от "zip-бомбы": распакованное сообщение не больше максимального кадра
+        if len(payload) > self.max_length or context.unconsumed_tail:
+            raise IncorrectDataRecivedError
+        self.cpu_ns += time.process_time_ns() - start
+        self.frames += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(payload)
+        return payload
+
+
+def create_compressor(mode, threshold=COMPRESSION_THRESHOLD):
+    return FrameCompressor(mode, threshold) if mode in COMPRESSIONS else None
+
+
+def create_decompressor(mode):
+    return FrameDecompressor(mode) if mode in COMPRESSIONS else None
@@ -1,29 +1,10 @@
 import json
-import sys
-
-import app.logs.config_client_log as srv_log
-import app.logs.config_server_log as cli_log
 
 from .errors import ReqFieldMissingError, ServerError
+from .tracing import trace
 
-# метод определения модуля, источника запуска.
-if sys.argv[0].find("client") == -1:
-    # если не клиент то сервер!
-    logger = srv_log.logger
-else:
-    # ну, раз не сервер, то клиент
-    logger = cli_log.logger
-
-
-def log(func_to_log):
-    def log_saver(*args, **kwargs):
-        logger.debug(
-            f"Была вызвана функция {func_to_log.__name__} c параметрами {args} , {kwargs}. Вызов из модуля {func_to_log.__module__}"
-        )
-        ret = func_to_log(*args, **kwargs)
-        return ret
-
-    return log_saver
+# Трассировка вызова в лог (DEBUG): формирование записи - только если уровень включён (app.common.tracing)
+log = trace()
 
 
 def try_except_wrapper(func):
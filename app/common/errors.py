@@ -19,6 +19,13 @@ class NonDictInputError(Exception):
         return "Аргумент функции должен быть словарём."
 
 
+# Исключение - сообщение нельзя закодировать кодеком получателя (например, строка с одиночным суррогатом
+# для MessagePack или двоичные данные для JSON)
+class MessageEncodeError(Exception):
+    def __str__(self):
+        return "Сообщение не может быть закодировано."
+
+
 # Ошибка - отсутствует обязательное поле в принятом словаре.
 class ReqFieldMissingError(Exception):
     def __init__(self, missing_field):
@@ -0,0 +1,271 @@
+import re
+import struct
+
+from .codecs import JSON_CODEC
+from .compression import COMPRESSED_FLAG, LENGTH_MASK
+from .errors import IncorrectDataRecivedError
+from .variables import *
+
+# Префикс длины кадра: 4 байта, сетевой порядок
+LENGTH_PREFIX = struct.Struct("!I")
+
+
+# Упаковка уже закодированного сообщения в кадр выбранного формата
+def encode_frame(payload, framing=FRAMING_LEGACY):
+    if framing == FRAMING_LENGTH:
+        return LENGTH_PREFIX.pack(len(payload)) + payload
+    if framing == FRAMING_NEWLINE:
+        return payload + b"\n"
+    return payload
+
+
+# Выбор формата кадров по списку, предложенному клиентом. Берётся первый поддерживаемый,
+# если клиент ничего не предложил (старый клиент) - legacy.
+def choose_framing(offered):
+    if isinstance(offered, (list, tuple)):
+        for framing in offered:
+            if framing in FRAMINGS:
+                return framing
+    return FRAMING_LEGACY
+
+
+# Потоковый разборщик кадров одного соединения. Копит принятые блоки и отдаёт все целиком пришедшие сообщения,
+# неполный хвост ждёт следующего feed. Формат можно сменить между сообщениями (после согласования в presence),
+# остаток буфера будет разобран уже по новому формату.
+class FrameDecoder:
+    __slots__ = (
+        "framing",
+        "codec",
+        "decompressor",
+        "max_length",
+        "_buffer",
+        "_pos",
+        "_chunks",
+        "_size",
+        "_scanned",
+        "_legacy",
+        "_length",
+    )
+
+    def __init__(self, framing=FRAMING_LEGACY, max_length=MAX_FRAME_LENGTH, codec=JSON_CODEC):
+        self.framing = framing
+        # Кодек сообщений (app.common.codecs), как и формат кадров, меняется после ответа на presence
+        self.codec = codec
+        # Распаковка сжатых кадров (FrameDecompressor), если сжатие согласовано
+        self.decompressor = None
+        self.max_length = max_length
+        # Текущий неизменяемый буфер и позиция разбора в нём. Кадры отдаются срезами memoryview без копирования.
+        self._buffer = b""
+        self._pos = 0
+        # Блоки, пришедшие после последней склейки, и их суммарный размер
+        self._chunks = []
+        self._size = 0
+        # Сколько блоков из _chunks уже проверено на наличие перевода строки (или просканировано в legacy)
+        self._scanned = 0
+        # Состояние сканирования недошедшего legacy-объекта (глубина, внутри строки, экранирование) или None,
+        # и сколько байт объекта уже просканировано
+        self._legacy = None
+        self._length = 0
+
+    def feed(self, data):
+        if data:
+            self._chunks.append(data)
+            self._size += len(data)
+
+    @property
+    def buffered(self):
+        return len(self._buffer) - self._pos + self._size
+
+    def __iter__(self):
+        while True:
+            message = self.next_message()
+            if message is None:
+                return
+            yield message
+
+    # Следующее целиком принятое сообщение или None, если данных пока недостаточно
+    def next_message(self):
+        if self.framing == FRAMING_LEGACY:
+            return self._next_legacy()
+        payload = self.next_payload()
+        if payload is None:
+            return None
+        return self.decode(payload)
+
+    # Все целиком принятые сообщения. route(frame, payload) получает кадр до декодирования, и если вернёт True,
+    # кадр считается обработанным (пересылка без разбора), иначе сообщение декодируется как обычно.
+    # В формате legacy границы кадра известны только после разбора, поэтому route не вызывается.
+    def messages(self, route=None):
+        if self.framing == FRAMING_LEGACY or route is None:
+            yield from self
+            return
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            payload = self.payload(frame)
+            if not route(frame, payload):
+                yield self.decode(payload)
+
+    # Блокирующее чтение одного сообщения из сокета, лишние принятые сообщения остаются в буфере
+    def read_message(self, sock):
+        message = self.next_message()
+        while message is None:
+            data = sock.recv(READ_CHUNK_SIZE)
+            if not data:
+                raise ConnectionResetError
+            self.feed(data)
+            message = self.next_message()
+        return message
+
+    def decode(self, payload):
+        return self.codec.decode(payload)
+
+    # Полезная нагрузка следующего кадра (memoryview) для форматов length/newline
+    def next_payload(self):
+        frame = self.next_frame()
+        if frame is None:
+            return None
+        return self.payload(frame)
+
+    # Следующий кадр целиком, вместе с префиксом длины или переводом строки (memoryview без копирования).
+    # Сжатый кадр возвращается уже распакованным, с обычным префиксом длины.
+    def next_frame(self):
+        if self.framing == FRAMING_LENGTH:
+            return self._next_length()
+        return self._next_line()
+
+    # Полезная нагрузка кадра, полученного из next_frame
+    def payload(self, frame):
+        if self.framing == FRAMING_LENGTH:
+            return frame[LENGTH_PREFIX.size :]
+        return frame[:-1]
+
+    def _merge(self):
+        if not self._chunks:
+            return
+        if self._pos < len(self._buffer):
+            self._chunks.insert(0, self._buffer[self._pos :])
+        self._buffer = self._chunks[0] if len(self._chunks) == 1 else b"".join(self._chunks)
+        self._pos = 0
+        self._chunks = []
+        self._size = 0
+        self._scanned = 0
+
+    def _next_length(self):
+        if self.buffered < LENGTH_PREFIX.size:
+            return None
+        if len(self._buffer) - self._pos < LENGTH_PREFIX.size:
+            self._merge()
+        (length,) = LENGTH_PREFIX.unpack_from(self._buffer, self._pos)
+        compressed = self.decompressor is not None and length & COMPRESSED_FLAG
+        if compressed:
+            length &= LENGTH_MASK
+        if length > self.max_length:
+            raise IncorrectDataRecivedError
+        start = self._pos + LENGTH_PREFIX.size
+        end = start + length
+        if end > len(self._buffer):
+            # Склеиваем только когда кадр пришёл целиком, так большой кадр копируется один раз
+            if self.buffered < LENGTH_PREFIX.size + length:
+                return None
+            self._merge()
+            end = LENGTH_PREFIX.size + length
+        frame = memoryview(self._buffer)[self._pos : end]
+        self._pos = end
+        if compressed:
+            payload = self.decompressor.decompress(frame[LENGTH_PREFIX.size :])
+            return memoryview(LENGTH_PREFIX.pack(len(payload)) + payload)
+        return frame
+
+    def _next_line(self):
+        end = self._buffer.find(b"\n", self._pos)
+        if end < 0:
+            while self._scanned < len(self._chunks):
+                if b"\n" in self._chunks[self._scanned]:
+                    break
+                self._scanned += 1
+            else:
+                if self.buffered > self.max_length:
+                    raise IncorrectDataRecivedError
+                return None
+            self._merge()
+            end = self._buffer.find(b"\n")
+        if end - self._pos > self.max_length:
+            raise IncorrectDataRecivedError
+        start = self._pos
+        self._pos = end + 1
+        return memoryview(self._buffer)[start : end + 1]
+
+    # Старый формат: JSON-объекты идут подряд без разделителей, склеенные сообщения разбираются по очереди.
+    # Недошедший объект не склеивается при каждом feed: новые блоки сканируются по одному с сохранённым
+    # состоянием, склейка - один раз, когда объект пришёл целиком.
+    def _next_legacy(self):
+        if self._legacy is None:
+            self._merge()
+            buffer = self._buffer
+            start = self._pos
+            while start < len(buffer) and buffer[start] in b" \t\r\n":
+                start += 1
+            if start >= len(buffer):
+                self._buffer, self._pos = b"", 0
+                return None
+            if buffer[start] != 0x7B:
+                raise IncorrectDataRecivedError
+            self._pos = start
+            end, *state = _legacy_scan(buffer, start, 0, False, False)
+            if end >= 0:
+                return self._legacy_object(end - start)
+            self._legacy = state
+            self._length = len(buffer) - start
+        while self._scanned < len(self._chunks):
+            chunk = self._chunks[self._scanned]
+            end, *state = _legacy_scan(chunk, 0, *self._legacy)
+            if end >= 0:
+                length = self._length + end
+                self._legacy = None
+                self._merge()
+                return self._legacy_object(length)
+            self._legacy = state
+            self._length += len(chunk)
+            self._scanned += 1
+        # Объект ещё не дошёл целиком
+        if self._length > self.max_length:
+            raise IncorrectDataRecivedError
+        return None
+
+    def _legacy_object(self, length):
+        if length > self.max_length:
+            raise IncorrectDataRecivedError
+        start = self._pos
+        self._pos = start + length
+        return self.decode(self._buffer[start : self._pos])
+
+
+_LEGACY_TOKENS = re.compile(rb'[{}"\\]')
+
+
+# Сканирование JSON-объекта в buffer с позиции start, продолжая с состояния (depth, in_string, escape)
+# предыдущего блока. Возвращает (конец объекта или -1, depth, in_string, escape) - состояние для следующего блока.
+# Байты многобайтовых символов UTF-8 не совпадают со скобками и кавычками, поэтому хватает сканирования байт.
+def _legacy_scan(buffer, start, depth, in_string, escape):
+    skip = start + 1 if escape else -1
+    for match in _LEGACY_TOKENS.finditer(buffer, start):
+        pos = match.start()
+        if pos < skip:
+            continue
+        char = buffer[pos]
+        if in_string:
+            if char == 0x5C:
+                skip = pos + 2
+            elif char == 0x22:
+                in_string = False
+        elif char == 0x22:
+            in_string = True
+        elif char == 0x7B:
+            depth += 1
+        elif char == 0x7D:
+            depth -= 1
+            if depth == 0:
+                return pos + 1, 0, False, False
+    return -1, depth, in_string, skip > len(buffer)
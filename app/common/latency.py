@@ -0,0 +1,54 @@
+import time
+
+from .metrics import HdrHistogram
+from .variables import *
+
+# Участки пути сообщения. Первые два считаются по отметкам сервера в подтверждении и зависят от расхождения
+# часов клиента и сервера, подтверждение туда и обратно - только по часам отправителя, доставку считает
+# получатель по time отправителя.
+HOP_UPLINK = "клиент -> сервер"
+HOP_SERVER = "сервер: приём -> очередь получателя"
+HOP_ACK = "отправка -> подтверждение"
+HOP_DELIVERY = "отправитель -> получатель"
+HOPS = (HOP_UPLINK, HOP_SERVER, HOP_ACK, HOP_DELIVERY)
+
+QUANTILES = ((0.5, "p50"), (0.99, "p99"), (0.999, "p999"))
+
+
+# Задержки сообщений по участкам пути: гистограммы HdrHistogram, заполняются потоком приёма клиента
+class LatencyTracker:
+    __slots__ = ("hops",)
+
+    def __init__(self):
+        self.hops = {hop: HdrHistogram() for hop in HOPS}
+
+    # Подтверждение сервера на своё сообщение
+    def record_ack(self, ack, now=None):
+        now = time.time() if now is None else now
+        sent, received, dispatched = ack.get(TIME), ack.get(RECEIVED), ack.get(DISPATCHED)
+        if not all(isinstance(stamp, (int, float)) for stamp in (sent, received, dispatched)):
+            return
+        self.hops[HOP_UPLINK].record(received - sent)
+        self.hops[HOP_SERVER].record(dispatched - received)
+        self.hops[HOP_ACK].record(now - sent)
+
+    # Сообщение от другого пользователя
+    def record_delivery(self, message, now=None):
+        now = time.time() if now is None else now
+        if isinstance(message.get(TIME), (int, float)):
+            self.hops[HOP_DELIVERY].record(now - message[TIME])
+
+    def clear(self):
+        for hop in HOPS:
+            self.hops[hop] = HdrHistogram()
+
+    # Строки отчёта: число сообщений и квантили по каждому участку, миллисекунды
+    def report(self):
+        lines = []
+        for hop in HOPS:
+            histogram = self.hops[hop]
+            if not histogram.total:
+                continue
+            quantiles = ", ".join(f"{title} {histogram.quantile(q) * 1000:.3f}" for q, title in QUANTILES)
+            lines.append(f"{hop}: {histogram.total} сообщ., {quantiles}, max {histogram.max / 1000:.3f} мс")
+        return lines
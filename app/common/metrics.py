@@ -0,0 +1,259 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .variables import *
+
+# Границы корзин гистограмм времени по умолчанию, секунды
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# Сколько старших бит значения сохраняет корзина HdrHistogram
+HDR_SIGNIFICANT_BITS = 7
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# Счётчик: только растёт. Увеличение - одно сложение без блокировок; метрики пишет в основном цикл сервера,
+# редкие потерянные из-за гонки потоков единицы для статистики не важны.
+class Counter:
+    __slots__ = ("value",)
+
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def collect(self):
+        return self.value
+
+
+# Текущее значение: задаётся set или вычисляется функцией func в момент чтения метрик (размер очереди,
+# число соединений) - тогда на горячем пути ничего не делается
+class Gauge:
+    __slots__ = ("value", "func")
+
+    kind = "gauge"
+
+    def __init__(self, func=None):
+        self.value = 0
+        self.func = func
+
+    def set(self, value):
+        self.value = value
+
+    def collect(self):
+        return self.func() if self.func is not None else self.value
+
+
+# Гистограмма с фиксированными корзинами: наблюдение - двоичный поиск корзины и два сложения.
+# Накопленные суммы по корзинам считаются только при чтении.
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    kind = "histogram"
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    # Накопленные счётчики по границам (последняя - +Inf), сумма и число наблюдений
+    def collect(self):
+        cumulative, total = [], 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative, self.sum, total
+
+    # Оценка квантиля по корзинам: верхняя граница корзины, в которую он попал
+    def quantile(self, q):
+        cumulative, _, total = self.collect()
+        if not total:
+            return 0.0
+        for bound, count in zip(self.bounds, cumulative):
+            if count >= q * total:
+                return bound
+        return float("inf")
+
+
+# Гистограмма задержек в духе HdrHistogram: значение в микросекундах попадает в корзину, где сохранены его
+# старшие HDR_SIGNIFICANT_BITS бит, так что квантиль отличается от точного не больше чем на 1/64 при любом
+# масштабе - от микросекунд до минут. Корзины в словаре по нижней границе, сортируются только при чтении.
+class HdrHistogram:
+    __slots__ = ("counts", "total", "max")
+
+    def __init__(self):
+        self.counts = dict()
+        self.total = 0
+        self.max = 0
+
+    # Значение в секундах; отрицательное (расхождение часов) считается нулём
+    def record(self, seconds):
+        value = max(int(seconds * 1000000), 0)
+        shift = max(value.bit_length() - HDR_SIGNIFICANT_BITS, 0)
+        key = value >> shift << shift
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.total += 1
+        if value > self.max:
+            self.max = value
+
+    # Квантиль (q от 0 до 1) в секундах: верхняя граница корзины, но не больше наибольшего значения
+    def quantile(self, q):
+        if not self.total:
+            return 0.0
+        rank, seen = q * self.total, 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                shift = max(key.bit_length() - HDR_SIGNIFICANT_BITS, 0)
+                return min(key + (1 << shift) - 1, self.max) / 1000000
+        return self.max / 1000000
+
+
+# Гистограмма с заданными границами для реестра
+class HistogramFactory:
+    __slots__ = ("bounds",)
+
+    kind = "histogram"
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+
+    def __call__(self):
+        return Histogram(self.bounds)
+
+
+# Реестр метрик процесса. Метрика задаётся именем и метками; повторный запрос с теми же именем и метками
+# возвращает ту же метрику, так что модули получают свои метрики при импорте.
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # имя -> (тип, описание, {метки: метрика})
+        self.families = dict()
+
+    def metric(self, factory, name, help_text, labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = (factory.kind, help_text, dict())
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = factory()
+            return metric
+
+    def counter(self, name, help_text, **labels):
+        return self.metric(Counter, name, help_text, labels)
+
+    def histogram(self, name, help_text, bounds=LATENCY_BUCKETS, **labels):
+        return self.metric(HistogramFactory(bounds), name, help_text, labels)
+
+    # Метрика-функция заменяет прежнюю с тем же именем: её значение берётся у последнего созданного сервера
+    def gauge(self, name, help_text, func=None, **labels):
+        gauge = self.metric(Gauge, name, help_text, labels)
+        if func is not None:
+            gauge.func = func
+        return gauge
+
+    # Все значения: (имя, тип, описание, метки, значение)
+    def collect(self):
+        with self.lock:
+            families = [
+                (name, kind, help_text, list(series.items()))
+                for name, (kind, help_text, series) in self.families.items()
+            ]
+        for name, kind, help_text, series in families:
+            for labels, metric in series:
+                yield name, kind, help_text, labels, metric
+
+    # Текстовый формат Prometheus (exposition format 0.0.4)
+    def render(self):
+        lines = []
+        described = set()
+        for name, kind, help_text, labels, metric in self.collect():
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                lines.append(f"{name}{format_labels(labels)} {format_value(metric.collect())}")
+                continue
+            cumulative, total_sum, count = metric.collect()
+            for bound, value in zip(metric.bounds + (float("inf"),), cumulative):
+                bucket_labels = labels + (("le", format_value(bound)),)
+                lines.append(f"{name}_bucket{format_labels(bucket_labels)} {value}")
+            lines.append(f"{name}_sum{format_labels(labels)} {format_value(total_sum)}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+REGISTRY = Registry()
+
+
+# Время выполнения блока в гистограмму: with timed(histogram): ...
+class timed:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode(ENCODING)
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Запросы сборщика метрик в лог сервера не пишутся
+    def log_message(self, format, *args):
+        pass
+
+
+# HTTP-сервер метрик в фоновом потоке: GET /metrics отдаёт реестр в формате Prometheus
+def start_metrics_server(port, addr=METRICS_ADDR, registry=REGISTRY):
+    handler = type("RegistryMetricsHandler", (MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,135 @@
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+
+from .variables import *
+
+
+# Функция по объекту кода: файл:строка(имя), как в отчётах pstats
+def location(code):
+    return f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+
+
+# Выборочный профилировщик: фоновый поток раз в interval секунд читает текущий стек потока thread_id
+# (sys._current_frames). В профилируемый поток ничего не встраивается, он работает с обычной скоростью.
+class SamplingProfiler:
+    kind = PROFILER_SAMPLE
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        # Сколько выборок функция была на вершине стека и сколько - где-то в стеке
+        self.own = Counter()
+        self.total = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.own[location(frame.f_code)] += 1
+            # Рекурсивная функция в одной выборке считается один раз
+            seen = set()
+            while frame is not None:
+                key = location(frame.f_code)
+                if key not in seen:
+                    seen.add(key)
+                    self.total[key] += 1
+                frame = frame.f_back
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def report(self, top=PROFILE_TOP):
+        samples = max(self.samples, 1)
+        lines = [
+            f"Выборок: {self.samples}, интервал {self.interval * 1000:g} мс",
+            "  своё   всего  функция (доля выборок, %)",
+        ]
+        for key, count in self.own.most_common(top):
+            lines.append(f"{count / samples * 100:6.1f} {self.total[key] / samples * 100:6.1f}  {key}")
+        return lines
+
+
+# Детерминированный профилировщик cProfile. Включается и выключается только в профилируемом потоке:
+# sys.setprofile действует на поток, из которого вызван.
+class CallProfiler:
+    kind = PROFILER_CPROFILE
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def report(self, top=PROFILE_TOP):
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats(pstats.SortKey.TIME).print_stats(top)
+        return [line for line in stream.getvalue().splitlines() if line.strip()]
+
+
+# Снимки распределения памяти tracemalloc и разница с предыдущим снимком по строкам кода. Пока трассировка
+# выключена, выделения памяти не замедляются.
+class MemoryTracer:
+    def __init__(self, frames=TRACEMALLOC_FRAMES):
+        self.frames = frames
+        self.snapshot = None
+
+    @property
+    def running(self):
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        tracemalloc.start(self.frames)
+        self.snapshot = self.take_snapshot()
+
+    # Служебные выделения самого tracemalloc и импорта модулей в отчёт не попадают
+    def take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            )
+        )
+
+    # Новый снимок: места выделения с наибольшим ростом памяти с прошлого снимка
+    def diff(self, top=PROFILE_TOP):
+        snapshot = self.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Отслеживается {current / 1024:.0f} КиБ, максимум {peak / 1024:.0f} КиБ. Рост с прошлого снимка:"]
+        for stat in snapshot.compare_to(self.snapshot, "lineno")[:top]:
+            lines.append(str(stat))
+        self.snapshot = snapshot
+        return lines
+
+    def stop(self):
+        tracemalloc.stop()
+        self.snapshot = None
+
+
+# Отчёт в файл каталога PROFILE_DIR, имя - вид отчёта и время. Возвращает путь к файлу.
+def dump_report(kind, lines, directory=PROFILE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{kind}-{datetime.datetime.now():%Y%m%d-%H%M%S}.txt")
+    with open(path, "w", encoding=ENCODING) as file:
+        file.write("\n".join(lines) + "\n")
+    return path
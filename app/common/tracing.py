@@ -0,0 +1,67 @@
+import itertools
+import logging
+import sys
+from functools import wraps
+
+import app.logs.config_client_log as client_log
+import app.logs.config_server_log as server_log
+
+from .variables import *
+
+# Логгер трассировки по умолчанию: клиентский, если запущен клиент, иначе серверный
+default_logger = client_log.logger if sys.argv[0].find("client") != -1 else server_log.logger
+
+# Аргументы в трассировке обрезаются до ARG_REPR_LIMIT символов: сообщения и сокеты не выводятся целиком
+ARG_REPR_LIMIT = 80
+
+
+def short_repr(value):
+    text = repr(value)
+    return text if len(text) <= ARG_REPR_LIMIT else text[: ARG_REPR_LIMIT - 3] + "..."
+
+
+# Аргументы вызова для записи лога. Строка собирается, только когда обработчик форматирует запись.
+class CallArgs:
+    __slots__ = ("args", "kwargs")
+
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        parts = [short_repr(arg) for arg in self.args]
+        parts.extend(f"{key}={short_repr(value)}" for key, value in self.kwargs.items())
+        return ", ".join(parts)
+
+
+# Декоратор трассировки вызовов. В режиме TRACE_MODE = off (переменная окружения JIM_TRACE) или при sample = 0
+# функция возвращается без обёртки и вызов ничего не стоит. Иначе обёртка сначала проверяет isEnabledFor
+# и выборку - записывается каждый 1 / sample вызов, - и только потом создаёт запись лога.
+def trace(sample=1.0, level=logging.DEBUG, logger=None):
+    def decorator(func):
+        if TRACE_MODE == TRACE_OFF or sample <= 0:
+            return func
+        log = logger or default_logger
+        period = max(round(1 / sample), 1)
+        calls = itertools.count()
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        if period == 1:
+
+            @wraps(func)
+            def traced(*args, **kwargs):
+                if log.isEnabledFor(level):
+                    log.log(level, "Вызов %s(%s)", name, CallArgs(args, kwargs))
+                return func(*args, **kwargs)
+
+        else:
+
+            @wraps(func)
+            def traced(*args, **kwargs):
+                if log.isEnabledFor(level) and not next(calls) % period:
+                    log.log(level, "Вызов %s(%s), каждый %d-й", name, CallArgs(args, kwargs), period)
+                return func(*args, **kwargs)
+
+        return traced
+
+    return decorator
@@ -1,18 +1,36 @@
+import datetime
 import json
 import sys
 
-from .errors import IncorrectDataRecivedError, NonDictInputError
+from .errors import IncorrectDataRecivedError
 
 sys.path.append("../")
-from .decos import log
+from .codecs import JSON_CODEC
+from .framing import encode_frame
+from .metrics import REGISTRY
+from .tracing import trace
 from .variables import *
 
+# Счётчики вызовов приёма и отправки сообщений (app.common.metrics)
+GET_MESSAGE_CALLS = REGISTRY.counter("jim_get_message_total", "get_message calls")
+SEND_MESSAGE_CALLS = REGISTRY.counter("jim_send_message_total", "send_message calls")
+
 
 # Утилита приёма и декодирования сообщения
-# принимает байты выдаёт словарь, если приняточто-то другое отдаёт ошибку значения
-@log
-def get_message(client):
+# принимает байты выдаёт словарь, если приняточто-то другое отдаёт ошибку значения.
+# С разборщиком кадров (FrameDecoder соединения) читает блоками и отдаёт по одному сообщению,
+# остальные принятые сообщения остаются в разборщике до следующего вызова.
+@trace(sample=TRACE_IO_SAMPLE)
+def get_message(client, decoder=None):
+    GET_MESSAGE_CALLS.inc()
+    if decoder is not None:
+        return decoder.read_message(client)
     encoded_response = client.recv(MAX_PACKAGE_LENGTH)
+    return decode_message(encoded_response)
+
+
+# Декодирование уже принятых байт в словарь, используется и там, где чтение из сокета делает не get_message
+def decode_message(encoded_response):
     if isinstance(encoded_response, bytes):
         json_response = encoded_response.decode(ENCODING)
         response = json.loads(json_response)
@@ -25,11 +43,45 @@ def get_message(client):
 
 
 # Утилита кодирования и отправки сообщения
-# принимает словарь и отправляет его
-@log
-def send_message(sock, message):
-    if not isinstance(message, dict):
-        raise NonDictInputError
-    js_message = json.dumps(message)
-    encoded_message = js_message.encode(ENCODING)
-    sock.send(encoded_message)
+# принимает словарь и отправляет его согласованным кодеком в кадре согласованного формата,
+# со сжатием, если передан compressor (FrameCompressor)
+@trace(sample=TRACE_IO_SAMPLE)
+def send_message(sock, message, framing=FRAMING_LEGACY, codec=JSON_CODEC, compressor=None):
+    SEND_MESSAGE_CALLS.inc()
+    frame = encode_message(message, framing, codec)
+    if compressor is not None:
+        frame = compressor.compress_frame(frame)
+    sock.send(frame)
+
+
+# Кодирование словаря в готовый к отправке кадр
+def encode_message(message, framing=FRAMING_LEGACY, codec=JSON_CODEC):
+    return encode_frame(dump_message(message, codec), framing)
+
+
+# Сообщение пользователю или в комнату со всеми обязательными полями
+def is_message(message):
+    return (
+        isinstance(message, dict)
+        and message.get(ACTION) == MESSAGE
+        and DESTINATION in message
+        and TIME in message
+        and SENDER in message
+        and MESSAGE_TEXT in message
+    )
+
+
+# Адресат - комната, а не пользователь
+def is_room(destination):
+    return isinstance(destination, str) and destination.startswith(ROOM_PREFIX)
+
+
+# Кодирование словаря в байты без кадра (для хранения и последующей упаковки в кадр)
+def dump_message(message, codec=JSON_CODEC):
+    return codec.encode(message)
+
+
+# Дата из консоли: "ГГГГ-ММ-ДД" или "ГГГГ-ММ-ДД ЧЧ:ММ". Пустая строка - None, неверный формат - ValueError.
+def parse_time(text):
+    text = text.strip()
+    return datetime.datetime.fromisoformat(text) if text else None
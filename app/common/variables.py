@@ -1,4 +1,5 @@
 import logging
+from os import environ
 from os.path import abspath, dirname, join
 
 # Порт поумолчанию для сетевого ваимодействия
@@ -7,14 +8,54 @@ DEFAULT_PORT = 7777
 DEFAULT_IP_ADDRESS = "127.0.0.1"
 # "Сервер по умолчанию"
 DEFAULT_SERVER = "server"
+# Режимы работы сервера: цикл на select или движок на asyncio
+SERVER_MODE_SELECT = "select"
+SERVER_MODE_ASYNCIO = "asyncio"
+SERVER_MODES = (SERVER_MODE_SELECT, SERVER_MODE_ASYNCIO)
+DEFAULT_SERVER_MODE = SERVER_MODE_SELECT
+# Число процессов-обработчиков на одном порту (SO_REUSEPORT). 0 - сервер в одном процессе.
+DEFAULT_WORKERS = 0
 # Максимальная очередь подключений
 MAX_CONNECTIONS = 5
 # Максимальная длинна сообщения в байтах
 MAX_PACKAGE_LENGTH = 1024
+# Размер блока чтения из сокета при кадровом протоколе: за один вызов recv разбирается сразу много сообщений
+READ_CHUNK_SIZE = 65536
+# Максимальный размер одного кадра
+MAX_FRAME_LENGTH = 16 * 1024 * 1024
+# Ограничение очереди исходящих данных одного клиента в байтах
+OUTBOX_LIMIT = 1024 * 1024
+# Политики при переполнении очереди: отбросить сообщение, отключить получателя, приостановить чтение от отправителя
+OUTBOX_POLICY_DROP = "drop"
+OUTBOX_POLICY_DISCONNECT = "disconnect"
+OUTBOX_POLICY_PAUSE = "pause"
+OUTBOX_POLICIES = (OUTBOX_POLICY_DROP, OUTBOX_POLICY_DISCONNECT, OUTBOX_POLICY_PAUSE)
+DEFAULT_OUTBOX_POLICY = OUTBOX_POLICY_DROP
+# Очередь канала между процессами-обработчиками. При переполнении чтение от отправителя приостанавливается.
+PEER_OUTBOX_LIMIT = 16 * 1024 * 1024
+# Сколько кадров очереди отправлять одним системным вызовом sendmsg (не больше IOV_MAX)
+SEND_BATCH = 1024
 # Кодировка проекта
 ENCODING = "utf-8"
 # Текущий уровень логирования
 LOGGING_LEVEL = logging.DEBUG
+# Вывод лога фоновым потоком (app.logs.pipeline): размер очереди записей, записей в одной пачке вывода
+# и что делать при переполнении очереди - отбросить запись или ждать места
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH = 256
+LOG_POLICY_DROP = "drop"
+LOG_POLICY_BLOCK = "block"
+LOG_QUEUE_POLICY = LOG_POLICY_DROP
+# HTTP-сервер метрик в формате Prometheus: адрес (только локальный) и порт по умолчанию (0 - выключен)
+METRICS_ADDR = "127.0.0.1"
+METRICS_PORT = 0
+# Трассировка вызовов (app.common.tracing): on - вызовы пишутся в лог на уровне DEBUG, off - декораторы
+# не оборачивают функции. Задаётся переменной окружения JIM_TRACE до запуска.
+TRACE_ON = "on"
+TRACE_OFF = "off"
+TRACE_MODE = environ.get("JIM_TRACE", TRACE_ON)
+# Доля трассируемых вызовов приёма и отправки сообщений (get_message, send_message)
+TRACE_IO_SAMPLE = 0.01
 
 BASEDIR = abspath(dirname(__file__))
 
@@ -25,6 +66,51 @@ def create_sqlite_uri(db_name):
 
 # База данных для хранения данных сервера:
 SERVER_DATABASE = create_sqlite_uri("../db/server_data.db3")
+# Каталог журнала недоставленных сообщений (пользователи не в сети)
+MESSAGE_LOG_DIR = join(BASEDIR, "../db/messages")
+# Каталог снимков активных сессий (по файлу на процесс) и как часто их сохранять, секунды
+SESSIONS_DIR = join(BASEDIR, "../db/sessions")
+SESSION_SNAPSHOT_INTERVAL = 5
+# Профилирование из консоли сервера (app.common.profiling): каталог отчётов, строк в отчёте, интервал
+# выборочного профилировщика, секунды, и глубина стека, запоминаемая tracemalloc для каждого выделения
+PROFILE_DIR = join(BASEDIR, "../logs/profiles")
+PROFILE_TOP = 25
+PROFILE_SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 1
+PROFILER_SAMPLE = "sample"
+PROFILER_CPROFILE = "cprofile"
+PROFILERS = (PROFILER_SAMPLE, PROFILER_CPROFILE)
+# Настройки SQLite на каждое подключение: журнал WAL (чтение не ждёт записи), fsync только при checkpoint,
+# отображение файла в память до 256 МиБ и кэш страниц 64 МиБ
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+}
+# Архив сообщений с полнотекстовым поиском: файл базы, сообщений в одной транзакции записи, секунд ожидания
+# пачки и строк на странице результатов поиска
+ARCHIVE_PATH = join(BASEDIR, "../db/archive.db3")
+ARCHIVE_BATCH = 2000
+ARCHIVE_INTERVAL = 0.1
+ARCHIVE_PAGE_SIZE = 20
+# Отложенная запись в базу: не больше событий в одной транзакции и не дольше секунд ожидания пачки
+DB_COMMIT_EVENTS = 500
+DB_COMMIT_INTERVAL = 0.05
+# История входов: строк на странице консоли и строк в одной пачке чтения из базы
+LOGHIST_PAGE_SIZE = 50
+LOGHIST_BATCH = 1000
+# Сколько дней хранить подробную историю входов (0 - без ограничения), более старые записи сворачиваются
+# в дневные сводки раз в RETENTION_INTERVAL секунд
+HISTORY_RETENTION_DAYS = 90
+RETENTION_INTERVAL = 60 * 60
+# Сколько пользователей держать в справочнике имя -> id в памяти сервера
+USER_CACHE_SIZE = 100000
+# Хранилище пользователей и истории входов: SQLite на диске или словари в памяти процесса
+STORAGE_SQLITE = "sqlite"
+STORAGE_MEMORY = "memory"
+STORAGE_BACKENDS = (STORAGE_SQLITE, STORAGE_MEMORY)
+DEFAULT_STORAGE = STORAGE_SQLITE
 
 
 # Прококол JIM основные ключи:
@@ -42,6 +128,50 @@ ERROR = "error"
 MESSAGE = "message"
 MESSAGE_TEXT = "mess_text"
 EXIT = "exit"
+FRAMING = "framing"
+# Комнаты (групповые чаты): вход, выход и имя комнаты. Сообщение в комнату - to с префиксом "#"
+JOIN = "join"
+LEAVE = "leave"
+ROOM = "room"
+ROOM_PREFIX = "#"
+# Кодек сообщений, согласуемый в сообщении о присутствии
+CODEC = "codec"
+# Сжатие кадров, согласуемое в сообщении о присутствии
+COMPRESSION = "compression"
+# Пакет сообщений: один кадр со списком сообщений в поле messages
+BATCH = "batch"
+MESSAGES = "messages"
+# Подтверждения с отметками времени сервера: клиент запрашивает их полем acks в presence, и на каждое его
+# сообщение сервер отвечает action=ack с исходным time, временем приёма (received) и постановки в очередь
+# получателя (dispatched), время - time.time() сервера
+ACKS = "acks"
+ACK = "ack"
+RECEIVED = "received"
+DISPATCHED = "dispatched"
+
+# Служебные сообщения между процессами-обработчиками: изменения общего справочника имён
+DIRECTORY_ADD = "directory_add"
+DIRECTORY_DEL = "directory_del"
+
+# Форматы кадров, согласуемые в сообщении о присутствии. Порядок - по предпочтению сервера.
+# legacy - одно JSON-сообщение без разделителей, для старых клиентов
+FRAMING_LENGTH = "length"
+FRAMING_NEWLINE = "newline"
+FRAMING_LEGACY = "legacy"
+FRAMINGS = (FRAMING_LENGTH, FRAMING_NEWLINE, FRAMING_LEGACY)
+
+# Кодеки сообщений. msgpack - двоичный, с короткими целыми ключами, только для кадров с префиксом длины.
+CODEC_MSGPACK = "msgpack"
+CODEC_JSON = "json"
+
+# Режимы сжатия кадров (только для кадров length): deflate-stream - общий контекст сжатия на соединение,
+# deflate - каждый кадр отдельно
+COMPRESSION_DEFLATE_STREAM = "deflate-stream"
+COMPRESSION_DEFLATE = "deflate"
+COMPRESSIONS = (COMPRESSION_DEFLATE_STREAM, COMPRESSION_DEFLATE)
+# Кадры короче порога (байт полезной нагрузки) не сжимаются
+COMPRESSION_THRESHOLD = 512
+COMPRESSION_LEVEL = 6
 
 # Словари - ответы:
 # 200
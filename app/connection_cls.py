@@ -0,0 +1,233 @@
+import socket
+from collections import deque
+from itertools import islice
+
+from app.common.framing import FrameDecoder
+from app.common.metrics import REGISTRY
+from app.common.variables import *
+
+
+# sendmsg есть не на всех платформах (нет в Windows), тогда кадры отправляются по одному
+SENDMSG = hasattr(socket.socket, "sendmsg")
+
+# Метрики соединений всех клиентов процесса
+BYTES_RECEIVED = REGISTRY.counter("jim_received_bytes_total", "Bytes read from client sockets")
+BYTES_SENT = REGISTRY.counter("jim_sent_bytes_total", "Bytes written to client sockets")
+SEND_CALLS = REGISTRY.counter("jim_send_calls_total", "Socket send/sendmsg calls")
+FRAMES_DROPPED = REGISTRY.counter("jim_dropped_frames_total", "Frames dropped by the outbox drop policy")
+
+
+# Сообщение, пересылаемое без разбора: исходный кадр (memoryview), его полезная нагрузка, получатель
+# из заголовка и соединение отправителя
+class Relay:
+    __slots__ = ("frame", "payload", "destination", "sender")
+
+    def __init__(self, frame, payload, destination, sender):
+        self.frame = frame
+        self.payload = payload
+        self.destination = destination
+        self.sender = sender
+
+    # Полный разбор, когда кадр нельзя переслать как есть
+    def decode(self):
+        return self.sender.codec.decode(self.payload)
+
+
+# Состояние одного клиентского соединения на сервере: сокет, адрес, имя после presence, разборщик кадров
+# и ограниченная очередь исходящих данных. Повторяет интерфейс сокета (fileno, send, getpeername, close),
+# поэтому годится для селектора и send_message: send только ставит данные в очередь, отправка - в flush.
+class Connection:
+    __slots__ = (
+        "sock",
+        "fd",
+        "addr",
+        "name",
+        "decoder",
+        "outbox",
+        "out_bytes",
+        "limit",
+        "policy",
+        "blocked_by",
+        "paused_senders",
+        "dropped",
+        "closing",
+        "overflowed",
+        "events",
+        "changes",
+        "replay",
+        "replayed",
+        "rooms",
+        "compressor",
+        "send_calls",
+        "sent_frames",
+        "acks",
+    )
+
+    def __init__(self, sock, addr, limit=OUTBOX_LIMIT, policy=DEFAULT_OUTBOX_POLICY, changes=None):
+        self.sock = sock
+        # Дескриптор запоминается сразу: после закрытия сокета fileno() вернёт -1, а по нему ищется соединение
+        self.fd = sock.fileno() if sock is not None else -1
+        self.addr = addr
+        self.name = None
+        self.decoder = FrameDecoder()
+        # Очередь исходящих кадров и её размер в байтах
+        self.outbox = deque()
+        self.out_bytes = 0
+        self.limit = limit
+        self.policy = policy
+        # Получатели, из-за переполненных очередей которых чтение от этого клиента приостановлено
+        self.blocked_by = set()
+        # Отправители, приостановленные из-за переполнения очереди этого клиента
+        self.paused_senders = set()
+        # Сколько кадров отброшено по политике drop
+        self.dropped = 0
+        # Соединение закрывается: новые данные не принимаются, сокет закроется после отправки очереди
+        self.closing = False
+        # Очередь переполнилась при политике disconnect, сервер разорвёт соединение
+        self.overflowed = False
+        # События, на которые соединение сейчас зарегистрировано в селекторе сервера
+        self.events = 0
+        # Общее для сервера множество соединений, чьё состояние изменилось за проход цикла (или None)
+        self.changes = changes
+        # Имена, чьи недоставленные сообщения из журнала ещё нужно отправить в это соединение
+        self.replay = []
+        # Выданные из журнала порции: (номер последнего кадра порции, имя, позиция в журнале). Доставка
+        # отмечается в журнале, когда кадры порции отправлены.
+        self.replayed = deque()
+        # Комнаты, в которые входит клиент
+        self.rooms = set()
+        # Сжатие исходящих кадров (FrameCompressor), если согласовано в presence
+        self.compressor = None
+        # Сколько системных вызовов отправки сделано и сколько кадров ими отправлено
+        self.send_calls = 0
+        self.sent_frames = 0
+        # Клиент запросил подтверждения своих сообщений с отметками времени сервера
+        self.acks = False
+
+    # Формат кадров, согласованный в presence. Меняется только после ответа на presence.
+    @property
+    def framing(self):
+        return self.decoder.framing
+
+    @framing.setter
+    def framing(self, value):
+        self.decoder.framing = value
+
+    # Кодек сообщений (app.common.codecs), согласованный в presence
+    @property
+    def codec(self):
+        return self.decoder.codec
+
+    @codec.setter
+    def codec(self, value):
+        self.decoder.codec = value
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def getpeername(self):
+        return self.addr
+
+    def send(self, data):
+        self.enqueue(data)
+        return len(data)
+
+    # Постановка кадра в очередь. sender - соединение отправителя, его чтение приостанавливается
+    # при политике pause. cache - сжатые варианты кадра при рассылке многим (FrameCompressor.compress_frame).
+    # Возвращает False, если кадр не принят.
+    def enqueue(self, data, sender=None, cache=None):
+        if self.closing:
+            return False
+        # Пустая очередь принимает кадр любого размера, иначе большое сообщение не ушло бы никогда
+        if self.out_bytes and self.out_bytes + len(data) > self.limit:
+            if self.policy == OUTBOX_POLICY_DROP:
+                self.dropped += 1
+                FRAMES_DROPPED.inc()
+                return False
+            if self.policy == OUTBOX_POLICY_DISCONNECT:
+                self.overflowed = True
+                self.touch()
+                return False
+            if sender is not None and sender is not self:
+                if not sender.blocked_by:
+                    sender.touch()
+                sender.blocked_by.add(self)
+                self.paused_senders.add(sender)
+        # Сжатие - только для принятого в очередь кадра, иначе разойдётся общий контекст deflate-stream
+        if self.compressor is not None:
+            data = self.compressor.compress_frame(data, cache)
+        self.outbox.append(data)
+        self.out_bytes += len(data)
+        if len(self.outbox) == 1:
+            self.touch()
+        return True
+
+    # Неблокирующая отправка очереди. Все накопленные кадры уходят одним вызовом sendmsg (writev), частично
+    # отправленный кадр остаётся в голове очереди срезом memoryview. Возвращает True, если очередь опустела.
+    def flush(self):
+        full = False
+        while self.outbox and not full:
+            try:
+                if len(self.outbox) == 1 or not SENDMSG:
+                    sent = self.sock.send(self.outbox[0])
+                else:
+                    sent = self.sock.sendmsg(list(islice(self.outbox, SEND_BATCH)))
+            except (BlockingIOError, InterruptedError):
+                break
+            self.send_calls += 1
+            self.out_bytes -= sent
+            SEND_CALLS.inc()
+            BYTES_SENT.inc(sent)
+            while sent:
+                data = self.outbox[0]
+                if sent < len(data):
+                    # Буфер сокета заполнен, остаток кадра уйдёт при следующей готовности к записи
+                    self.outbox[0] = memoryview(data)[sent:]
+                    full = True
+                    break
+                sent -= len(data)
+                self.outbox.popleft()
+                self.sent_frames += 1
+        if self.paused_senders and self.out_bytes <= self.limit // 2:
+            self.release_senders()
+        return not self.outbox
+
+    # Снятие паузы с отправителей, которые ждали освобождения этой очереди
+    def release_senders(self):
+        for sender in self.paused_senders:
+            sender.blocked_by.discard(self)
+            if not sender.blocked_by:
+                sender.resume()
+        self.paused_senders.clear()
+
+    # Вызывается, когда чтение от клиента можно продолжать
+    def resume(self):
+        self.touch()
+
+    # Отметка для сервера: пересмотреть регистрацию соединения в селекторе в конце прохода цикла
+    def touch(self):
+        if self.changes is not None:
+            self.changes.add(self)
+
+    # Мягкое закрытие: сокет закроется после отправки очереди
+    def close(self):
+        self.closing = True
+        self.touch()
+
+    # Немедленное закрытие с отбрасыванием очереди
+    def abort(self):
+        self.closing = True
+        self.release_senders()
+        self.outbox.clear()
+        self.out_bytes = 0
+        self.sock.close()
+
+    # Читает из сокета блок до READ_CHUNK_SIZE и возвращает итератор по всем целиком принятым сообщениям.
+    # route - см. FrameDecoder.messages.
+    def read_messages(self, route=None):
+        data = self.sock.recv(READ_CHUNK_SIZE)
+        if not data:
+            raise ConnectionResetError
+        BYTES_RECEIVED.inc(len(data))
+        self.decoder.feed(data)
+        return self.decoder.messages(route)
@@ -0,0 +1,234 @@
+import logging
+import os
+import time
+from functools import partial
+
+from sqlalchemy import (Column, Float, Index, Integer, MetaData, String, Table,
+                        create_engine, event, text)
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+
+from app.common.codecs import get_codec
+from app.common.errors import IncorrectDataRecivedError
+from app.common.variables import *
+from app.db.batch_writer import BatchWriter
+from app.db.server_db import set_pragmas
+
+logger = logging.getLogger("server")
+
+# Полнотекстовый индекс FTS5 по тексту сообщений. Текст хранится только в Messages (external content),
+# индекс пополняется триггером при вставке.
+FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS Messages_fts USING fts5(text, content='Messages', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS Messages_fts_insert AFTER INSERT ON Messages BEGIN "
+    "INSERT INTO Messages_fts(rowid, text) VALUES (new.id, new.text); END",
+)
+
+
+# Поиск по словам с фильтром по отправителю или получателю перебирает их сообщения, если их меньше этого числа
+ARCHIVE_PROBE = 2000
+# Насколько (в секундах) порядок записи в архив может расходиться со временем приёма сообщений
+ARCHIVE_REORDER = 60
+
+
+# Запрос FTS5 из введённого текста: каждое слово - отдельная фраза в кавычках, ищутся сообщения со всеми
+# словами. Кавычки и операторы FTS5 во введённом тексте не действуют.
+def fts_query(words):
+    return " ".join('"' + word.replace('"', '""') + '"' for word in words.split())
+
+
+# Значение для базы: одиночные суррогаты (JSON их допускает, UTF-8 - нет) заменяются на "?"
+def storable(value):
+    return value.encode(ENCODING, "replace").decode(ENCODING) if isinstance(value, str) else value
+
+
+# Архив сообщений пользователей с полнотекстовым поиском (SQLite FTS5). Сообщения ставятся в очередь
+# и записываются фоновым потоком пачками: цикл сервера не ждёт базу и не разбирает пересылаемые без разбора
+# кадры - их разбирает поток записи. Отдельный файл базы: запись архива не мешает записи входов.
+class MessageArchive:
+    def __init__(
+        self,
+        path=ARCHIVE_PATH,
+        batch_size=ARCHIVE_BATCH,
+        interval=ARCHIVE_INTERVAL,
+        pragmas=SQLITE_PRAGMAS,
+    ):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.engine = create_engine(
+            "sqlite:///" + path,
+            echo=False,
+            poolclass=QueuePool,
+            connect_args={"check_same_thread": False},
+        )
+        if pragmas:
+            event.listen(self.engine, "connect", partial(set_pragmas, pragmas=pragmas))
+        self.metadata = MetaData()
+        self.table = Table(
+            "Messages",
+            self.metadata,
+            Column("id", Integer, primary_key=True),
+            Column("time", Float),
+            Column("sender", String),
+            Column("recipient", String),
+            Column("text", String),
+        )
+        # Поиск по отправителю или получателю идёт по индексу, внутри него строки упорядочены по id
+        Index("Messages_sender", self.table.c.sender)
+        Index("Messages_recipient", self.table.c.recipient)
+        Index("Messages_time", self.table.c.time)
+        self.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            for statement in FTS_SCHEMA:
+                connection.execute(text(statement))
+        self.insert = self.table.insert()
+        self.writer = BatchWriter(self.write_batch, batch_size, interval, "archive-writer")
+        # Сколько сообщений записано и сколько не удалось разобрать
+        self.written = 0
+        self.rejected = 0
+
+    # Сообщение-словарь из цикла сервера
+    def append(self, message):
+        self.writer.submit((time.time(), message))
+
+    # Кадр, пересланный без разбора: полезная нагрузка копируется (буфер соединения будет переиспользован)
+    # и разбирается потоком записи кодеком отправителя
+    def append_payload(self, payload, codec):
+        self.writer.submit((time.time(), (codec.name, bytes(payload))))
+
+    def write_batch(self, batch):
+        rows = []
+        for received, message in batch:
+            if not isinstance(message, dict):
+                name, payload = message
+                try:
+                    message = get_codec(name).decode(payload)
+                except (IncorrectDataRecivedError, ValueError):
+                    self.rejected += 1
+                    continue
+            rows.append(
+                {
+                    "time": received,
+                    "sender": message.get(SENDER),
+                    "recipient": message.get(DESTINATION),
+                    "text": str(message.get(MESSAGE_TEXT, "")),
+                }
+            )
+        if rows:
+            self.insert_rows(rows)
+
+    # Пачка пишется одной транзакцией. Если она не записалась, строки пишутся по одной (как в
+    # ServerStorage.write_batch), и ошибочная строка не отменяет остальные. Строка, которую не удалось
+    # закодировать в UTF-8, записывается с заменой некодируемых символов.
+    def insert_rows(self, rows):
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(self.insert, rows)
+        except (SQLAlchemyError, ValueError) as ex:
+            if len(rows) > 1:
+                for row in rows:
+                    self.insert_rows([row])
+            elif isinstance(ex, UnicodeEncodeError):
+                self.insert_rows([{key: storable(value) for key, value in rows[0].items()}])
+            else:
+                logger.error(f"Ошибка записи в архив сообщений: {ex}")
+                self.rejected += 1
+            return
+        self.written += len(rows)
+
+    # Страница результатов поиска, новые сообщения первыми: строки (id, время, отправитель, получатель, текст)
+    # и курсор следующей страницы (id последней строки, None - больше нет). words - слова, которые должны
+    # быть в тексте; период [since, until) задаётся datetime.
+    def search(
+        self,
+        words=None,
+        sender=None,
+        recipient=None,
+        since=None,
+        until=None,
+        before=None,
+        limit=ARCHIVE_PAGE_SIZE,
+    ):
+        with self.engine.connect() as connection:
+            filters, params = [], {"limit": limit}
+            if sender:
+                filters.append("Messages.sender = :sender")
+                params["sender"] = sender
+            if recipient:
+                filters.append("Messages.recipient = :recipient")
+                params["recipient"] = recipient
+            if since is not None:
+                filters.append("Messages.time >= :since")
+                params["since"] = since.timestamp()
+            if until is not None:
+                filters.append("Messages.time < :until")
+                params["until"] = until.timestamp()
+            low, high = self.id_range(connection, since, until)
+            if before is not None:
+                high = before if high is None else min(high, before)
+            query = fts_query(words) if words else ""
+            if not query:
+                source, key = "Messages", "Messages.id"
+            elif (sender or recipient) and self.few_candidates(connection, filters, params, low, high):
+                # У отправителя или получателя сообщений немного: перебор по индексу Messages, текст каждого
+                # проверяется индексом FTS по rowid, а не просмотром всех совпадений частого слова
+                source, key = "Messages CROSS JOIN Messages_fts ON Messages_fts.rowid = Messages.id", "Messages.id"
+            else:
+                source, key = "Messages_fts JOIN Messages ON Messages.id = Messages_fts.rowid", "Messages_fts.rowid"
+            conditions = list(filters)
+            if query:
+                conditions.append("Messages_fts MATCH :query")
+                params["query"] = query
+            if low is not None:
+                conditions.append(f"{key} > :low")
+                params["low"] = low
+            if high is not None:
+                conditions.append(f"{key} < :high")
+                params["high"] = high
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            statement = text(
+                f"SELECT Messages.id, Messages.time, Messages.sender, Messages.recipient, Messages.text "
+                f"FROM {source} {where} ORDER BY {key} DESC LIMIT :limit"
+            )
+            rows = connection.execute(statement, params).fetchall()
+        cursor = rows[-1].id if len(rows) == limit else None
+        return rows, cursor
+
+    # Период в границы id (обе не включаются, None - без границы). Сообщения записываются в порядке приёма,
+    # с расхождением не больше ARCHIVE_REORDER секунд между процессами-обработчиками, поэтому всё за период
+    # лежит между последним сообщением до since - ARCHIVE_REORDER и первым после until + ARCHIVE_REORDER.
+    # Две выборки по индексу времени, дальше и FTS, и Messages перебирают только этот диапазон id.
+    def id_range(self, connection, since, until):
+        low = high = None
+        if since is not None:
+            low = connection.execute(
+                text("SELECT id FROM Messages WHERE time < :time ORDER BY time DESC LIMIT 1"),
+                {"time": since.timestamp() - ARCHIVE_REORDER},
+            ).scalar()
+        if until is not None:
+            high = connection.execute(
+                text("SELECT id FROM Messages WHERE time >= :time ORDER BY time LIMIT 1"),
+                {"time": until.timestamp() + ARCHIVE_REORDER},
+            ).scalar()
+        return low, high
+
+    # Меньше ли ARCHIVE_PROBE сообщений проходит фильтры (подсчёт останавливается на ARCHIVE_PROBE)
+    def few_candidates(self, connection, filters, params, low, high):
+        conditions = list(filters)
+        if low is not None:
+            conditions.append(f"Messages.id > {int(low)}")
+        if high is not None:
+            conditions.append(f"Messages.id < {int(high)}")
+        count = connection.execute(
+            text(f"SELECT count(*) FROM (SELECT 1 FROM Messages WHERE {' AND '.join(conditions)} LIMIT :probe)"),
+            dict(params, probe=ARCHIVE_PROBE),
+        ).scalar()
+        return count < ARCHIVE_PROBE
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,87 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+# Служебные события очереди: записать накопленное сейчас и остановить поток записи
+WRITER_FLUSH = "flush"
+WRITER_STOP = "stop"
+
+logger = logging.getLogger("server")
+
+
+# Отложенная запись пачками: события ставятся в очередь, фоновый поток передаёт их обработчику handler
+# списком - не больше max_events событий, пачка собирается не дольше interval секунд после первого события.
+# Поток запускается при первом событии, поэтому главный процесс многопроцессного сервера создаёт
+# обработчики (fork) без лишних потоков.
+class BatchWriter:
+    __slots__ = ("handler", "max_events", "interval", "name", "events", "thread", "lag", "batches")
+
+    def __init__(self, handler, max_events, interval, name):
+        self.handler = handler
+        self.max_events = max_events
+        self.interval = interval
+        self.name = name
+        self.events = queue.Queue()
+        self.thread = None
+        # Задержка записи последней пачки (от постановки самого старого события до конца записи), секунды,
+        # и число записанных пачек
+        self.lag = 0.0
+        self.batches = 0
+
+    def submit(self, event):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+        self.events.put((time.monotonic(), event))
+
+    # Сколько событий ждёт записи
+    def pending(self):
+        return self.events.qsize()
+
+    # Ожидание записи всех поставленных в очередь событий
+    def flush(self):
+        if self.thread is not None:
+            self.events.put(WRITER_FLUSH)
+            self.events.join()
+
+    # Очередь записывается до конца, поток останавливается. Возвращает False, если поток не запускался.
+    def close(self):
+        thread, self.thread = self.thread, None
+        if thread is None or not thread.is_alive():
+            return False
+        self.events.put(WRITER_STOP)
+        thread.join()
+        return True
+
+    def run(self):
+        running = True
+        while running:
+            batch, marks = [], 0
+            event = self.events.get()
+            deadline = time.monotonic() + self.interval
+            while True:
+                # Служебное событие завершает пачку досрочно
+                if event is WRITER_FLUSH or event is WRITER_STOP:
+                    marks = 1
+                    running = event is WRITER_FLUSH
+                    break
+                batch.append(event)
+                if len(batch) >= self.max_events:
+                    break
+                try:
+                    event = self.events.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self.handler([event for queued, event in batch])
+                except Exception as ex:
+                    # Поток записи не должен останавливаться: иначе flush и close будут ждать вечно
+                    logger.error(f"Ошибка отложенной записи ({self.name}): {ex}")
+                self.lag = time.monotonic() - batch[0][0]
+                self.batches += 1
+            for _ in range(len(batch) + marks):
+                self.events.task_done()
@@ -0,0 +1,101 @@
+import datetime
+from bisect import bisect_left, bisect_right, insort
+
+from app.common.variables import *
+from app.db.sessions import ActiveSessions
+from app.db.storage import BaseStorage
+
+
+class UserRecord:
+    __slots__ = ("name", "last_login")
+
+    def __init__(self, name, last_login):
+        self.name = name
+        self.last_login = last_login
+
+
+# Запись истории входов. Записи упорядочены по (время входа, id): списки истории отсортированы, период
+# и курсор страницы находятся двоичным поиском.
+class LoginRecord:
+    __slots__ = ("name", "date_time", "ip", "port", "id")
+
+    def __init__(self, name, date_time, ip, port, record_id):
+        self.name = name
+        self.date_time = date_time
+        self.ip = ip
+        self.port = port
+        self.id = record_id
+
+    def __lt__(self, other):
+        return (self.date_time, self.id) < (other.date_time, other.id)
+
+    def row(self):
+        return self.name, self.date_time, self.ip, self.port, self.id
+
+
+# Граница поиска в списке истории: перед всеми записями со временем moment (id записей начинаются с 1)
+# или сразу после записи с курсором (moment, record_id)
+def bound(moment, record_id=0):
+    return LoginRecord(None, moment, None, None, record_id)
+
+
+# Хранилище в памяти процесса: без диска и без фоновой записи, данные теряются при остановке сервера.
+# Для тестов и нагрузочных замеров, где стоимость базы данных не должна влиять на пропускную способность сети.
+# История входов не сворачивается и растёт до остановки.
+class MemoryStorage(BaseStorage):
+    __slots__ = ("users", "sessions", "history", "user_history", "last_id")
+
+    name = STORAGE_MEMORY
+
+    def __init__(self, sessions=None):
+        self.users = dict()
+        self.sessions = ActiveSessions() if sessions is None else sessions
+        # История входов: вся и по пользователю, в порядке (время, id)
+        self.history = []
+        self.user_history = dict()
+        self.last_id = 0
+
+    def user_login(self, username, ip_address, port):
+        login_time = datetime.datetime.now()
+        user = self.users.get(username)
+        if user is None:
+            self.users[username] = UserRecord(username, login_time)
+        else:
+            user.last_login = login_time
+        self.sessions.login(username, ip_address, port, login_time)
+        self.last_id += 1
+        record = LoginRecord(username, login_time, ip_address, port, self.last_id)
+        # Вставка в конец, кроме случая, когда системные часы перевели назад
+        insort(self.history, record)
+        insort(self.user_history.setdefault(username, []), record)
+
+    def user_logout(self, username):
+        self.sessions.logout(username)
+
+    def user_list(self):
+        return [(user.name, user.last_login) for user in list(self.users.values())]
+
+    def login_history(self, username=None, since=None, until=None):
+        records, start, end = self.history_range(username, since, until)
+        return [records[i].row()[:4] for i in range(start, end)]
+
+    def login_history_page(self, username=None, after=None, limit=LOGHIST_PAGE_SIZE, since=None, until=None):
+        records, start, end = self.history_range(username, since, until)
+        if after is not None:
+            start = max(start, bisect_right(records, bound(*after)))
+        rows = [records[i].row() for i in range(start, min(start + limit, end))]
+        cursor = (rows[-1][1], rows[-1][4]) if len(rows) == limit else None
+        return rows, cursor
+
+    # Список истории и границы периода [since, until) в нём
+    def history_range(self, username=None, since=None, until=None):
+        records = self.user_history.get(username, []) if username else self.history
+        start = 0 if since is None else bisect_left(records, bound(since))
+        end = len(records) if until is None else bisect_left(records, bound(until))
+        return records, start, end
+
+    def status(self):
+        return (
+            f"Хранилище в памяти: пользователей {len(self.users)}, активных {len(self.sessions)}, "
+            f"записей истории входов {len(self.history)}"
+        )
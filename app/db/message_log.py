@@ -0,0 +1,280 @@
+import os
+import struct
+from collections import deque
+from itertools import chain
+
+# Заголовок записи журнала: тип, длина имени получателя, длина данных
+RECORD_HEADER = struct.Struct("!BHI")
+# Запись с сообщением для получателя, который не в сети
+RECORD_MESSAGE = 1
+# Отметка о доставке: всё до позиции включительно отдано получателю
+RECORD_ACK = 2
+ACK_BODY = struct.Struct("!Q")
+# Пропуск: место удалённых при перезаписи сегмента записей, после заголовка - дыра в разреженном файле
+RECORD_SKIP = 3
+
+# Позиция записи упакована в одно число: номер сегмента в старших битах, смещение - в младших 40 битах
+OFFSET_BITS = 40
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+SEGMENT_SUFFIX = ".seg"
+# Сегмент перезаписывается, когда недоставленных в нём осталось не больше этой доли записанных сообщений
+COMPACT_RATIO = 4
+
+
+# Журнал недоставленных сообщений (store-and-forward). Сообщения только дописываются в конец текущего
+# сегмента, для каждого получателя в памяти хранится очередь позиций его записей. Доставка отмечается
+# записью ACK после отправки выданных сообщений, сегменты без недоставленных сообщений удаляются целиком,
+# а в почти доставленных сегментах место доставленных записей освобождается перезаписью. После перезапуска
+# индекс восстанавливается чтением сегментов.
+class MessageLog:
+    __slots__ = (
+        "directory",
+        "segment_size",
+        "index",
+        "reading",
+        "live",
+        "written",
+        "acked",
+        "segment",
+        "file",
+        "offset",
+        "dirty",
+        "unflushed",
+    )
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        # получатель -> очередь упакованных позиций его ещё не выданных сообщений
+        self.index = dict()
+        # получатель -> очередь позиций выданных сообщений, доставка которых ещё не подтверждена
+        self.reading = dict()
+        # номер сегмента -> число недоставленных сообщений в нём
+        self.live = dict()
+        # номер сегмента -> число сообщений, записанных в него (после перезаписи - оставшихся)
+        self.written = dict()
+        # получатель -> (позиция последней отметки о доставке, сегмент с записью ACK)
+        self.acked = dict()
+        os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        for segment in segments:
+            self.load_segment(segment)
+        self.segment = segments[-1] if segments else 1
+        self.live.setdefault(self.segment, 0)
+        self.written.setdefault(self.segment, 0)
+        self.file = open(self.segment_path(self.segment), "ab")
+        self.offset = self.file.tell()
+        # Есть записи без fsync / без flush в файл
+        self.dirty = False
+        self.unflushed = False
+        self.compact()
+
+    def segments(self):
+        names = [name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX)]
+        return sorted(int(name[: -len(SEGMENT_SUFFIX)]) for name in names)
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"{segment:08d}{SEGMENT_SUFFIX}")
+
+    def load_segment(self, segment):
+        path = self.segment_path(segment)
+        self.live.setdefault(segment, 0)
+        self.written.setdefault(segment, 0)
+        with open(path, "rb") as file:
+            data = file.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            kind, name_length, length = RECORD_HEADER.unpack_from(data, offset)
+            end = offset + RECORD_HEADER.size + name_length + length
+            if end > len(data):
+                break
+            name_start = offset + RECORD_HEADER.size
+            recipient = data[name_start : name_start + name_length].decode("utf-8")
+            if kind == RECORD_MESSAGE:
+                self.index.setdefault(recipient, deque()).append(segment << OFFSET_BITS | offset)
+                self.live[segment] += 1
+                self.written[segment] += 1
+            elif kind == RECORD_ACK:
+                (position,) = ACK_BODY.unpack_from(data, name_start + name_length)
+                self.acknowledge(recipient, position)
+                self.acked[recipient] = (position, segment)
+            offset = end
+        # Недописанный хвост после аварийной остановки отрезаем
+        if offset < len(data):
+            with open(path, "r+b") as file:
+                file.truncate(offset)
+
+    # Снятие с учёта всех сообщений получателя до позиции включительно
+    def acknowledge(self, recipient, position):
+        for queues in (self.reading, self.index):
+            positions = queues.get(recipient)
+            while positions and positions[0] <= position:
+                self.live[positions.popleft() >> OFFSET_BITS] -= 1
+            if not positions:
+                queues.pop(recipient, None)
+
+    def write(self, kind, recipient, body):
+        name = recipient.encode("utf-8")
+        position = self.segment << OFFSET_BITS | self.offset
+        self.file.write(RECORD_HEADER.pack(kind, len(name), len(body)))
+        self.file.write(name)
+        self.file.write(body)
+        self.offset += RECORD_HEADER.size + len(name) + len(body)
+        self.dirty = True
+        self.unflushed = True
+        return position
+
+    # Добавление сообщения в конец журнала, O(1). На диск попадает при sync.
+    def append(self, recipient, payload):
+        if self.offset >= self.segment_size:
+            self.rotate()
+        position = self.write(RECORD_MESSAGE, recipient, payload)
+        self.index.setdefault(recipient, deque()).append(position)
+        self.live[self.segment] += 1
+        self.written[self.segment] += 1
+
+    def rotate(self):
+        self.sync()
+        self.file.close()
+        self.segment += 1
+        self.live[self.segment] = 0
+        self.written[self.segment] = 0
+        self.file = open(self.segment_path(self.segment), "ab")
+        self.offset = 0
+
+    # Сколько недоставленных и ещё не выданных сообщений ждёт получателя
+    def pending(self, recipient):
+        positions = self.index.get(recipient)
+        return len(positions) if positions else 0
+
+    # Следующая порция ещё не выданных сообщений получателя не больше max_bytes (но хотя бы одно сообщение)
+    # и позиция последнего из них. Доставленными сообщения становятся только после ack с этой позицией,
+    # до тех пор rewind возвращает их в выдачу. Весь журнал в память не читается, выданные позиции переходят
+    # в очередь reading, так что порция стоит только своего размера.
+    def read_batch(self, recipient, max_bytes):
+        positions = self.index.get(recipient)
+        if not positions:
+            return [], None
+        if self.unflushed:
+            self.file.flush()
+            self.unflushed = False
+        reading = self.reading.setdefault(recipient, deque())
+        batch = []
+        size = 0
+        last = None
+        handles = dict()
+        try:
+            while positions and (not batch or size < max_bytes):
+                position = positions[0]
+                segment = position >> OFFSET_BITS
+                if segment not in handles:
+                    handles[segment] = os.open(self.segment_path(segment), os.O_RDONLY)
+                fd = handles[segment]
+                offset = position & OFFSET_MASK
+                kind, name_length, length = RECORD_HEADER.unpack(os.pread(fd, RECORD_HEADER.size, offset))
+                payload = os.pread(fd, length, offset + RECORD_HEADER.size + name_length)
+                batch.append(payload)
+                size += len(payload)
+                last = position
+                reading.append(positions.popleft())
+        finally:
+            for fd in handles.values():
+                os.close(fd)
+        if not positions:
+            del self.index[recipient]
+        return batch, last
+
+    # Подтверждение доставки всех сообщений получателя до позиции включительно (после отправки порции)
+    def ack(self, recipient, position):
+        self.acknowledge(recipient, position)
+        self.acked[recipient] = (position, self.segment)
+        self.write(RECORD_ACK, recipient, ACK_BODY.pack(position))
+        self.compact()
+
+    # Выданные, но не подтверждённые сообщения получателя снова ждут выдачи (соединение закрылось раньше)
+    def rewind(self, recipient):
+        reading = self.reading.pop(recipient, None)
+        if reading:
+            self.index.setdefault(recipient, deque()).extendleft(reversed(reading))
+
+    # Освобождение места: сегменты без недоставленных сообщений удаляются, сегменты, где их осталось мало,
+    # перезаписываются (см. rewrite). Текущий сегмент не трогается.
+    def compact(self):
+        removed = [segment for segment, live in self.live.items() if not live and segment != self.segment]
+        sparse = [
+            segment
+            for segment, live in self.live.items()
+            if live and segment != self.segment and live * COMPACT_RATIO <= self.written[segment]
+        ]
+        if not removed and not sparse:
+            return
+        for segment in removed:
+            del self.live[segment]
+            del self.written[segment]
+        self.carry_acks(set(removed) | set(sparse))
+        # Перенесённые отметки должны попасть на диск раньше, чем пропадут старые
+        self.sync()
+        for segment in removed:
+            try:
+                os.remove(self.segment_path(segment))
+            except FileNotFoundError:
+                pass
+        if sparse:
+            self.rewrite(sparse)
+
+    # Отметки ACK из удаляемых и перезаписываемых сегментов, которые ещё относятся к записям на диске,
+    # переносятся в текущий сегмент. Иначе после перезапуска доставленные сообщения вернулись бы.
+    def carry_acks(self, segments):
+        oldest = min(self.live)
+        for recipient, (position, segment) in list(self.acked.items()):
+            if segment not in segments:
+                continue
+            if position >> OFFSET_BITS < oldest:
+                del self.acked[recipient]
+                continue
+            self.acked[recipient] = (position, self.segment)
+            self.write(RECORD_ACK, recipient, ACK_BODY.pack(position))
+
+    # Перезапись сегментов с оставшимися недоставленными сообщениями. Записи остаются на прежних смещениях,
+    # так что позиции в индексе и отметках ACK не меняются, а место между ними становится дырой разреженного
+    # файла за записью-пропуском.
+    def rewrite(self, segments):
+        keep = {segment: [] for segment in segments}
+        for positions in chain(self.reading.values(), self.index.values()):
+            for position in positions:
+                offsets = keep.get(position >> OFFSET_BITS)
+                if offsets is not None:
+                    offsets.append(position & OFFSET_MASK)
+        for segment, offsets in keep.items():
+            offsets.sort()
+            path = self.segment_path(segment)
+            with open(path, "rb") as source, open(path + ".tmp", "wb") as target:
+                cursor = 0
+                for offset in offsets:
+                    if offset > cursor:
+                        target.write(RECORD_HEADER.pack(RECORD_SKIP, 0, offset - cursor - RECORD_HEADER.size))
+                        target.seek(offset)
+                    source.seek(offset)
+                    header = source.read(RECORD_HEADER.size)
+                    kind, name_length, length = RECORD_HEADER.unpack(header)
+                    target.write(header)
+                    target.write(source.read(name_length + length))
+                    cursor = offset + RECORD_HEADER.size + name_length + length
+                target.flush()
+                os.fsync(target.fileno())
+            os.replace(path + ".tmp", path)
+            self.written[segment] = self.live[segment]
+
+    # Групповая фиксация: один fsync на все записи, сделанные с прошлого вызова
+    def sync(self):
+        if not self.dirty:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.dirty = False
+        self.unflushed = False
+
+    def close(self):
+        self.sync()
+        self.file.close()
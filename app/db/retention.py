@@ -0,0 +1,175 @@
+import datetime
+import logging
+import threading
+import time
+
+from sqlalchemy import (Column, Date, DateTime, ForeignKey, Index, Integer,
+                        String, Table, func, select)
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.common.variables import *
+
+logger = logging.getLogger("server")
+
+# Разделитель адресов в поле ips дневной сводки
+IPS_SEPARATOR = " "
+
+
+# Таблица дневных сводок входов: по пользователю за день - число входов, первый и последний вход,
+# различные адреса
+def create_rollup_table(metadata):
+    table = Table(
+        "Login_daily",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("user", ForeignKey("Users.id")),
+        Column("day", Date),
+        Column("logins", Integer),
+        Column("first_login", DateTime),
+        Column("last_login", DateTime),
+        Column("ip_count", Integer),
+        Column("ips", String),
+    )
+    Index("Login_daily_user_day", table.c.user, table.c.day, unique=True)
+    Index("Login_daily_day", table.c.day)
+    return table
+
+
+# Срок хранения подробной истории входов. Записи старше days дней сворачиваются в дневные сводки
+# (Login_daily) и удаляются из Login_history, поэтому таблица истории остаётся небольшой, а старые данные
+# доступны в виде сводок. Сворачивание идёт по одному дню в транзакции: запись входов ждёт недолго.
+# days = 0 - история хранится без ограничения.
+class HistoryRetention:
+    __slots__ = ("storage", "days", "interval", "lock", "thread", "compacted_rows", "last_run")
+
+    def __init__(self, storage, days=HISTORY_RETENTION_DAYS, interval=RETENTION_INTERVAL):
+        self.storage = storage
+        self.days = days
+        self.interval = interval
+        # Сворачивание запускают фоновый поток и консоль, одновременно - только одно
+        self.lock = threading.Lock()
+        self.thread = None
+        # Сколько записей истории свёрнуто с запуска и когда сворачивание выполнялось последний раз
+        self.compacted_rows = 0
+        self.last_run = None
+
+    # Начало первого дня, который ещё хранится подробно
+    def cutoff(self, now=None):
+        today = (now or datetime.datetime.now()).date()
+        return datetime.datetime.combine(today - datetime.timedelta(days=self.days), datetime.time.min)
+
+    # Сворачивание всех записей старше срока хранения. Возвращает число свёрнутых записей и дней.
+    def compact(self, now=None):
+        if not self.days:
+            return 0, 0
+        history = self.storage.history_table
+        cutoff = self.cutoff(now)
+        rows = days = 0
+        with self.lock:
+            session = self.storage.Session()
+            while True:
+                first = session.execute(
+                    select(func.min(history.c.date_time)).where(history.c.date_time < cutoff)
+                ).scalar()
+                if first is None:
+                    break
+                start = datetime.datetime.combine(first.date(), datetime.time.min)
+                rows += self.compact_day(session, start, min(start + datetime.timedelta(days=1), cutoff))
+                days += 1
+            self.compacted_rows += rows
+            self.last_run = datetime.datetime.now()
+        return rows, days
+
+    # Один день: сводки по пользователям дописываются к уже свёрнутым за этот день, записи истории удаляются
+    def compact_day(self, session, start, end):
+        history, rollups = self.storage.history_table, self.storage.rollup_table
+        in_day = (history.c.date_time >= start) & (history.c.date_time < end)
+        day = start.date()
+        try:
+            existing = {
+                row.user: row for row in session.execute(select(rollups).where(rollups.c.day == day)).fetchall()
+            }
+            totals = session.execute(
+                select(
+                    history.c.name,
+                    func.count(),
+                    func.min(history.c.date_time),
+                    func.max(history.c.date_time),
+                    func.group_concat(history.c.ip.distinct()),
+                )
+                .where(in_day)
+                .group_by(history.c.name)
+            ).fetchall()
+            rows = 0
+            for user_id, logins, first_login, last_login, ips in totals:
+                ips = set(ips.split(",")) if ips else set()
+                rows += logins
+                old = existing.get(user_id)
+                if old is None:
+                    session.execute(
+                        rollups.insert().values(
+                            user=user_id,
+                            day=day,
+                            logins=logins,
+                            first_login=first_login,
+                            last_login=last_login,
+                            ip_count=len(ips),
+                            ips=IPS_SEPARATOR.join(sorted(ips)),
+                        )
+                    )
+                    continue
+                if old.ips:
+                    ips.update(old.ips.split(IPS_SEPARATOR))
+                session.execute(
+                    rollups.update()
+                    .where(rollups.c.id == old.id)
+                    .values(
+                        logins=old.logins + logins,
+                        first_login=min(old.first_login, first_login),
+                        last_login=max(old.last_login, last_login),
+                        ip_count=len(ips),
+                        ips=IPS_SEPARATOR.join(sorted(ips)),
+                    )
+                )
+            session.execute(history.delete().where(in_day))
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+        return rows
+
+    # Дневные сводки (имя, день, входов, первый вход, последний вход, адреса) за период [since, until)
+    def daily(self, username=None, since=None, until=None):
+        rollups, users = self.storage.rollup_table, self.storage.users_table
+        query = select(
+            users.c.name,
+            rollups.c.day,
+            rollups.c.logins,
+            rollups.c.first_login,
+            rollups.c.last_login,
+            rollups.c.ips,
+        ).select_from(rollups.join(users, rollups.c.user == users.c.id))
+        if username:
+            query = query.where(users.c.name == username)
+        if since is not None:
+            query = query.where(rollups.c.day >= since.date())
+        if until is not None:
+            query = query.where(rollups.c.day < until.date())
+        return self.storage.session.execute(query.order_by(rollups.c.day, users.c.name)).fetchall()
+
+    # Фоновое сворачивание: сразу при запуске сервера и затем раз в interval секунд
+    def start(self):
+        if not self.days or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name="history-retention", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                rows, days = self.compact()
+                if rows:
+                    logger.info(f"История входов: {rows} записей за {days} дн. свёрнуто в дневные сводки")
+            except SQLAlchemyError as ex:
+                logger.error(f"Ошибка сворачивания истории входов: {ex}")
+            time.sleep(self.interval)
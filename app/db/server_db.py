@@ -1,28 +1,52 @@
 import datetime
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
 
 from icecream import ic
-from sqlalchemy import (Column, DateTime, ForeignKey, Integer, MetaData,
-                        String, Table, create_engine)
-from sqlalchemy.orm import mapper, sessionmaker
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer, MetaData,
+                        String, Table, bindparam, create_engine, event,
+                        inspect, literal, tuple_)
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import mapper, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
 
+from app.common.metrics import REGISTRY
 from app.common.variables import *
+from app.db.batch_writer import BatchWriter
+from app.db.retention import HistoryRetention, create_rollup_table
+from app.db.sessions import ActiveSessions
+from app.db.storage import BaseStorage
 
+logger = logging.getLogger("server")
+
+# Метрики записи в базу: время транзакции пачки, записанные и потерянные из-за ошибок события
+DB_BATCH_SECONDS = REGISTRY.histogram("jim_db_batch_seconds", "Storage write transaction time")
+DB_EVENTS = REGISTRY.counter("jim_db_events_total", "Storage events written to the database")
+DB_ERRORS = REGISTRY.counter("jim_db_errors_total", "Storage events lost on database errors")
+
+
+# Настройка каждого нового подключения к SQLite
+def set_pragmas(dbapi_connection, connection_record, pragmas=SQLITE_PRAGMAS):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+# Хранилище в базе SQLite через SQLAlchemy: пользователи, история входов и её сводки. Активные сессии -
+# только в памяти (ActiveSessions)
+class ServerStorage(BaseStorage):
+    name = STORAGE_SQLITE
 
-class ServerStorage:
     class AllUsers:
         def __init__(self, username):
             self.name = username
             self.last_login = datetime.datetime.now()
             self.id = None
 
-    class ActiveUsers:
-        def __init__(self, user_id, ip_address, port, login_time):
-            self.user = user_id
-            self.ip_address = ip_address
-            self.port = port
-            self.login_time = login_time
-            self.id = None
-
     class LoginHistory:
         def __init__(self, name, date, ip, port):
             self.id = None
@@ -31,8 +55,27 @@ class ServerStorage:
             self.ip = ip
             self.port = port
 
-    def __init__(self):
-        self.database_engine = create_engine(SERVER_DATABASE, echo=False, pool_recycle=7200)
+    def __init__(
+        self,
+        write_behind=True,
+        database=SERVER_DATABASE,
+        commit_events=DB_COMMIT_EVENTS,
+        commit_interval=DB_COMMIT_INTERVAL,
+        cache_size=USER_CACHE_SIZE,
+        pragmas=SQLITE_PRAGMAS,
+        retention_days=HISTORY_RETENTION_DAYS,
+        sessions=None,
+    ):
+        # Подключения переиспользуются пулом и могут достаться разным потокам, поэтому check_same_thread выключен
+        self.database_engine = create_engine(
+            database,
+            echo=False,
+            pool_recycle=7200,
+            poolclass=QueuePool,
+            connect_args={"check_same_thread": False},
+        )
+        if pragmas:
+            event.listen(self.database_engine, "connect", partial(set_pragmas, pragmas=pragmas))
         self.metadata = MetaData()
 
         user_table = Table(
@@ -43,16 +86,6 @@ class ServerStorage:
             Column("last_login", DateTime),
         )
 
-        acitve_user_table = Table(
-            "Active_user",
-            self.metadata,
-            Column("id", Integer, primary_key=True),
-            Column("user", ForeignKey("Users.id")),
-            Column("ip_addtess", String),
-            Column("port", Integer),
-            Column("login_time", DateTime),
-        )
-
         user_login_history = Table(
             "Login_history",
             self.metadata,
@@ -63,41 +96,174 @@ class ServerStorage:
             Column("port", Integer),
         )
 
+        # История входов читается по пользователю и по времени. Индексы создаются и в существующей базе:
+        # create_all добавляет их только вместе с новой таблицей.
+        history_indexes = (
+            Index("Login_history_name_date_time", user_login_history.c.name, user_login_history.c.date_time),
+            Index("Login_history_date_time", user_login_history.c.date_time),
+        )
+
+        # Дневные сводки входов старше срока хранения истории (app.db.retention)
+        self.rollup_table = create_rollup_table(self.metadata)
+
         self.metadata.create_all(self.database_engine)
+        for index in history_indexes:
+            index.create(self.database_engine, checkfirst=True)
+        # Запросы потока записи (SQLAlchemy Core, без отслеживания объектов сессией) собираются один раз,
+        # при выполнении передаются только параметры
+        self.insert_user = user_table.insert()
+        self.update_login = (
+            user_table.update().where(user_table.c.id == bindparam("user_id")).values(last_login=bindparam("time"))
+        )
+        self.insert_history = user_login_history.insert()
+        self.users_table = user_table
+        self.history_table = user_login_history
+
+        # Классы отображаются на таблицы один раз на процесс, следующие хранилища используют то же отображение
+        if inspect(self.AllUsers, raiseerr=False) is None:
+            mapper(self.AllUsers, user_table)
+            mapper(self.LoginHistory, user_login_history)
 
-        mapper(self.AllUsers, user_table)
-        mapper(self.ActiveUsers, acitve_user_table)
-        mapper(self.LoginHistory, user_login_history)
+        # У каждого потока (цикл сервера, консоль, поток записи) своя сессия
+        self.Session = scoped_session(sessionmaker(bind=self.database_engine))
 
-        Session = sessionmaker(bind=self.database_engine)
-        self.session = Session()
+        # Отложенная запись: входы пользователей ставятся в очередь, фоновый поток применяет их пачками -
+        # одна транзакция на commit_events событий или commit_interval секунд. Без неё запись идёт сразу
+        # в потоке сервера.
+        self.write_behind = write_behind
+        self.writer = BatchWriter(self.write_events, commit_events, commit_interval, "storage-writer")
+        # Число транзакций и записанных событий
+        self.commits = 0
+        self.written = 0
 
-        self.session.query(self.ActiveUsers).delete()
-        self.session.commit()
+        # Справочник пользователей в памяти: имя -> id с вытеснением давно не входивших (LRU, не больше
+        # cache_size записей). Заполняется при старте последними входившими, пополняется при записи входов.
+        # Справочником пользуются поток записи и консоль, поэтому он меняется и читается под блокировкой.
+        self.cache_size = cache_size
+        self.user_ids = OrderedDict()
+        self.users_lock = threading.Lock()
+        self.warm_cache()
+        # Активные сессии процесса: вход и выход меняют только память, в базу не пишутся
+        self.sessions = ActiveSessions() if sessions is None else sessions
+        # Срок хранения подробной истории входов, фоновое сворачивание запускает сервер (retention.start)
+        self.retention = HistoryRetention(self, retention_days)
+
+    # Сессия текущего потока: сессия SQLAlchemy не потокобезопасна
+    @property
+    def session(self):
+        return self.Session()
 
     def user_login(self, username, ip_address, port):
-        print(username, ip_address, port)
-        rez = self.session.query(self.AllUsers).filter_by(name=username)
-        if rez.count():
-            user = rez.first()
-            user.last_login = datetime.datetime.now()
+        login_time = datetime.datetime.now()
+        self.sessions.login(username, ip_address, port, login_time)
+        self.submit(self.apply_login, username, ip_address, port, login_time)
+
+    def user_logout(self, username):
+        self.sessions.logout(username)
+
+    def apply_login(self, session, username, ip_address, port, login_time):
+        user_id = self.user_id(username, session)
+        if user_id is None:
+            result = session.execute(self.insert_user, {"name": username, "last_login": login_time})
+            user_id = result.inserted_primary_key[0]
+            self.remember_user(username, user_id)
         else:
-            user = self.AllUsers(username)
-            self.session.add(user)
+            session.execute(self.update_login, {"user_id": user_id, "time": login_time})
+        session.execute(
+            self.insert_history, {"name": user_id, "date_time": login_time, "ip": ip_address, "port": port}
+        )
+
+    # Заполнение справочника последними входившими пользователями. Самые недавние - в конце, как после входа.
+    def warm_cache(self):
+        query = (
+            self.session.query(self.AllUsers.id, self.AllUsers.name)
+            .order_by(self.AllUsers.last_login.desc())
+            .limit(self.cache_size)
+        )
+        with self.users_lock:
+            for user_id, name in reversed(query.all()):
+                self.user_ids[name] = user_id
+
+    def remember_user(self, username, user_id):
+        with self.users_lock:
+            self.user_ids[username] = user_id
+            self.user_ids.move_to_end(username)
+            if len(self.user_ids) > self.cache_size:
+                self.user_ids.popitem(last=False)
+
+    # id пользователя по имени: из справочника, при промахе - из базы (запрос - без блокировки справочника).
+    # None - пользователь неизвестен.
+    def user_id(self, username, session=None):
+        with self.users_lock:
+            user_id = self.user_ids.get(username)
+        if user_id is None:
+            user = (session or self.session).query(self.AllUsers.id).filter_by(name=username).first()
+            if user is None:
+                return None
+            user_id = user.id
+        self.remember_user(username, user_id)
+        return user_id
+
+    # Запись события: сразу или через очередь фонового потока
+    def submit(self, func, *args):
+        if not self.write_behind:
+            func(self.session, *args)
             self.session.commit()
+            return
+        self.writer.submit((func, args))
 
-        new_active_user = self.ActiveUsers(user.id, ip_address, port, datetime.datetime.now())
-        self.session.add(new_active_user)
+    # Пачка событий от потока записи, у него своя сессия
+    def write_events(self, batch):
+        start = time.perf_counter()
+        self.write_batch(self.session, batch)
+        DB_BATCH_SECONDS.observe(time.perf_counter() - start)
 
-        history = self.LoginHistory(user.id, datetime.datetime.now(), ip_address, port)
-        self.session.add(history)
+    # Пачка событий одной транзакцией. При ошибке события повторяются по одному, чтобы одно
+    # некорректное событие не отменило остальные.
+    def write_batch(self, session, batch):
+        try:
+            for func, args in batch:
+                func(session, *args)
+            session.commit()
+        except SQLAlchemyError as ex:
+            session.rollback()
+            # В справочнике могли остаться id пользователей из отменённой транзакции
+            with self.users_lock:
+                self.user_ids.clear()
+            if len(batch) == 1:
+                logger.error(f"Ошибка записи в базу данных: {ex}")
+                DB_ERRORS.inc()
+                return
+            for item in batch:
+                self.write_batch(session, [item])
+            return
+        self.commits += 1
+        self.written += len(batch)
+        DB_EVENTS.inc(len(batch))
 
-        self.session.commit()
+    # Снимки сессий и фоновое сворачивание истории запускаются после создания процессов-обработчиков (fork)
+    def start(self):
+        super().start()
+        self.retention.start()
 
-    def user_logout(self, username):
-        user = self.session.query(self.AllUsers).filter_by(user=username).first()
-        self.session.query(self.ActiveUsers).fiter_by(user=user.id).delete()
-        self.session.commit()
+    def pending(self):
+        return self.writer.pending()
+
+    def flush(self):
+        self.writer.flush()
+
+    # Завершение работы: очередь записывается до конца, поток записи останавливается.
+    # Последующие события пишутся сразу.
+    def close(self):
+        self.write_behind = False
+        self.writer.close()
+        super().close()
+
+    def status(self):
+        return (
+            f"Ожидают записи в базу {self.pending()} событий, задержка последней пачки "
+            f"{self.writer.lag * 1000:.1f} мс. Записано {self.written} событий за {self.commits} транзакций"
+        )
 
     def user_list(self):
         query = self.session.query(
@@ -106,29 +272,57 @@ class ServerStorage:
         )
         return query.all()
 
-    def active_user_list(self):
-        query = self.session.query(
-            self.AllUsers.name, self.ActiveUsers.ip_address, self.ActiveUsers.port, self.ActiveUsers.login_time
-        ).join(self.AllUsers)
-        print(f"Выводим {query.all()}")
-        return query.all()
+    def login_history(self, username=None, since=None, until=None):
+        return [row[:4] for row in self.iter_login_history(username, since, until)]
 
-    def login_history(self, username=None):
-        query = self.session.query(
-            self.AllUsers.name, self.LoginHistory.date_time, self.LoginHistory.ip, self.LoginHistory.port
-        ).join(self.AllUsers)
+    # История входов потоком: строки читаются из базы пачками по batch, без загрузки всей таблицы в память
+    def iter_login_history(self, username=None, since=None, until=None, batch=LOGHIST_BATCH):
+        query = self.history_query(username, since, until)
+        if query is not None:
+            yield from query.yield_per(batch)
+
+    # Страница истории входов по ключу: записи строго после курсора after = (время, id) в порядке времени входа,
+    # не больше limit. Возвращает строки и курсор следующей страницы (None, если записей больше нет).
+    # Курсор, в отличие от OFFSET, не заставляет базу перебирать уже показанные строки.
+    def login_history_page(self, username=None, after=None, limit=LOGHIST_PAGE_SIZE, since=None, until=None):
+        query = self.history_query(username, since, until)
+        if query is None:
+            return [], None
+        if after is not None:
+            query = query.filter(tuple_(self.LoginHistory.date_time, self.LoginHistory.id) > tuple_(*after))
+        rows = query.limit(limit).all()
+        cursor = (rows[-1].date_time, rows[-1].id) if len(rows) == limit else None
+        return rows, cursor
+
+    # Запрос истории входов: строки (имя, время, ip, порт, id) в порядке (время, id), период [since, until).
+    # None - пользователь неизвестен.
+    def history_query(self, username=None, since=None, until=None):
+        history = self.LoginHistory
+        columns = (history.date_time, history.ip, history.port, history.id)
         if username:
-            query = query.filter(self.AllUsers.name == username)
-        return query.all()
+            # История одного пользователя - по id из справочника, без соединения с таблицей пользователей
+            user_id = self.user_id(username)
+            if user_id is None:
+                return None
+            query = self.session.query(literal(username).label("name"), *columns).filter(history.name == user_id)
+        else:
+            query = self.session.query(self.AllUsers.name, *columns).select_from(history).join(self.AllUsers)
+        if since is not None:
+            query = query.filter(history.date_time >= since)
+        if until is not None:
+            query = query.filter(history.date_time < until)
+        return query.order_by(history.date_time, history.id)
 
 
 if __name__ == "__main__":
     test_db = ServerStorage()
     test_db.user_login("client_1", "192.168.1.4", 8888)
     test_db.user_login("client_2", "192.168.1.5", 7777)
+    test_db.flush()
     ic(test_db.active_user_list())
 
     test_db.user_logout("client_1")
+    test_db.flush()
     ic(test_db.active_user_list())
 
     test_db.login_history("client_1")
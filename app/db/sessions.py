@@ -0,0 +1,115 @@
+import datetime
+import json
+import logging
+import os
+import threading
+
+from app.common.variables import *
+
+SNAPSHOT_SUFFIX = ".json"
+
+logger = logging.getLogger("server")
+
+
+# Активные сессии процесса в памяти: имя -> (ip, порт, время входа). Вход и выход не пишут в базу,
+# список активных пользователей строится из словаря за O(активных). Для консоли главного процесса
+# многопроцессного сервера и внешних инструментов состояние раз в interval секунд (если менялось)
+# сохраняется снимком в файл directory/<owner>.json. directory = None - без снимков.
+class ActiveSessions:
+    __slots__ = ("directory", "owner", "interval", "active", "changes", "saved", "thread", "stopped")
+
+    def __init__(self, directory=None, owner="server", interval=SESSION_SNAPSHOT_INTERVAL):
+        self.directory = directory
+        self.owner = owner
+        self.interval = interval
+        self.active = dict()
+        # Счётчик изменений и его значение на момент последнего снимка
+        self.changes = 0
+        self.saved = 0
+        self.thread = None
+        self.stopped = threading.Event()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def login(self, username, ip_address, port, login_time):
+        self.active[username] = (ip_address, port, login_time)
+        self.changes += 1
+
+    def logout(self, username):
+        if self.active.pop(username, None) is not None:
+            self.changes += 1
+
+    # Активные пользователи (имя, ip, порт, время входа)
+    def rows(self):
+        return [(name, *session) for name, session in list(self.active.items())]
+
+    def __len__(self):
+        return len(self.active)
+
+    def snapshot_path(self, owner=None):
+        return os.path.join(self.directory, f"{owner or self.owner}{SNAPSHOT_SUFFIX}")
+
+    # Снимок пишется во временный файл и подменяет прежний: читатель не увидит недописанный файл
+    def save(self):
+        changes = self.changes
+        if not self.directory or changes == self.saved:
+            return False
+        sessions = [(name, ip, port, login_time.isoformat()) for name, ip, port, login_time in self.rows()]
+        path = self.snapshot_path()
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump({"owner": self.owner, "time": datetime.datetime.now().isoformat(), "sessions": sessions}, file)
+        os.replace(path + ".tmp", path)
+        self.saved = changes
+        return True
+
+    # Сессии из снимков всех процессов каталога (с задержкой до interval секунд)
+    def load_all(self):
+        if not self.directory:
+            return []
+        rows = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(SNAPSHOT_SUFFIX):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError) as ex:
+                logger.error(f"Не удалось прочитать снимок сессий {name}: {ex}")
+                continue
+            for username, ip, port, login_time in snapshot["sessions"]:
+                rows.append((username, ip, port, datetime.datetime.fromisoformat(login_time)))
+        return rows
+
+    # Снимки после перезапуска ничего не значат: их удаляет главный процесс при старте
+    def clear(self):
+        if not self.directory:
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(SNAPSHOT_SUFFIX):
+                os.remove(os.path.join(self.directory, name))
+
+    # Фоновое сохранение снимков раз в interval секунд
+    def start(self):
+        if not self.directory or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name="session-snapshots", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.save()
+            except OSError as ex:
+                logger.error(f"Ошибка сохранения снимка сессий: {ex}")
+
+    # Остановка: сессий процесса больше нет, его снимок удаляется
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.directory:
+            try:
+                os.remove(self.snapshot_path())
+            except FileNotFoundError:
+                pass
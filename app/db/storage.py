@@ -0,0 +1,80 @@
+from app.common.variables import *
+from app.db.sessions import ActiveSessions
+
+
+# Хранилище пользователей и истории входов, с которым работает сервер. Реализации регистрируются по имени
+# (--storage): ServerStorage - SQLite через SQLAlchemy (app.db.server_db), MemoryStorage - словари в памяти
+# процесса (app.db.memory_storage). Строки истории входов - (имя, время входа, ip, порт, id).
+# Активные сессии реализации держат в памяти (self.sessions, ActiveSessions), в базу они не пишутся.
+class BaseStorage:
+    __slots__ = ()
+
+    name = None
+    # Сворачивание старой истории входов (HistoryRetention) или None, если хранилище его не ведёт
+    retention = None
+
+    def user_login(self, username, ip_address, port):
+        raise NotImplementedError
+
+    def user_logout(self, username):
+        raise NotImplementedError
+
+    # Известные пользователи: (имя, последний вход)
+    def user_list(self):
+        raise NotImplementedError
+
+    # Активные пользователи (имя, ip, порт, время входа) из памяти; shared - из снимков всех процессов
+    def active_user_list(self, shared=False):
+        if shared:
+            return self.sessions.load_all()
+        return self.sessions.rows()
+
+    # История входов (имя, время, ip, порт) в порядке времени входа за период [since, until)
+    def login_history(self, username=None, since=None, until=None):
+        raise NotImplementedError
+
+    # Страница истории входов строго после курсора after = (время, id), не больше limit строк.
+    # Возвращает строки и курсор следующей страницы (None, если записей больше нет).
+    def login_history_page(self, username=None, after=None, limit=LOGHIST_PAGE_SIZE, since=None, until=None):
+        raise NotImplementedError
+
+    # Фоновые задачи хранилища, сервер запускает их после создания процессов-обработчиков
+    def start(self):
+        self.sessions.start()
+
+    # Сколько событий ждёт записи
+    def pending(self):
+        return 0
+
+    # Ожидание записи всех событий
+    def flush(self):
+        pass
+
+    def close(self):
+        self.sessions.close()
+
+    # Состояние хранилища для команды консоли storage
+    def status(self):
+        return f"Хранилище {self.name}"
+
+
+# Хранилище по имени. Снимки сессий процесса owner сохраняются в sessions_dir (None - без снимков),
+# clear_active - удалить при старте снимки прошлого запуска (только главный процесс).
+def create_storage(
+    backend=DEFAULT_STORAGE,
+    clear_active=True,
+    retention_days=HISTORY_RETENTION_DAYS,
+    sessions_dir=None,
+    owner="server",
+):
+    sessions = ActiveSessions(sessions_dir, owner)
+    if clear_active:
+        sessions.clear()
+    # Импорт внутри функции: модули реализаций сами импортируют BaseStorage отсюда
+    if backend == STORAGE_MEMORY:
+        from app.db.memory_storage import MemoryStorage
+
+        return MemoryStorage(sessions)
+    from app.db.server_db import ServerStorage
+
+    return ServerStorage(retention_days=retention_days, sessions=sessions)
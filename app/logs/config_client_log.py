@@ -5,6 +5,7 @@ sys.path.append("../")
 import logging
 
 from app.common.variables import LOGGING_LEVEL
+from app.logs.pipeline import BatchFileHandler, BatchStreamHandler, LogPipeline
 
 # создаём формировщик логов (formatter):
 client_formatter = logging.Formatter("%(asctime)s %(levelname)s %(filename)s %(message)s")
@@ -14,16 +15,17 @@ path = os.path.dirname(os.path.abspath(__file__))
 path = os.path.join(path, "client.log")
 
 # создаём потоки вывода логов
-steam = logging.StreamHandler(sys.stderr)
+steam = BatchStreamHandler(sys.stderr)
 steam.setFormatter(client_formatter)
 steam.setLevel(logging.ERROR)
-log_file = logging.FileHandler(path, encoding="utf8")
+log_file = BatchFileHandler(path, encoding="utf8")
 log_file.setFormatter(client_formatter)
 
 # создаём регистратор и настраиваем его
+# Терминал и файл пишет фоновый поток, потоки клиента только ставят запись в очередь
+pipeline = LogPipeline([steam, log_file])
 logger = logging.getLogger("client")
-logger.addHandler(steam)
-logger.addHandler(log_file)
+logger.addHandler(pipeline)
 logger.setLevel(LOGGING_LEVEL)
 
 # отладка
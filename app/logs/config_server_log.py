@@ -6,6 +6,8 @@ import logging.handlers
 import os
 
 from ..common.variables import LOGGING_LEVEL
+from .pipeline import (BatchStreamHandler, BatchTimedRotatingFileHandler,
+                       LogPipeline)
 
 # создаём формировщик логов (formatter):
 server_formatter = logging.Formatter("%(asctime)s %(levelname)s %(filename)s %(message)s")
@@ -15,16 +17,17 @@ path = os.path.dirname(os.path.abspath(__file__))
 path = os.path.join(path, "server.log")
 
 # создаём потоки вывода логов
-steam = logging.StreamHandler(sys.stderr)
+steam = BatchStreamHandler(sys.stderr)
 steam.setFormatter(server_formatter)
 steam.setLevel(logging.DEBUG)
-log_file = logging.handlers.TimedRotatingFileHandler(path, encoding="utf8", interval=1, when="D")
+log_file = BatchTimedRotatingFileHandler(path, encoding="utf8", interval=1, when="D")
 log_file.setFormatter(server_formatter)
 
 # создаём регистратор и настраиваем его
+# Терминал и файл пишет фоновый поток, поток сервера только ставит запись в очередь
+pipeline = LogPipeline([steam, log_file])
 logger = logging.getLogger("server")
-logger.addHandler(steam)
-logger.addHandler(log_file)
+logger.addHandler(pipeline)
 logger.setLevel(LOGGING_LEVEL)
 
 # отладка
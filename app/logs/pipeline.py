@@ -0,0 +1,142 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import traceback
+
+from app.common.variables import *
+
+
+# Обработчик, который не сбрасывает буфер после каждой записи: поток записи лога сбрасывает его один раз
+# после пачки записей (flush_batch)
+class BatchFlush:
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+    def close(self):
+        self.flush_batch()
+        super().close()
+
+
+class BatchStreamHandler(BatchFlush, logging.StreamHandler):
+    pass
+
+
+class BatchFileHandler(BatchFlush, logging.FileHandler):
+    pass
+
+
+class BatchTimedRotatingFileHandler(BatchFlush, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+# Асинхронный вывод лога: запись ставится в ограниченную очередь, в терминал и файл её пишет фоновый поток
+# пачками до batch записей. При переполнении очереди policy = drop отбрасывает запись (поток сервера не ждёт
+# диск), block - ждёт места в очереди (записи не теряются). Поток запускается при первой записи и заново
+# в процессе-обработчике после fork: поток родителя в дочерний процесс не переходит.
+class LogPipeline(logging.handlers.QueueHandler):
+    def __init__(self, handlers, size=LOG_QUEUE_SIZE, policy=LOG_QUEUE_POLICY, batch=LOG_BATCH):
+        super().__init__(queue.Queue(size))
+        self.handlers = handlers
+        self.size = size
+        self.policy = policy
+        self.batch = batch
+        self.pid = None
+        self.thread = None
+        # Сколько записей выведено, отброшено при переполнении очереди и сколько было пачек
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    # Аргументы подставляются в сообщение сразу (объекты в args могут измениться до вывода), остальное
+    # форматирование, включая трассировку исключения, - в потоке записи. Запись не копируется: других
+    # обработчиков у логгера нет.
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        elif self.thread is None:
+            # После остановки потока (выход из программы) записи выводятся сразу
+            self.write([record])
+            return
+        if self.policy == LOG_POLICY_BLOCK:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        self.queue = queue.Queue(self.size)
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # None - сигнал остановки (stop)
+            records = [record for record in batch if record is not None]
+            running = len(records) == len(batch)
+            if records:
+                try:
+                    self.write(records)
+                except Exception:
+                    # Поток записи не должен останавливаться: иначе flush будет ждать вечно, а при политике
+                    # block встанет и поток сервера
+                    traceback.print_exc(file=sys.stderr)
+            for _ in batch:
+                self.queue.task_done()
+
+    def write(self, records):
+        for record in records:
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+        for handler in self.handlers:
+            getattr(handler, "flush_batch", handler.flush)()
+        self.written += len(records)
+        self.batches += 1
+
+    # Ожидание вывода всех поставленных в очередь записей
+    def flush(self):
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            self.queue.join()
+
+    # Очередь выводится до конца, поток останавливается
+    def stop(self):
+        thread, self.thread = self.thread, None
+        if thread is None or self.pid != os.getpid() or not thread.is_alive():
+            return
+        self.queue.put(None)
+        thread.join()
+
+    def close(self):
+        self.stop()
+        for handler in self.handlers:
+            handler.close()
+        super().close()
+
+    def status(self):
+        return (
+            f"в очереди {self.queue.qsize()} из {self.size}, выведено {self.written} записей "
+            f"за {self.batches} пачек, отброшено {self.dropped} ({self.policy})"
+        )
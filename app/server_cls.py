@@ -1,16 +1,55 @@
 import argparse
-import select
+import datetime
+import selectors
 import sys
-from socket import AF_INET, SOCK_STREAM, socket
-from threading import Thread
+import time
+from collections import deque
+from functools import partial
+from socket import (AF_INET, SO_REUSEPORT, SOCK_STREAM, SOL_SOCKET, SOMAXCONN,
+                    socket)
+from threading import Event, Thread
+
+from sqlalchemy.exc import SQLAlchemyError
 
 from app.common.decos import try_except_wrapper
 from app.common.descriptor import Port
+from app.common.errors import IncorrectDataRecivedError, MessageEncodeError
+from app.common.metrics import REGISTRY, format_labels, start_metrics_server
+from app.common.codecs import JSON_CODEC, choose_codec, get_codec
+from app.common.compression import choose_compression, create_compressor, create_decompressor
+from app.common.framing import choose_framing, encode_frame
 from app.common.meta import ServerVerifier
+from app.common.profiling import CallProfiler, MemoryTracer, SamplingProfiler, dump_report
 from app.common.utils import *
 from app.common.variables import *
-from app.db.server_db import ServerStorage
-from app.logs.config_server_log import logger
+from app.connection_cls import Connection, Relay
+from app.db.archive import MessageArchive
+from app.db.message_log import MessageLog
+from app.db.storage import create_storage
+from app.logs.config_server_log import logger, pipeline as log_pipeline
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Метрики сервера (app.common.metrics): команда консоли stats и HTTP /metrics в формате Prometheus
+CONNECTIONS_ACCEPTED = REGISTRY.counter("jim_connections_accepted_total", "Accepted client connections")
+LOOP_SECONDS = REGISTRY.histogram("jim_loop_pass_seconds", "Event loop pass time, without waiting in select")
+REQUESTS = {
+    action: REGISTRY.counter("jim_requests_total", "Parsed client requests by action", action=action)
+    for action in (PRESENCE, MESSAGE, BATCH, JOIN, LEAVE, EXIT, "other")
+}
+MESSAGES_RELAYED = REGISTRY.counter("jim_messages_total", "Messages to users and rooms by route", route="relay")
+MESSAGES_DIRECT = REGISTRY.counter("jim_messages_total", "Messages to users and rooms by route", route="direct")
+MESSAGES_ROOM = REGISTRY.counter("jim_messages_total", "Messages to users and rooms by route", route="room")
+MESSAGES_OFFLINE = REGISTRY.counter("jim_messages_total", "Messages to users and rooms by route", route="offline")
+MESSAGES_UNDELIVERED = REGISTRY.counter(
+    "jim_messages_total", "Messages to users and rooms by route", route="undelivered"
+)
+ACK_DISPATCH_SECONDS = REGISTRY.histogram(
+    "jim_ack_dispatch_seconds", "Receive to recipient queue time of acknowledged messages"
+)
 
 
 class ServerThread(Thread):
@@ -30,34 +69,129 @@ class ServerThread(Thread):
 
 
 class Server(metaclass=ServerVerifier):
-    __slots__ = ("bind_addr", "_port", "logger", "socket", "clients", "listener", "messages", "names", "storage")
+    __slots__ = (
+        "bind_addr",
+        "_port",
+        "logger",
+        "socket",
+        "clients",
+        "listener",
+        "messages",
+        "names",
+        "storage",
+        "outbox_limit",
+        "outbox_policy",
+        "selector",
+        "changes",
+        "offline",
+        "rooms",
+        "compress_threshold",
+        "archive",
+        "metrics_port",
+        "stats_mark",
+        "received",
+        "profiler",
+        "tracer",
+        "calls",
+    )
 
 
     TCP = (AF_INET, SOCK_STREAM)
     TIMEOUT = 5
+    # Сколько подключений принимать за одно пробуждение, чтобы шквал подключений не останавливал обмен
+    ACCEPT_BATCH = 256
+    # SO_REUSEPORT на слушающем сокете - нужен, когда порт слушают несколько процессов
+    REUSE_PORT = False
+    # Сессии клиентов ведут другие процессы: консоль читает активных пользователей из их снимков, а не из памяти
+    SHARED_SESSIONS = False
+    # Профилировать цикл сервера из консоли можно, только если он работает в этом процессе
+    PROFILING = True
     port = Port("_port")
 
-    def __init__(self, bind_addr, port, storage):
+    def __init__(
+        self,
+        bind_addr,
+        port,
+        storage,
+        outbox_limit=OUTBOX_LIMIT,
+        outbox_policy=DEFAULT_OUTBOX_POLICY,
+        message_log=None,
+        compress_threshold=COMPRESSION_THRESHOLD,
+        archive=None,
+        metrics_port=METRICS_PORT,
+    ):
         self.logger = logger
         self.bind_addr = bind_addr
         self.port = port
-        # список клиентов , очередь сообщений
-        self.clients = []
+        # клиенты по дескриптору сокета, очередь сообщений - пары (словарь или Relay, соединение отправителя)
+        self.clients = dict()
         self.messages = []
         # Словарь, содержащий имена пользователей и соответствующие им сокеты.
         self.names = dict()
         self.storage = storage
+        # Ограничение очереди исходящих данных каждого клиента и политика при её переполнении
+        self.outbox_limit = outbox_limit
+        self.outbox_policy = outbox_policy
+        # Селектор (epoll в Linux) со слушающим сокетом и клиентами. Клиент ждёт записи, только пока у него
+        # есть неотправленные данные.
+        self.selector = selectors.DefaultSelector()
+        # Соединения, чью регистрацию в селекторе нужно пересмотреть в конце прохода цикла
+        self.changes = set()
+        # Журнал сообщений для пользователей не в сети (MessageLog) или None - такие сообщения отбрасываются
+        self.offline = message_log
+        # Комнаты: имя комнаты -> множество соединений участников
+        self.rooms = dict()
+        # Порог сжатия кадров для клиентов, согласовавших сжатие
+        self.compress_threshold = compress_threshold
+        # Архив сообщений с поиском (MessageArchive) или None
+        self.archive = archive
+        # Порт HTTP-сервера метрик (0 - выключен)
+        self.metrics_port = metrics_port
+        # Последние показанные командой stats значения счётчиков и время показа - для скорости между вызовами
+        self.stats_mark = (time.monotonic(), dict())
+        # Время приёма (time.time()) сообщений текущего прохода цикла - для подтверждений
+        self.received = 0.0
+        # Запущенный из консоли профилировщик цикла сервера и снимки памяти tracemalloc
+        self.profiler = None
+        self.tracer = MemoryTracer()
+        # Функции, которые консоль передала на выполнение в потоке цикла сервера между проходами
+        self.calls = deque()
+        self.register_gauges()
+
+
+    def start(self, request_count=SOMAXCONN):
+        self.raise_fd_limit()
+        self.open_socket(request_count)
+        self.start_metrics(self.metrics_port)
+        # Фоновые задачи хранилища запускаются после создания процессов-обработчиков (fork)
+        self.storage.start()
+        self.listener = ServerThread(self.listen, self.logger, self.storage)
+        self.listener.start()
+        self.__console()
+        # Недописанные в базу события записываются до выхода
+        self.storage.close()
+        if self.archive is not None:
+            self.archive.close()
 
-
-    def start(self, request_count=5):
+    def open_socket(self, request_count=SOMAXCONN):
         self.socket = socket(*self.TCP)
-        self.socket.settimeout(0.5)
+        self.socket.setblocking(False)
+        if self.REUSE_PORT:
+            self.socket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
         self.socket.bind((self.bind_addr, self.port))
         self.logger.info(f"Порт сервера - {self.port}| адресс - {self.bind_addr}")
         self.socket.listen(request_count)
-        self.listener = ServerThread(self.listen, self.logger, self.storage)
-        self.listener.start()
-        self.__console()
+
+    # Каждый клиент - открытый дескриптор, поэтому мягкий лимит открытых файлов поднимаем до жёсткого
+    def raise_fd_limit(self):
+        if resource is None:
+            return
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            try:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            except (ValueError, OSError) as ex:
+                self.logger.warning(f"Не удалось поднять лимит открытых файлов: {ex}")
 
     def print_help(self):
         txt = (
@@ -65,6 +199,16 @@ class Server(metaclass=ServerVerifier):
             "users - список известных пользователей\n"
             "connected - список подключенных пользователей\n"
             "loghist - история входов пользователя\n"
+            "queues - очереди исходящих сообщений клиентов\n"
+            "compression - сжатие трафика клиентов\n"
+            "storage - состояние хранилища и очередь записи в базу данных\n"
+            "logdaily - дневные сводки входов старше срока хранения истории\n"
+            "maintenance - свернуть устаревшую историю входов сейчас\n"
+            "search - поиск по архиву сообщений\n"
+            "logging - очередь вывода лога\n"
+            "stats - метрики сервера: счётчики, скорость с прошлого вызова, время цикла и записи в базу\n"
+            "profile - запустить или остановить профилирование цикла сервера, отчёт - в файл\n"
+            "memory - снимки памяти tracemalloc: рост по местам выделения с прошлого снимка\n"
             "exit - завершение работы сервера\n"
             "help - вывод справки по поддерживаемым командамn\n"
         )
@@ -83,140 +227,777 @@ class Server(metaclass=ServerVerifier):
                 for user in sorted(self.storage.user_list()):
                     print(f"Пользователь {user[0]}, последний вход: {user[1]}")
             elif command == "connected":
-                for user in sorted(self.storage.active_user_list()):
+                for user in sorted(self.storage.active_user_list(self.SHARED_SESSIONS)):
                     print(
                         f"Пользователь {user[0]}, подключен: {user[1]}:{user[2]}, время установки соединения: {user[3]}"
                     )
             elif command == "loghist":
-                name = input(
-                    "Введите имя пользователя для просмотра истории. Для вывода всей истории, просто нажмите Enter: "
+                self.print_login_history()
+            elif command == "queues":
+                for client in self.connections():
+                    paused = ", чтение приостановлено" if client.blocked_by else ""
+                    print(
+                        f"Клиент {client.name or client.getpeername()}: в очереди {client.out_bytes} байт, "
+                        f"кадров {len(client.outbox)}, отброшено {client.dropped}{paused}, "
+                        f"отправлено кадров {client.sent_frames} за {client.send_calls} вызовов"
+                    )
+            elif command == "compression":
+                self.print_compression()
+            elif command == "logdaily":
+                self.print_daily_history()
+            elif command == "maintenance":
+                if self.storage.retention is None:
+                    print("Хранилище не сворачивает историю входов.")
+                    continue
+                try:
+                    rows, days = self.storage.retention.compact()
+                except SQLAlchemyError as ex:
+                    print(f"Ошибка сворачивания истории входов: {ex}")
+                    continue
+                print(
+                    f"Свёрнуто {rows} записей истории входов за {days} дн. "
+                    f"Срок хранения истории: {self.storage.retention.days or 'без ограничения'} дн."
                 )
-                for user in sorted(self.storage.login_history(name)):
-                    print(f"Пользователь: {user[0]} время входа: {user[1]}. Вход с: {user[2]}:{user[3]}")
+            elif command == "search":
+                self.print_search()
+            elif command == "logging":
+                print(f"Лог сервера: {log_pipeline.status()}")
+            elif command == "storage":
+                print(self.storage.status())
+            elif command == "stats":
+                self.print_stats()
+            elif command == "profile":
+                self.toggle_profile()
+            elif command == "memory":
+                self.memory_snapshot()
             else:
                 print("Команда не распознана.")
 
 
-    def listen(self):
-        self.logger.info("Запусп прослушки")
+    # История входов постранично (по LOGHIST_PAGE_SIZE строк) с фильтром по пользователю и периоду
+    def print_login_history(self):
+        name = input(
+            "Введите имя пользователя для просмотра истории. Для вывода всей истории, просто нажмите Enter: "
+        )
+        try:
+            since = parse_time(input("Начало периода (ГГГГ-ММ-ДД [ЧЧ:ММ]), Enter - с начала: "))
+            until = parse_time(input("Конец периода (ГГГГ-ММ-ДД [ЧЧ:ММ]), Enter - до текущего момента: "))
+        except ValueError:
+            print("Неверный формат даты.")
+            return
+        after = None
+        while True:
+            rows, after = self.storage.login_history_page(name, after, LOGHIST_PAGE_SIZE, since, until)
+            for user in rows:
+                print(f"Пользователь: {user[0]} время входа: {user[1]}. Вход с: {user[2]}:{user[3]}")
+            if after is None or input("Enter - следующая страница, q - завершить: ") == "q":
+                break
+
+    # Дневные сводки входов за период
+    def print_daily_history(self):
+        if self.storage.retention is None:
+            print("Хранилище не ведёт дневные сводки входов.")
+            return
+        name = input("Введите имя пользователя. Для всех пользователей просто нажмите Enter: ")
+        try:
+            since = parse_time(input("Начало периода (ГГГГ-ММ-ДД), Enter - с начала: "))
+            until = parse_time(input("Конец периода (ГГГГ-ММ-ДД), Enter - до текущего момента: "))
+        except ValueError:
+            print("Неверный формат даты.")
+            return
+        for row in self.storage.retention.daily(name, since, until):
+            print(
+                f"Пользователь: {row.name} {row.day}: входов {row.logins}, первый {row.first_login}, "
+                f"последний {row.last_login}. Адреса: {row.ips}"
+            )
+
+    # Поиск по архиву сообщений: по словам текста, отправителю, получателю и периоду, страницами
+    def print_search(self):
+        if self.archive is None:
+            print("Архив сообщений отключён.")
+            return
+        words = input("Слова для поиска, Enter - любой текст: ")
+        sender = input("Отправитель, Enter - любой: ")
+        recipient = input("Получатель или комната, Enter - любой: ")
+        try:
+            since = parse_time(input("Начало периода (ГГГГ-ММ-ДД [ЧЧ:ММ]), Enter - с начала: "))
+            until = parse_time(input("Конец периода (ГГГГ-ММ-ДД [ЧЧ:ММ]), Enter - до текущего момента: "))
+        except ValueError:
+            print("Неверный формат даты.")
+            return
+        before = None
         while True:
-            # Ждём подключения, если таймаут вышел, ловим исключение.
+            rows, before = self.archive.search(words, sender, recipient, since, until, before)
+            for row in rows:
+                print(f"{datetime.datetime.fromtimestamp(row.time)} {row.sender} -> {row.recipient}: {row.text}")
+            if before is None or input("Enter - следующая страница, q - завершить: ") == "q":
+                break
+
+    # HTTP-сервер метрик на локальном адресе; если порт занят, сервер работает без него
+    def start_metrics(self, port):
+        if not port:
+            return
+        try:
+            start_metrics_server(port)
+        except OSError as ex:
+            self.logger.error(f"Не удалось запустить HTTP-сервер метрик на порту {port}: {ex}")
+            return
+        self.logger.info(f"Метрики в формате Prometheus: http://{METRICS_ADDR}:{port}/metrics")
+
+    # Метрики-функции текущего состояния сервера: считаются только при чтении метрик
+    def register_gauges(self):
+        REGISTRY.gauge("jim_connections", "Open client connections", lambda: len(self.clients))
+        REGISTRY.gauge("jim_users", "Logged in users", lambda: len(self.names))
+        REGISTRY.gauge("jim_rooms", "Rooms with members", lambda: len(self.rooms))
+        REGISTRY.gauge(
+            "jim_outbox_bytes", "Bytes queued to clients", lambda: sum(c.out_bytes for c in self.connections())
+        )
+        REGISTRY.gauge("jim_storage_pending", "Storage events waiting for the database", lambda: self.storage.pending())
+        # Очередь лога читается при каждом вызове: поток записи заменяет её при запуске (в том числе после fork)
+        REGISTRY.gauge("jim_log_queue", "Log records waiting for the writer thread", lambda: log_pipeline.queue.qsize())
+        if self.archive is not None:
+            REGISTRY.gauge("jim_archive_pending", "Messages waiting for the archive", self.archive.writer.pending)
+
+    # Метрики процесса: значение, для счётчиков - скорость в секунду с прошлого вызова stats,
+    # для гистограмм - число наблюдений и оценки медианы и 99-го процентиля по корзинам
+    def print_stats(self):
+        now = time.monotonic()
+        last_time, last_values = self.stats_mark
+        values = dict()
+        for name, kind, _, labels, metric in REGISTRY.collect():
+            title = name + format_labels(labels)
+            if kind == "histogram":
+                _, total_sum, count = metric.collect()
+                print(
+                    f"{title}: {count} наблюдений, среднее {total_sum / max(count, 1) * 1000:.3f} мс, "
+                    f"50% <= {metric.quantile(0.5) * 1000:g} мс, 99% <= {metric.quantile(0.99) * 1000:g} мс"
+                )
+            elif kind == "counter":
+                values[title] = value = metric.collect()
+                rate = (value - last_values.get(title, 0)) / max(now - last_time, 1e-9)
+                print(f"{title}: {value}, {rate:.1f}/с")
+            else:
+                print(f"{title}: {metric.collect()}")
+        self.stats_mark = (now, values)
+
+    # Выполнение func в потоке цикла сервера: в начале следующего прохода, не позже чем через TIMEOUT секунд.
+    # Возвращает False, если поток не выполнил её за это время (func всё равно выполнится позже).
+    def in_listener(self, func):
+        done = Event()
+
+        def call():
+            func()
+            done.set()
+
+        self.call_soon(call)
+        return done.wait(self.TIMEOUT + 1)
+
+    def call_soon(self, func):
+        self.calls.append(func)
+
+    def run_calls(self):
+        while self.calls:
             try:
-                client, addr = self.socket.accept()
-            except OSError:
-                pass
+                self.calls.popleft()()
             except Exception as ex:
-                self.logger.error(ex)
+                self.logger.error(f"Ошибка вызова из консоли в потоке сервера: {ex}")
+
+    # Профилирование цикла сервера без остановки обмена: первый вызов запускает профилировщик, второй
+    # останавливает его и выводит самые горячие функции, отчёт сохраняется в PROFILE_DIR.
+    # sample - выборки стека потока сервера из отдельного потока, cprofile - все вызовы в потоке сервера.
+    def toggle_profile(self):
+        if not self.PROFILING:
+            print("Цикл сервера работает в процессах-обработчиках, профилирование из консоли недоступно.")
+            return
+        if self.profiler is None:
+            kind = input(f"Профилировщик ({', '.join(PROFILERS)}, по умолчанию {PROFILER_SAMPLE}): ") or PROFILER_SAMPLE
+            if kind not in PROFILERS:
+                print("Неизвестный профилировщик.")
+                return
+            if kind == PROFILER_SAMPLE:
+                self.profiler = SamplingProfiler(self.listener.ident)
+                self.profiler.start()
             else:
-                self.logger.info(f"Установлено соединение с ПК {addr}")
-                self.clients.append(client)
+                self.profiler = CallProfiler()
+                if not self.in_listener(self.profiler.start):
+                    print("Поток сервера занят, профилирование начнётся, когда он освободится.")
+            print("Профилирование запущено, остановка - повторная команда profile.")
+            return
+        profiler, self.profiler = self.profiler, None
+        if profiler.kind == PROFILER_SAMPLE:
+            profiler.stop()
+        elif not self.in_listener(profiler.stop):
+            print("Поток сервера занят, отчёт может быть неполным.")
+        lines = profiler.report(PROFILE_TOP)
+        print("\n".join(lines))
+        print(f"Отчёт сохранён в {dump_report(profiler.kind, lines)}")
+
+    # Снимки памяти: первый вызов включает tracemalloc, следующие выводят места выделения с наибольшим
+    # ростом памяти с прошлого снимка или выключают трассировку
+    def memory_snapshot(self):
+        if not self.PROFILING:
+            print("Цикл сервера работает в процессах-обработчиках, снимки памяти из консоли недоступны.")
+            return
+        if not self.tracer.running:
+            self.tracer.start()
+            print("Трассировка памяти включена, сделан первый снимок. Следующий - повторная команда memory.")
+            return
+        if input("Действие (snapshot, stop; по умолчанию snapshot): ") == "stop":
+            self.tracer.stop()
+            print("Трассировка памяти выключена.")
+            return
+        lines = self.tracer.diff(PROFILE_TOP)
+        print("\n".join(lines))
+        print(f"Отчёт сохранён в {dump_report('memory', lines)}")
+
+    # Снимок списка соединений для консоли (цикл сервера работает в другом потоке)
+    def connections(self):
+        return list(self.clients.values())
+
+    # Счётчики сжатия по клиентам: сколько кадров сжато, степень сжатия и время процессора на кадр
+    def print_compression(self):
+        for client in self.connections():
+            compressor, decompressor = client.compressor, client.decoder.decompressor
+            if compressor is None:
+                continue
+            print(
+                f"Клиент {client.name}: {compressor.mode}, порог {compressor.threshold} байт. "
+                f"Отправлено сжатых кадров {compressor.frames}, {compressor.bytes_in} -> {compressor.bytes_out} байт "
+                f"(x{compressor.ratio:.2f}), {compressor.cpu_ns // max(compressor.frames, 1)} нс/кадр. "
+                f"Принято сжатых кадров {decompressor.frames}, {decompressor.bytes_in} -> {decompressor.bytes_out} байт, "
+                f"{decompressor.cpu_ns // max(decompressor.frames, 1)} нс/кадр"
+            )
 
-            recv_data_lst, send_data_lst, err_lst = [], [], []
-            # Проверяем на наличие ждущих клиентов
+    def listen(self):
+        self.logger.info("Запусп прослушки")
+        # Слушающий сокет в том же селекторе, что и клиенты: подключение принимается сразу, без таймаута опроса.
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        while True:
             try:
-                if self.clients:
-                    recv_data_lst, send_data_lst, err_lst = select.select(self.clients, self.clients, [], self.TIMEOUT)
-            except OSError:
-                pass
-            except Exception as ex:
-                self.logger.error(ex)
+                events = self.selector.select(self.TIMEOUT)
+            except InterruptedError:
+                continue
+            started = time.perf_counter()
+            self.received = time.time()
+            if self.calls:
+                self.run_calls()
+
+            for key, mask in events:
+                client = key.data
+                if client is None:
+                    self.accept_clients()
+                    continue
+                if mask & selectors.EVENT_WRITE:
+                    self.flush_client(client)
+                if mask & selectors.EVENT_READ and not client.closing:
+                    self.read_client(client)
+
+            # Если есть сообщения, ставим каждое в очередь получателя.
+            for message, sender in self.messages:
+                self.deliver(message, sender)
+            self.messages.clear()
+
+            self.update_clients()
+            # Один fsync журнала недоставленных сообщений на весь проход цикла
+            if self.offline is not None:
+                self.offline.sync()
+            LOOP_SECONDS.observe(time.perf_counter() - started)
 
-            # принимаем сообщения и если ошибка, исключаем клиента.
-            if recv_data_lst:
-                for client_with_message in recv_data_lst:
-                    try:
-                        self.process_client_message(get_message(client_with_message), client_with_message)
-                    except:
-                        self.logger.info(f"Клиент {client_with_message.getpeername()} отключился от сервера.")
-                        self.clients.remove(client_with_message)
-
-            # Если есть сообщения, обрабатываем каждое.
-            for i in self.messages:
+    def accept_clients(self):
+        for _ in range(self.ACCEPT_BATCH):
+            try:
+                client, addr = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as ex:
+                self.logger.error(ex)
+                return
+            self.logger.info(f"Установлено соединение с ПК {addr}")
+            CONNECTIONS_ACCEPTED.inc()
+            client.setblocking(False)
+            connection = Connection(client, addr, self.outbox_limit, self.outbox_policy, self.changes)
+            self.clients[connection.fd] = connection
+            self.selector.register(client, selectors.EVENT_READ, connection)
+            connection.events = selectors.EVENT_READ
+
+    # принимаем сообщения и если ошибка, исключаем клиента. За одно чтение может прийти несколько сообщений.
+    def read_client(self, client):
+        try:
+            for message in client.read_messages(partial(self.relay_frame, client)):
+                self.process_client_message(message, client)
+                if client.closing:
+                    break
+        except BlockingIOError:
+            pass
+        except Exception:
+            self.logger.info(f"Клиент {client.getpeername()} отключился от сервера.")
+            self.drop_client(client, abort=True)
+
+    def flush_client(self, client):
+        try:
+            client.flush()
+        except OSError:
+            self.logger.info(f"Связь с клиентом с именем {client.name} была потеряна")
+            self.drop_client(client, abort=True)
+            return
+        self.changes.add(client)
+
+    # Обработка соединений, изменившихся за проход: отправка новых данных без ожидания события записи,
+    # закрытие и перерегистрация в селекторе только с теми событиями, которые сейчас нужны.
+    def update_clients(self):
+        changes = self.changes
+        while changes:
+            client = changes.pop()
+            if self.clients.get(client.fd) is not client:
+                continue
+            if client.overflowed and not client.closing:
+                self.logger.warning(f"Очередь клиента {client.name} переполнена, соединение разорвано.")
+                self.drop_client(client, abort=True)
+                continue
+            if client.replay and not client.closing and client.out_bytes < client.limit // 2:
+                self.refill(client)
+            if client.outbox:
                 try:
-                    self.process_message(i, send_data_lst)
-                except:
-                    self.logger.info(f"Связь с клиентом с именем {i[DESTINATION]} была потеряна")
-                    self.clients.remove(self.names[i[DESTINATION]])
-                    del self.names[i[DESTINATION]]
-            self.messages.clear()
+                    client.flush()
+                except OSError:
+                    self.logger.info(f"Связь с клиентом с именем {client.name} была потеряна")
+                    self.drop_client(client, abort=True)
+                    continue
+            if client.replayed:
+                self.confirm_replay(client)
+            if client.closing and not client.outbox:
+                self.close_client(client)
+                continue
+            events = 0
+            if not client.closing and not client.blocked_by:
+                events |= selectors.EVENT_READ
+            # Пока идёт выдача журнала, ждём готовности к записи, чтобы дозаполнить очередь
+            if client.outbox or client.replay:
+                events |= selectors.EVENT_WRITE
+            if events != client.events:
+                if not client.events:
+                    self.selector.register(client.sock, events, client)
+                elif not events:
+                    self.selector.unregister(client.sock)
+                else:
+                    self.selector.modify(client.sock, events, client)
+                client.events = events
+
+    # Начало выдачи недоставленных сообщений пользователя name в соединение (клиента или канал к обработчику)
+    def start_replay(self, client, name):
+        if self.offline is None or not self.offline.pending(name):
+            return
+        self.logger.info(f"Для {name} сохранено недоставленных сообщений: {self.offline.pending(name)}")
+        client.replay.append(name)
+        client.touch()
+
+    # Следующая порция журнала в очередь соединения. Порция не больше половины очереди, так что выдача
+    # большого журнала идёт потоком по мере отправки, а не загружается в память целиком.
+    def refill(self, client):
+        name = client.replay[0]
+        # В журнале сообщения хранятся в JSON, для клиента с другим кодеком они перекодируются
+        batch, position = self.offline.read_batch(name, client.limit // 2)
+        for payload in batch:
+            if client.codec is not JSON_CODEC:
+                try:
+                    payload = client.codec.encode(JSON_CODEC.decode(payload))
+                except (MessageEncodeError, IncorrectDataRecivedError, ValueError):
+                    self.logger.warning(f"Сохранённое сообщение для {name} не удалось перекодировать, оно пропущено.")
+                    continue
+            client.enqueue(encode_frame(payload, client.framing))
+        if position is not None:
+            client.replayed.append((client.sent_frames + len(client.outbox), name, position))
+        if not self.offline.pending(name):
+            client.replay.pop(0)
+            self.logger.info(f"Недоставленные сообщения для {name} отправлены.")
+
+    # Отметка в журнале порций, все кадры которых уже отправлены
+    def confirm_replay(self, client):
+        replayed = client.replayed
+        while replayed and replayed[0][0] <= client.sent_frames:
+            _, name, position = replayed.popleft()
+            self.offline.ack(name, position)
+
+    # Соединение закрыто: неотправленные порции журнала будут выданы при следующем подключении получателя
+    def rewind_replay(self, client):
+        while client.replayed:
+            _, name, _ = client.replayed.popleft()
+            self.offline.rewind(name)
+
+    # Отключение клиента: имя освобождается сразу, сокет закрывается после отправки очереди (или сразу при abort)
+    def drop_client(self, client, abort=False):
+        if self.names.get(client.name) is client:
+            del self.names[client.name]
+            self.storage.user_logout(client.name)
+        for room in list(client.rooms):
+            self.leave_room(client, room)
+        if abort:
+            self.close_client(client)
+        else:
+            client.close()
+
+    # Окончательное закрытие: снятие с селектора до закрытия сокета, иначе дескриптор нельзя будет переиспользовать
+    def close_client(self, client):
+        if client.events:
+            self.selector.unregister(client.sock)
+            client.events = 0
+        self.clients.pop(client.fd, None)
+        client.abort()
+        if client.replayed:
+            self.confirm_replay(client)
+            self.rewind_replay(client)
 
     # Обработчик сообщений от клиентов, принимает словарь - сообщение от клиента, проверяет корректность, отправляет
     # словарь-ответ в случае необходимости.
     @try_except_wrapper
     def process_client_message(self, message, client):
         self.logger.debug(f"Разбор сообщения от клиента : {message}")
+        REQUESTS.get(str(message.get(ACTION)), REQUESTS["other"]).inc()
         # Если это сообщение о присутствии, принимаем и отвечаем
         if ACTION in message and message[ACTION] == PRESENCE and TIME in message and USER in message:
             # Если такой пользователь ещё не зарегистрирован, регистрируем, иначе отправляем ответ и завершаем соединение.
             if message[USER][ACCOUNT_NAME] not in self.names.keys():
                 self.names[message[USER][ACCOUNT_NAME]] = client
+                client.name = message[USER][ACCOUNT_NAME]
                 client_ip, client_port = client.getpeername()
                 self.storage.user_login(message[USER][ACCOUNT_NAME], client_ip, client_port)
 
-                send_message(client, RESPONSE_200)
+                # Ответ на presence уходит в старом формате, согласованные формат кадров и кодек действуют после него.
+                # Старые клиенты их не предлагают и остаются на legacy и JSON.
+                response = dict(RESPONSE_200)
+                if FRAMING in message:
+                    response[FRAMING] = choose_framing(message[FRAMING])
+                if CODEC in message:
+                    response[CODEC] = choose_codec(message[CODEC], response.get(FRAMING, FRAMING_LEGACY))
+                compression = choose_compression(message.get(COMPRESSION), response.get(FRAMING, FRAMING_LEGACY))
+                if compression is not None:
+                    response[COMPRESSION] = compression
+                if message.get(ACKS) is True:
+                    response[ACKS] = client.acks = True
+                send_message(client, response)
+                client.framing = response.get(FRAMING, FRAMING_LEGACY)
+                client.codec = get_codec(response.get(CODEC, CODEC_JSON))
+                client.compressor = create_compressor(compression, self.compress_threshold)
+                client.decoder.decompressor = create_decompressor(compression)
+                self.start_replay(client, client.name)
             else:
-                response = RESPONSE_400
+                response = dict(RESPONSE_400)
                 response[ERROR] = "Имя пользователя уже занято."
                 send_message(client, response)
-                self.clients.remove(client)
-                client.close()
+                self.drop_client(client)
             return
         # Если это сообщение, то добавляем его в очередь сообщений. Ответ не требуется.
+        # Сообщение от имени другого пользователя отклоняется.
+        elif is_message(message):
+            if not self.is_sender(client, message):
+                response = dict(RESPONSE_400)
+                response[ERROR] = "Отправитель сообщения не совпадает с именем пользователя."
+                send_message(client, response, client.framing, client.codec)
+                return
+            self.messages.append((message, client))
+            return
+        # Пакет сообщений: все корректные сообщения из него встают в очередь, некорректные и от имени другого
+        # пользователя отбрасываются. Ответ не требуется.
+        elif ACTION in message and message[ACTION] == BATCH and isinstance(message.get(MESSAGES), list):
+            accepted = [item for item in message[MESSAGES] if is_message(item) and self.is_sender(client, item)]
+            self.messages.extend((item, client) for item in accepted)
+            if len(accepted) < len(message[MESSAGES]):
+                self.logger.warning(
+                    f"В пакете от {client.name} отброшено некорректных сообщений: "
+                    f"{len(message[MESSAGES]) - len(accepted)}"
+                )
+            return
+        # Вход в комнату или выход из неё, комната создаётся при входе первого участника
         elif (
             ACTION in message
-            and message[ACTION] == MESSAGE
-            and DESTINATION in message
-            and TIME in message
-            and SENDER in message
-            and MESSAGE_TEXT in message
+            and message[ACTION] in (JOIN, LEAVE)
+            and ROOM in message
+            and self.names.get(client.name) is client
+            and is_room(message[ROOM])
         ):
-            self.messages.append(message)
+            if message[ACTION] == JOIN:
+                self.rooms.setdefault(message[ROOM], set()).add(client)
+                client.rooms.add(message[ROOM])
+            else:
+                self.leave_room(client, message[ROOM])
+            send_message(client, RESPONSE_200, client.framing, client.codec)
             return
-        # Если клиент выходит
+        # Если клиент выходит. Отключается только само соединение, приславшее exit.
         elif ACTION in message and message[ACTION] == EXIT and ACCOUNT_NAME in message:
-            self.storage.user_logout(message[ACCOUNT_NAME])
-
-            self.clients.remove(self.names[ACCOUNT_NAME])
-            self.names[ACCOUNT_NAME].close()
-            del self.names[ACCOUNT_NAME]
+            self.drop_client(client)
             return
         # Иначе отдаём Bad request
         else:
-            response = RESPONSE_400
+            response = dict(RESPONSE_400)
             response[ERROR] = "Запрос некорректен."
-            send_message(client, response)
+            send_message(client, response, client.framing, client.codec)
             return
 
-    # Функция адресной отправки сообщения определённому клиенту. Принимает словарь сообщение, список зарегистрированых
-    # пользователей и слушающие сокеты. Ничего не возвращает.
+    # Отправитель сообщения - пользователь, под чьим именем зарегистрировано соединение
+    def is_sender(self, client, message):
+        return client.name is not None and message[SENDER] == client.name and self.names.get(client.name) is client
+
+    # Быстрый путь для сообщений пользователю: из кадра читается только заголовок (action, from, to),
+    # и если отправитель совпадает с именем соединения, кадр встаёт в общую очередь сообщений без разбора.
+    # Возвращает False, если сообщение нужно разобрать целиком.
+    def relay_frame(self, client, frame, payload):
+        if client.name is None:
+            return False
+        header = client.codec.route(payload)
+        if header is None or header[0] != client.name or is_room(header[1]):
+            return False
+        self.messages.append((Relay(frame, payload, header[1], client), client))
+        return True
+
+    # Отправка сообщения из очереди: пересылка исходного кадра, если получатель на связи и использует те же
+    # формат кадров и кодек, что и отправитель, иначе полный разбор и process_message.
+    # sender - соединение, от которого сообщение принято. Если оно запросило подтверждения, после постановки
+    # в очередь ему уходит ack с отметками времени.
+    def deliver(self, message, sender):
+        if self.archive is not None:
+            if isinstance(message, Relay):
+                self.archive.append_payload(message.payload, message.sender.codec)
+            else:
+                self.archive.append(message)
+        if isinstance(message, Relay):
+            if not self.relay(message):
+                try:
+                    message = message.decode()
+                except (IncorrectDataRecivedError, ValueError):
+                    self.logger.error(f"Не удалось декодировать сообщение от пользователя {message.sender.name}.")
+                    return
+                self.process_message(message, sender)
+        else:
+            self.process_message(message, sender)
+        if sender is not None and sender.acks and not sender.closing:
+            self.acknowledge(sender, message)
+
+    # Подтверждение: исходное time сообщения, время приёма и постановки в очередь получателя. У пересланного
+    # без разбора кадра time читается полным разбором - только для клиентов, запросивших подтверждения.
+    def acknowledge(self, sender, message):
+        dispatched = time.time()
+        if isinstance(message, Relay):
+            try:
+                message = message.decode()
+            except (IncorrectDataRecivedError, ValueError):
+                return
+        ACK_DISPATCH_SECONDS.observe(dispatched - self.received)
+        ack = {
+            ACTION: ACK,
+            TIME: message.get(TIME),
+            DESTINATION: message.get(DESTINATION),
+            RECEIVED: self.received,
+            DISPATCHED: dispatched,
+        }
+        try:
+            send_message(sender, ack, sender.framing, sender.codec)
+        except MessageEncodeError:
+            self.logger.warning(f"Не удалось закодировать подтверждение для пользователя {sender.name}.")
+
+    def relay(self, item):
+        recipient = self.names.get(item.destination)
+        if (
+            recipient is None
+            or recipient.framing != item.sender.framing
+            or recipient.codec is not item.sender.codec
+            or (self.offline is not None and self.offline.pending(item.destination))
+        ):
+            return False
+        if recipient.enqueue(item.frame, item.sender):
+            MESSAGES_RELAYED.inc()
+            self.logger.debug(f"Переслано сообщение пользователю {item.destination} от пользователя {item.sender.name}.")
+            return True
+        MESSAGES_UNDELIVERED.inc()
+        if not recipient.overflowed:
+            self.logger.warning(
+                f"Очередь пользователя {item.destination} переполнена, сообщение от {item.sender.name} отброшено."
+            )
+        return True
+
+    # Функция адресной отправки сообщения определённому клиенту. Принимает словарь сообщение и ставит его в очередь
+    # получателя, отправка идёт в update_clients. При переполнении очереди действует политика соединения получателя.
+    # Сообщения пользователю не в сети сохраняются в журнал. Пока журнал пользователя не выдан целиком, новые
+    # сообщения тоже идут в журнал, чтобы не обогнать старые. sender - соединение отправителя или None.
+    # Сообщение, которое нельзя закодировать кодеком получателя, отбрасывается с ответом 400 отправителю.
     @try_except_wrapper
-    def process_message(self, message, listen_socks):
-        if message[DESTINATION] in self.names and self.names[message[DESTINATION]] in listen_socks:
-            send_message(self.names[message[DESTINATION]], message)
-            self.logger.info(
-                f"Отправлено сообщение пользователю {message[DESTINATION]} от пользователя {message[SENDER]}."
+    def process_message(self, message, sender=None):
+        if is_room(message[DESTINATION]):
+            self.process_room_message(message, sender)
+            return
+        recipient = self.names.get(message[DESTINATION])
+        try:
+            if self.offline is not None and (recipient is None or self.offline.pending(message[DESTINATION])):
+                self.offline.append(message[DESTINATION], dump_message(message))
+                MESSAGES_OFFLINE.inc()
+                if recipient is None:
+                    self.logger.info(
+                        f"Пользователь {message[DESTINATION]} не в сети, сообщение сохранено до подключения."
+                    )
+            elif recipient is None:
+                MESSAGES_UNDELIVERED.inc()
+                self.logger.error(
+                    f"Пользователь {message[DESTINATION]} не зарегистрирован на сервере, отправка сообщения невозможна."
+                )
+            elif recipient.enqueue(encode_message(message, recipient.framing, recipient.codec), sender):
+                MESSAGES_DIRECT.inc()
+                self.logger.info(
+                    f"Отправлено сообщение пользователю {message[DESTINATION]} от пользователя {message[SENDER]}."
+                )
+            else:
+                MESSAGES_UNDELIVERED.inc()
+                if not recipient.overflowed:
+                    self.logger.warning(
+                        f"Очередь пользователя {message[DESTINATION]} переполнена, сообщение от {message[SENDER]} "
+                        f"отброшено."
+                    )
+        except MessageEncodeError:
+            MESSAGES_UNDELIVERED.inc()
+            self.logger.warning(
+                f"Сообщение от {message[SENDER]} для {message[DESTINATION]} не удалось закодировать, оно отброшено."
             )
-        elif message[DESTINATION] in self.names and self.names[message[DESTINATION]] not in listen_socks:
-            raise ConnectionError
-        else:
-            self.logger.error(
-                f"Пользователь {message[DESTINATION]} не зарегистрирован на сервере, отправка сообщения невозможна."
+            self.reject_encoding(sender)
+
+    # Ответ 400 отправителю сообщения, которое не удалось закодировать для получателя
+    def reject_encoding(self, sender):
+        if sender is None or sender.closing:
+            return
+        response = dict(RESPONSE_400)
+        response[ERROR] = "Сообщение не может быть закодировано для получателя."
+        send_message(sender, response, sender.framing, sender.codec)
+
+
+    # Рассылка сообщения участникам комнаты (кроме отправителя). Сообщение кодируется один раз на каждую
+    # пару кодек/формат кадров, во все очереди ставится один и тот же объект bytes. Участникам, для чьего
+    # кодека сообщение не кодируется, оно не отправляется, отправителю уходит ответ 400.
+    def process_room_message(self, message, sender=None):
+        members = self.rooms.get(message[DESTINATION])
+        if not members:
+            MESSAGES_UNDELIVERED.inc()
+            self.logger.info(f"В комнате {message[DESTINATION]} нет участников, сообщение {message[SENDER]} отброшено.")
+            return
+        MESSAGES_ROOM.inc()
+        frames = dict()
+        dropped = failed = 0
+        for member in members:
+            if member is sender:
+                continue
+            encoded = frames.get((member.framing, member.codec))
+            if encoded is None:
+                try:
+                    frame = encode_message(message, member.framing, member.codec)
+                except MessageEncodeError:
+                    # пустой кадр - отметка, что для этой пары кодек/формат кадров сообщение не кодируется
+                    frame = b""
+                # кадр и его сжатые варианты живут только до конца рассылки
+                encoded = frames[member.framing, member.codec] = (frame, dict())
+            frame, cache = encoded
+            if not frame:
+                failed += 1
+            elif not member.enqueue(frame, sender, cache):
+                dropped += 1
+        self.logger.info(
+            f"Сообщение от {message[SENDER]} разослано в комнату {message[DESTINATION]}, участников {len(members)}."
+        )
+        if dropped:
+            self.logger.warning(f"Сообщение в комнату {message[DESTINATION]} не принято {dropped} участниками.")
+        if failed:
+            self.logger.warning(
+                f"Сообщение в комнату {message[DESTINATION]} не удалось закодировать для {failed} участников."
             )
+            self.reject_encoding(sender)
+
+    # Соединения, которым адресовано сообщение: участники комнаты или один получатель
+    def recipients(self, destination):
+        if is_room(destination):
+            return list(self.rooms.get(destination, ()))
+        recipient = self.names.get(destination)
+        return [recipient] if recipient is not None else []
+
+    def leave_room(self, client, room):
+        client.rooms.discard(room)
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(client)
+            if not members:
+                del self.rooms[room]
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, nargs="?", help="Port [default=7777]")
     parser.add_argument("-a", "--addr", type=str, default=DEFAULT_IP_ADDRESS, nargs="?", help="Bind address")
+    parser.add_argument("-m", "--mode", type=str, default=DEFAULT_SERVER_MODE, choices=SERVER_MODES, help="Server engine")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help="Worker processes [0 = in-process]")
+    parser.add_argument("--outbox-limit", type=int, default=OUTBOX_LIMIT, help="Per-client outbound queue, bytes")
+    parser.add_argument(
+        "--outbox-policy", type=str, default=DEFAULT_OUTBOX_POLICY, choices=OUTBOX_POLICIES, help="Queue overflow policy"
+    )
+    parser.add_argument("--offline-dir", type=str, default=MESSAGE_LOG_DIR, help="Undelivered message log directory")
+    parser.add_argument(
+        "--compress-threshold", type=int, default=COMPRESSION_THRESHOLD, help="Compress frames from this size, bytes"
+    )
+    parser.add_argument("--archive-db", type=str, default=ARCHIVE_PATH, help="Message archive file ['' = disabled]")
+    parser.add_argument(
+        "--history-days", type=int, default=HISTORY_RETENTION_DAYS, help="Login history retention, days [0 = forever]"
+    )
+    parser.add_argument(
+        "--sessions-dir", type=str, default=SESSIONS_DIR, help="Active session snapshots directory ['' = disabled]"
+    )
+    parser.add_argument(
+        "--storage", type=str, default=DEFAULT_STORAGE, choices=STORAGE_BACKENDS, help="Users and login history storage"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=METRICS_PORT, help="Prometheus /metrics HTTP port on 127.0.0.1 [0 = off]"
+    )
     return parser.parse_args(sys.argv[1:])
 
 
+def get_server_class(mode):
+    # Импорт внутри функции: модуль asyncio-сервера сам импортирует Server отсюда.
+    if mode == SERVER_MODE_ASYNCIO:
+        from app.async_server_cls import AsyncServer
+
+        return AsyncServer
+    return Server
+
+
+# Сервер по параметрам командной строки: с --workers - несколько процессов на одном порту, иначе выбранный движок
+def create_server(param, storage):
+    archive = MessageArchive(param.archive_db) if param.archive_db else None
+    if param.workers:
+        from app.shard_server_cls import ShardedServer
+
+        return ShardedServer(
+            param.addr,
+            param.port,
+            storage,
+            param.outbox_limit,
+            param.outbox_policy,
+            workers=param.workers,
+            offline_dir=param.offline_dir,
+            compress_threshold=param.compress_threshold,
+            archive=archive,
+            metrics_port=param.metrics_port,
+        )
+    return get_server_class(param.mode)(
+        param.addr,
+        param.port,
+        storage,
+        param.outbox_limit,
+        param.outbox_policy,
+        MessageLog(param.offline_dir),
+        param.compress_threshold,
+        archive,
+        param.metrics_port,
+    )
+
+
 def run():
     param = parse_args()
 
-    database = ServerStorage()
+    database = create_storage(param.storage, retention_days=param.history_days, sessions_dir=param.sessions_dir)
 
-    server = Server(param.addr, param.port, database)
+    server = create_server(param, database)
 
     server.start()
 
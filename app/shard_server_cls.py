@@ -0,0 +1,304 @@
+import os
+import selectors
+import signal
+import sys
+from multiprocessing import get_context
+from socket import SOMAXCONN, socketpair
+
+from app.common.decos import try_except_wrapper
+from app.common.errors import MessageEncodeError
+from app.common.utils import *
+from app.common.variables import *
+from app.connection_cls import Connection
+from app.db.archive import MessageArchive
+from app.db.message_log import MessageLog
+from app.db.storage import create_storage
+from app.server_cls import Server
+
+
+# Канал к другому процессу-обработчику (Unix-сокет из socketpair). По нему идут сообщения для пользователей,
+# подключённых к тому процессу, и изменения справочника имён. Кадры всегда с префиксом длины.
+class PeerConnection(Connection):
+    __slots__ = ("worker_id",)
+
+    def __init__(self, sock, worker_id, changes):
+        super().__init__(sock, f"worker-{worker_id}", PEER_OUTBOX_LIMIT, OUTBOX_POLICY_PAUSE, changes)
+        self.worker_id = worker_id
+        self.framing = FRAMING_LENGTH
+
+
+# Процесс-обработчик: тот же реактор, что и у Server, на общем порту через SO_REUSEPORT.
+# Свои клиенты в self.names, клиенты других обработчиков - в self.directory (имя -> номер обработчика).
+class ShardWorker(Server):
+    __slots__ = ("worker_id", "peers", "directory")
+
+    REUSE_PORT = True
+
+    def __init__(
+        self,
+        bind_addr,
+        port,
+        storage,
+        outbox_limit,
+        outbox_policy,
+        worker_id,
+        channels,
+        message_log=None,
+        compress_threshold=COMPRESSION_THRESHOLD,
+        archive=None,
+    ):
+        super().__init__(
+            bind_addr, port, storage, outbox_limit, outbox_policy, message_log, compress_threshold, archive
+        )
+        self.worker_id = worker_id
+        self.directory = dict()
+        self.peers = dict()
+        for peer_id, sock in channels.items():
+            sock.setblocking(False)
+            peer = PeerConnection(sock, peer_id, self.changes)
+            self.peers[peer_id] = peer
+            self.clients[peer.fd] = peer
+
+    def listen(self):
+        for peer in self.peers.values():
+            self.selector.register(peer.sock, selectors.EVENT_READ, peer)
+            peer.events = selectors.EVENT_READ
+        super().listen()
+
+    def read_client(self, client):
+        if isinstance(client, PeerConnection):
+            self.read_peer(client)
+        else:
+            super().read_client(client)
+
+    def read_peer(self, peer):
+        try:
+            for message in peer.read_messages():
+                action = message.get(ACTION)
+                if action == MESSAGE:
+                    # Пересланное сообщение доставляется только локально, повторно не пересылается
+                    super().process_message(message)
+                elif action == DIRECTORY_ADD:
+                    self.directory_add(message[ACCOUNT_NAME], peer.worker_id)
+                elif action == DIRECTORY_DEL and self.directory.get(message[ACCOUNT_NAME]) == peer.worker_id:
+                    del self.directory[message[ACCOUNT_NAME]]
+        except BlockingIOError:
+            pass
+        except Exception as ex:
+            self.logger.critical(f"Потерян канал к обработчику {peer.worker_id}: {ex}")
+            self.directory = {name: worker for name, worker in self.directory.items() if worker != peer.worker_id}
+            del self.peers[peer.worker_id]
+            self.close_client(peer)
+
+    # Имя занято в другом обработчике. Если одно имя одновременно заняли в двух обработчиках,
+    # остаётся регистрация в обработчике с меньшим номером. Сохранённые здесь сообщения для этого
+    # пользователя уходят по каналу в его обработчик. Канал к обработчику уже закрыт - имя не запоминается.
+    def directory_add(self, name, worker_id):
+        peer = self.peers.get(worker_id)
+        if peer is None:
+            self.directory.pop(name, None)
+            return
+        current = self.directory.get(name)
+        if current is not None and current < worker_id:
+            return
+        local = self.names.get(name)
+        if local is not None:
+            if self.worker_id < worker_id:
+                return
+            response = dict(RESPONSE_400)
+            response[ERROR] = "Имя пользователя уже занято."
+            send_message(local, response, local.framing, local.codec)
+            self.drop_client(local)
+        self.directory[name] = worker_id
+        self.start_replay(peer, name)
+
+    def broadcast(self, message):
+        frame = encode_message(message, FRAMING_LENGTH)
+        for peer in self.peers.values():
+            peer.enqueue(frame)
+
+    def process_client_message(self, message, client):
+        if message.get(ACTION) == PRESENCE and message.get(USER, {}).get(ACCOUNT_NAME) in self.directory:
+            response = dict(RESPONSE_400)
+            response[ERROR] = "Имя пользователя уже занято."
+            send_message(client, response)
+            self.drop_client(client)
+            return
+        registered = client.name is not None
+        super().process_client_message(message, client)
+        if not registered and self.names.get(client.name) is client:
+            self.broadcast({ACTION: DIRECTORY_ADD, ACCOUNT_NAME: client.name})
+
+    def drop_client(self, client, abort=False):
+        registered = self.names.get(client.name) is client
+        super().drop_client(client, abort)
+        if registered:
+            self.broadcast({ACTION: DIRECTORY_DEL, ACCOUNT_NAME: client.name})
+
+    # Получатель подключён к другому обработчику - сообщение уходит в канал к нему.
+    # Пока здесь есть его недоставленные сообщения, новые тоже сохраняются, чтобы не обогнать старые.
+    # Сообщение в комнату рассылается локально и отправляется всем обработчикам, у них свои участники комнаты.
+    # Если канал к обработчику получателя уже закрыт, имя удаляется из справочника и сообщение сохраняется в журнал.
+    @try_except_wrapper
+    def process_message(self, message, sender=None):
+        if is_room(message[DESTINATION]):
+            super().process_message(message, sender)
+            try:
+                self.broadcast(message)
+            except MessageEncodeError:
+                self.logger.warning(f"Сообщение в комнату {message[DESTINATION]} не удалось передать обработчикам.")
+            return
+        worker_id = self.directory.get(message[DESTINATION])
+        peer = self.peers.get(worker_id)
+        if peer is None and worker_id is not None:
+            del self.directory[message[DESTINATION]]
+        if peer is None or message[DESTINATION] in self.names or self.offline_pending(message[DESTINATION]):
+            super().process_message(message, sender)
+            return
+        # Между обработчиками сообщения идут в JSON: двоичные значения из MessagePack так не передать
+        try:
+            frame = encode_message(message, FRAMING_LENGTH)
+        except MessageEncodeError:
+            self.logger.warning(f"Сообщение для {message[DESTINATION]} не удалось закодировать, оно отброшено.")
+            self.reject_encoding(sender)
+            return
+        peer.enqueue(frame, sender)
+        self.logger.info(f"Сообщение пользователю {message[DESTINATION]} передано обработчику {worker_id}.")
+
+    def offline_pending(self, name):
+        return self.offline is not None and self.offline.pending(name)
+
+
+def run_worker(
+    worker_id,
+    bind_addr,
+    port,
+    outbox_limit,
+    outbox_policy,
+    channels,
+    offline_dir=None,
+    compress_threshold=COMPRESSION_THRESHOLD,
+    archive_path=None,
+    storage_backend=DEFAULT_STORAGE,
+    sessions_dir=None,
+    metrics_port=METRICS_PORT,
+):
+    # Копии чужих концов каналов, унаследованные при fork, закрываем: иначе падение обработчика не будет замечено
+    for owner, peers in enumerate(channels):
+        if owner != worker_id:
+            for sock in peers.values():
+                sock.close()
+    # Хранилище в памяти у каждого обработчика своё: консоль главного процесса его данных не видит.
+    # Активные сессии консоль читает из снимков обработчиков в sessions_dir.
+    storage = create_storage(
+        storage_backend, clear_active=False, sessions_dir=sessions_dir, owner=f"worker-{worker_id}"
+    )
+    # История входов сворачивает главный процесс, обработчик сохраняет только снимки своих сессий
+    storage.sessions.start()
+    # У каждого обработчика свой журнал недоставленных сообщений: запись в него идёт без блокировок
+    message_log = MessageLog(os.path.join(offline_dir, f"worker-{worker_id}")) if offline_dir else None
+    # Архив общий: обработчики пишут в один файл (SQLite сам упорядочивает запись), поиск - в главном процессе
+    archive = MessageArchive(archive_path) if archive_path else None
+    worker = ShardWorker(
+        bind_addr,
+        port,
+        storage,
+        outbox_limit,
+        outbox_policy,
+        worker_id,
+        channels[worker_id],
+        message_log,
+        compress_threshold,
+        archive,
+    )
+    worker.raise_fd_limit()
+    worker.open_socket(SOMAXCONN)
+    # Метрики у каждого процесса свои: обработчик N отдаёт их на порту главного процесса + N + 1
+    worker.start_metrics(metrics_port and metrics_port + worker_id + 1)
+    worker.logger.info(f"Запущен обработчик {worker_id}")
+    # Главный процесс останавливает обработчики сигналом SIGTERM, очередь записи в базу дописывается до выхода
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        worker.listen()
+    finally:
+        storage.close()
+        if archive is not None:
+            archive.close()
+
+
+# Главный процесс: запускает обработчики (fork) и ведёт консоль администратора. Порт сам не слушает.
+class ShardedServer(Server):
+    __slots__ = ("workers", "processes", "offline_dir")
+
+    SHARED_SESSIONS = True
+    PROFILING = False
+
+    def __init__(
+        self,
+        bind_addr,
+        port,
+        storage,
+        outbox_limit=OUTBOX_LIMIT,
+        outbox_policy=DEFAULT_OUTBOX_POLICY,
+        workers=2,
+        offline_dir=None,
+        compress_threshold=COMPRESSION_THRESHOLD,
+        archive=None,
+        metrics_port=METRICS_PORT,
+    ):
+        super().__init__(
+            bind_addr,
+            port,
+            storage,
+            outbox_limit,
+            outbox_policy,
+            compress_threshold=compress_threshold,
+            archive=archive,
+            metrics_port=metrics_port,
+        )
+        self.workers = workers
+        self.offline_dir = offline_dir
+        self.processes = []
+
+    # Обработчики создаются до запуска потоков главного процесса: fork из многопоточного процесса небезопасен
+    def open_socket(self, request_count=SOMAXCONN):
+        channels = [dict() for _ in range(self.workers)]
+        for first in range(self.workers):
+            for second in range(first + 1, self.workers):
+                channels[first][second], channels[second][first] = socketpair()
+        # Подключения к архиву не должны достаться обработчикам через fork, у них свои
+        if self.archive is not None:
+            self.archive.engine.dispose()
+        context = get_context("fork")
+        for worker_id in range(self.workers):
+            process = context.Process(
+                target=run_worker,
+                args=(
+                    worker_id,
+                    self.bind_addr,
+                    self.port,
+                    self.outbox_limit,
+                    self.outbox_policy,
+                    channels,
+                    self.offline_dir,
+                    self.compress_threshold,
+                    self.archive.path if self.archive is not None else None,
+                    self.storage.name,
+                    self.storage.sessions.directory,
+                    self.metrics_port,
+                ),
+                name=f"worker-{worker_id}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        for peers in channels:
+            for sock in peers.values():
+                sock.close()
+        self.logger.info(f"Порт сервера - {self.port}| адресс - {self.bind_addr}| обработчиков - {self.workers}")
+
+    # Поток главного процесса следит за обработчиками
+    def listen(self):
+        for process in self.processes:
+            process.join()
+            self.logger.critical(f"Обработчик {process.name} завершился с кодом {process.exitcode}")
@@ -0,0 +1,72 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from app.common.codecs import JSON_CODEC
+from app.common.variables import *
+from app.db.archive import MessageArchive
+
+
+# Тесты архива сообщений и полнотекстового поиска
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.archive = MessageArchive(os.path.join(self.tmp.name, "archive.db3"))
+
+    def tearDown(self):
+        self.archive.close()
+        self.tmp.cleanup()
+
+    def message(self, sender, recipient, text):
+        return {ACTION: MESSAGE, TIME: 1, SENDER: sender, DESTINATION: recipient, MESSAGE_TEXT: text}
+
+    def test_search(self):
+        for i in range(30):
+            self.archive.append(self.message("user1", "user2", f"привет номер {i}"))
+        self.archive.append(self.message("user2", "#room", 'ответ "в комнату"'))
+        self.archive.append_payload(JSON_CODEC.encode(self.message("user3", "user1", "пересланный кадр")), JSON_CODEC)
+        self.archive.append_payload(b"{broken", JSON_CODEC)
+        self.archive.flush()
+        self.assertEqual((self.archive.written, self.archive.rejected), (32, 1))
+
+        rows, before = self.archive.search("Привет", limit=20)
+        self.assertEqual(len(rows), 20)
+        self.assertEqual(rows[0].text, "привет номер 29")
+        rows, before = self.archive.search("привет", before=before, limit=20)
+        self.assertEqual((len(rows), before), (10, None))
+
+        self.assertEqual(self.archive.search("номер 7")[0][0].text, "привет номер 7")
+        self.assertEqual(self.archive.search('"в')[0][0].recipient, "#room")
+        self.assertEqual(self.archive.search(sender="user3")[0][0].text, "пересланный кадр")
+        self.assertEqual(len(self.archive.search("привет", recipient="user1")[0]), 0)
+        self.assertEqual(len(self.archive.search(recipient="user2", limit=100)[0]), 30)
+
+    def test_period(self):
+        start = datetime.datetime(2026, 3, 1, 12, 0)
+        batch = []
+        for minute in range(180):
+            sender = "user1" if minute % 2 else "user2"
+            batch.append((start.timestamp() + minute * 60, self.message(sender, "user3", f"минута {minute}")))
+        self.archive.write_batch(batch)
+        since, until = start + datetime.timedelta(hours=1), start + datetime.timedelta(hours=2)
+        rows, before = self.archive.search(since=since, until=until, limit=100)
+        self.assertEqual((len(rows), rows[0].text, rows[-1].text), (60, "минута 119", "минута 60"))
+        rows, _ = self.archive.search("минута", sender="user1", since=since, until=until, limit=100)
+        self.assertEqual(len(rows), 30)
+        self.assertTrue(all(row.sender == "user1" for row in rows))
+        rows, _ = self.archive.search("минута", until=since, before=11, limit=100)
+        self.assertEqual([row.text for row in rows], [f"минута {minute}" for minute in range(9, -1, -1)])
+
+    # строка, которую не закодировать в UTF-8, не отменяет запись остальной пачки
+    def test_bad_row(self):
+        batch = [(1.0, self.message("user1", "user2", f"сообщение {i}")) for i in range(10)]
+        batch.insert(5, (1.0, self.message("user1", "user2", "суррогат \ud800")))
+        self.archive.write_batch(batch)
+        self.assertEqual((self.archive.written, self.archive.rejected), (11, 0))
+        self.assertEqual(len(self.archive.search("сообщение")[0]), 10)
+        self.assertEqual(self.archive.search("суррогат")[0][0].text, "суррогат ?")
+
+
+if __name__ == "__main__":
+    unittest.main()
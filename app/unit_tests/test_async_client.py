@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import unittest
+
+from app.async_client_cls import AsyncClient
+from app.benchmarks.bench_latency import start_server
+from app.common.errors import ServerError
+from app.common.latency import HOP_ACK
+from app.common.variables import *
+
+
+# Тесты асинхронного клиента с настоящим сервером на свободном порту
+class TestAsyncClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_server()
+        logging.getLogger("client").setLevel(logging.WARNING)
+
+    def test_exchange(self):
+        async def exchange():
+            async with AsyncClient("127.0.0.1", self.server.port, "async1", acks=True) as sender:
+                async with AsyncClient("127.0.0.1", self.server.port, "async2") as recipient:
+                    self.assertTrue(sender.acks)
+                    self.assertFalse(recipient.acks)
+                    await sender.send("async2", "привет")
+                    message = await asyncio.wait_for(recipient.receive(), 5)
+                    self.assertEqual((message[SENDER], message[MESSAGE_TEXT]), ("async1", "привет"))
+                    await recipient.close()
+                    self.assertEqual([message async for message in recipient], [])
+                # подтверждение в итератор не попадает, но учтено в задержках
+                await sender.send("async1", "себе")
+                message = await asyncio.wait_for(sender.receive(), 5)
+                self.assertEqual(message[MESSAGE_TEXT], "себе")
+                self.assertGreaterEqual(sender.latency.hops[HOP_ACK].total, 1)
+
+        asyncio.run(exchange())
+
+    def test_name_taken(self):
+        async def duplicate():
+            async with AsyncClient("127.0.0.1", self.server.port, "async3"):
+                with self.assertRaises(ServerError):
+                    await AsyncClient("127.0.0.1", self.server.port, "async3").connect()
+
+        asyncio.run(duplicate())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import socket
+import tempfile
+import unittest
+
+from app.async_client_cls import AsyncClient, create_presence
+from app.async_server_cls import AsyncServer
+from app.benchmarks.bench_latency import free_port
+from app.common.framing import FrameDecoder
+from app.common.utils import dump_message, encode_message
+from app.common.variables import *
+from app.db.memory_storage import MemoryStorage
+from app.db.message_log import MessageLog
+
+TEXT = "x" * 1000
+
+
+# Тесты асинхронного сервера: сервер работает в цикле событий теста на свободном порту
+class TestAsyncServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.getLogger("server").setLevel(logging.ERROR)
+        logging.getLogger("client").setLevel(logging.WARNING)
+
+    def run_server(self, test, **kwargs):
+        async def run():
+            server = AsyncServer("127.0.0.1", free_port(), MemoryStorage(), **kwargs)
+            server.open_socket()
+            task = asyncio.ensure_future(server.serve())
+            try:
+                await test(server)
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                server.socket.close()
+
+        asyncio.run(run())
+
+    async def wait_until(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail("условие не выполнилось за 5 секунд")
+
+    # Получатель, который не читает: буфер приёма задан до подключения, буфер отправки сервера уменьшен, сжатия нет
+    async def stalled(self, server, name):
+        loop = asyncio.get_running_loop()
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setblocking(False)
+        self.addCleanup(sock.close)
+        await loop.sock_connect(sock, ("127.0.0.1", server.port))
+        await loop.sock_sendall(sock, encode_message(create_presence(name, (FRAMING_LENGTH,), (CODEC_JSON,), ())))
+        await self.wait_until(lambda: name in server.names)
+        server.names[name].writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        return sock
+
+    # Тексты count сообщений, пришедших получателю из stalled, после ответа на presence
+    async def receive(self, sock, count):
+        loop = asyncio.get_running_loop()
+        decoder = FrameDecoder()
+        messages = []
+        while len(messages) <= count:
+            message = decoder.next_message()
+            if message is None:
+                decoder.feed(await asyncio.wait_for(loop.sock_recv(sock, READ_CHUNK_SIZE), 5))
+            elif RESPONSE in message:
+                decoder.framing = message[FRAMING]
+                messages.append(message)
+            else:
+                messages.append(message[MESSAGE_TEXT])
+        return messages[1:]
+
+    # всё, что накопилось в очереди за проход, уходит одним writelines
+    def test_write_loop(self):
+        async def test(server):
+            async with AsyncClient("127.0.0.1", server.port, "test1") as sender:
+                async with AsyncClient("127.0.0.1", server.port, "test2") as recipient:
+                    connection = server.names["test2"]
+                    calls, frames = connection.send_calls, connection.sent_frames
+                    await sender.send_batch("test2", [str(i) for i in range(20)])
+                    received = [(await asyncio.wait_for(recipient.receive(), 5))[MESSAGE_TEXT] for _ in range(20)]
+                    self.assertEqual(received, [str(i) for i in range(20)])
+                    self.assertEqual((connection.send_calls - calls, connection.sent_frames - frames), (1, 20))
+                    self.assertEqual(connection.out_bytes, 0)
+
+        self.run_server(test)
+
+    # при политике pause переполненная очередь получателя останавливает чтение от отправителя до её разгрузки
+    def test_pause(self):
+        async def test(server):
+            recipient = await self.stalled(server, "test2")
+            async with AsyncClient("127.0.0.1", server.port, "test1") as sender:
+                connection = server.names["test1"]
+
+                async def flood():
+                    for i in range(1000):
+                        await sender.send("test2", f"{i} {TEXT}")
+
+                task = asyncio.ensure_future(flood())
+                await self.wait_until(lambda: connection.blocked_by)
+                self.assertIn(server.names["test2"], connection.blocked_by)
+                self.assertFalse(connection.resumed.is_set())
+                received = await self.receive(recipient, 1000)
+                self.assertEqual(received, [f"{i} {TEXT}" for i in range(1000)])
+                await task
+                self.assertFalse(connection.blocked_by)
+                self.assertFalse(server.names["test2"].paused_senders)
+
+        self.run_server(test, outbox_limit=16 * 1024, outbox_policy=OUTBOX_POLICY_PAUSE)
+
+    # при политике disconnect получатель с переполненной очередью отключается, отправитель продолжает работу
+    def test_overflow(self):
+        async def test(server):
+            recipient = await self.stalled(server, "test2")
+            async with AsyncClient("127.0.0.1", server.port, "test1") as sender:
+                for _ in range(1000):
+                    await sender.send("test2", TEXT)
+                    if "test2" not in server.names:
+                        break
+                await self.wait_until(lambda: "test2" not in server.names)
+                self.assertIn("test1", server.names)
+                # соединение получателя закрыто сервером: после уже принятых данных - конец потока
+                loop = asyncio.get_running_loop()
+                while await asyncio.wait_for(loop.sock_recv(recipient, READ_CHUNK_SIZE), 5):
+                    pass
+                await sender.send("test1", "себе")
+                self.assertEqual((await asyncio.wait_for(sender.receive(), 5))[MESSAGE_TEXT], "себе")
+
+        self.run_server(test, outbox_limit=16 * 1024, outbox_policy=OUTBOX_POLICY_DISCONNECT)
+
+    # журнал выдаётся порциями по мере отправки, доставка отмечается после отправки, а при обрыве соединения
+    # неотправленные сообщения остаются в журнале
+    def test_replay(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        log = MessageLog(directory.name)
+        self.addCleanup(log.close)
+        texts = [f"{i} {TEXT}" for i in range(3000)]
+        for text in texts:
+            message = {ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", TIME: 1.1, MESSAGE_TEXT: text}
+            log.append("test2", dump_message(message))
+
+        async def test(server):
+            recipient = await self.stalled(server, "test2")
+            connection = server.names["test2"]
+            await self.wait_until(lambda: connection.replayed and connection.out_bytes > connection.limit // 2)
+            self.assertGreater(log.pending("test2"), 0)
+            recipient.close()
+            await self.wait_until(lambda: connection.writer.is_closing() and not connection.replayed)
+            first = len(texts) - len(log.index["test2"])
+            self.assertEqual(log.pending("test2"), len(texts) - first)
+
+            async with AsyncClient("127.0.0.1", server.port, "test2") as recipient:
+                received = [(await asyncio.wait_for(recipient.receive(), 5))[MESSAGE_TEXT] for _ in texts[first:]]
+                self.assertEqual(received, texts[first:])
+                await self.wait_until(lambda: "test2" not in log.index)
+
+        self.run_server(test, outbox_limit=16 * 1024, message_log=log)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from app.common.codecs import CODECS, choose_codec, get_codec
+from app.common.framing import FrameDecoder
+from app.common.utils import encode_message
+from app.common.variables import *
+
+MESSAGE = {ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", TIME: 1.1, MESSAGE_TEXT: "Привет\n{"}
+
+
+# Тесты кодеков сообщений
+class TestCodecs(unittest.TestCase):
+    def test_round_trip(self):
+        for codec in CODECS.values():
+            self.assertEqual(codec.decode(codec.encode(MESSAGE)), MESSAGE)
+
+    @unittest.skipUnless(CODEC_MSGPACK in CODECS, "msgpack не установлен")
+    def test_msgpack(self):
+        codec = get_codec(CODEC_MSGPACK)
+        self.assertLess(len(codec.encode(MESSAGE)), len(get_codec(CODEC_JSON).encode(MESSAGE)))
+        presence = {ACTION: PRESENCE, TIME: 1.1, USER: {ACCOUNT_NAME: "test1"}, "extra": 1}
+        self.assertEqual(codec.decode(codec.encode(presence)), presence)
+        decoder = FrameDecoder(FRAMING_LENGTH, codec=codec)
+        decoder.feed(encode_message(MESSAGE, FRAMING_LENGTH, codec) * 2)
+        self.assertEqual(list(decoder), [MESSAGE, MESSAGE])
+
+    # двоичный кодек выбирается только вместе с кадрами с префиксом длины
+    def test_choose_codec(self):
+        offered = [CODEC_MSGPACK, CODEC_JSON]
+        self.assertEqual(choose_codec(offered, FRAMING_NEWLINE), CODEC_JSON)
+        self.assertEqual(choose_codec(None, FRAMING_LENGTH), CODEC_JSON)
+        self.assertEqual(choose_codec(["unknown"], FRAMING_LENGTH), CODEC_JSON)
+        if CODEC_MSGPACK in CODECS:
+            self.assertEqual(choose_codec(offered, FRAMING_LENGTH), CODEC_MSGPACK)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from app.common.compression import COMPRESSED_FLAG, choose_compression, create_compressor, create_decompressor
+from app.common.errors import IncorrectDataRecivedError
+from app.common.framing import LENGTH_PREFIX, FrameDecoder
+from app.common.utils import encode_message
+from app.common.variables import *
+
+MESSAGE = {ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", TIME: 1.1, MESSAGE_TEXT: "Привет! " * 200}
+
+
+# Тесты сжатия кадров
+class TestCompression(unittest.TestCase):
+    def round_trip(self, mode, messages):
+        compressor = create_compressor(mode, threshold=100)
+        decoder = FrameDecoder(FRAMING_LENGTH)
+        decoder.decompressor = create_decompressor(mode)
+        frames = [compressor.compress_frame(encode_message(message, FRAMING_LENGTH)) for message in messages]
+        decoder.feed(b"".join(frames))
+        self.assertEqual(list(decoder), messages)
+        return compressor, frames
+
+    def test_modes(self):
+        short = {ACTION: PRESENCE, TIME: 1.1}
+        for mode in COMPRESSIONS:
+            compressor, frames = self.round_trip(mode, [MESSAGE, short, MESSAGE])
+            (length,) = LENGTH_PREFIX.unpack_from(frames[1])
+            self.assertFalse(length & COMPRESSED_FLAG)
+            self.assertEqual(compressor.frames, 2)
+            self.assertGreater(compressor.ratio, 5)
+        # общий контекст сжимает повтор сообщения лучше отдельного сжатия
+        stream = self.round_trip(COMPRESSION_DEFLATE_STREAM, [MESSAGE, MESSAGE])[1]
+        single = self.round_trip(COMPRESSION_DEFLATE, [MESSAGE, MESSAGE])[1]
+        self.assertLess(len(stream[1]), len(single[1]))
+
+    # при рассылке кадр сжимается один раз на уровень, кэш живёт только у вызывающего
+    def test_fan_out_cache(self):
+        frame = encode_message(MESSAGE, FRAMING_LENGTH)
+        cache = dict()
+        first, second = (create_compressor(COMPRESSION_DEFLATE, threshold=100) for _ in range(2))
+        data = first.compress_frame(frame, cache)
+        self.assertIs(second.compress_frame(frame, cache), data)
+        self.assertEqual((second.frames, second.cpu_ns), (1, 0))
+        self.assertIsNot(second.compress_frame(frame), data)
+
+    def test_choose(self):
+        self.assertEqual(choose_compression(list(COMPRESSIONS), FRAMING_LENGTH), COMPRESSION_DEFLATE_STREAM)
+        self.assertIsNone(choose_compression(list(COMPRESSIONS), FRAMING_NEWLINE))
+        self.assertIsNone(choose_compression(None, FRAMING_LENGTH))
+
+    # распакованный кадр не может превышать максимальный размер
+    def test_bomb(self):
+        compressor = create_compressor(COMPRESSION_DEFLATE, threshold=0)
+        frame = compressor.compress_frame(LENGTH_PREFIX.pack(10 ** 6) + b"0" * 10 ** 6)
+        decoder = FrameDecoder(FRAMING_LENGTH, max_length=1000)
+        decoder.decompressor = create_decompressor(COMPRESSION_DEFLATE)
+        decoder.decompressor.max_length = 1000
+        decoder.feed(frame)
+        self.assertRaises(IncorrectDataRecivedError, decoder.next_frame)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+import selectors
+import socket
+import unittest
+
+from app.common.variables import *
+from app.connection_cls import Connection
+from app.db.memory_storage import MemoryStorage
+from app.server_cls import Server
+
+
+# Тесты очереди исходящих данных соединения
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.server_side, self.client_side = socket.socketpair()
+        self.server_side.setblocking(False)
+        self.server_side.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+
+    def tearDown(self):
+        self.server_side.close()
+        self.client_side.close()
+
+    def receive_all(self, size):
+        data = b""
+        while len(data) < size:
+            data += self.client_side.recv(65536)
+        return data
+
+    # частичная запись: хвост кадра остаётся в очереди и уходит при следующем flush
+    def test_partial_write(self):
+        conn = Connection(self.server_side, None, limit=10 ** 7)
+        payload = bytes(range(256)) * 4096
+        conn.enqueue(payload)
+        self.assertFalse(conn.flush())
+        self.assertLess(conn.out_bytes, len(payload))
+        received = b""
+        while conn.outbox:
+            received += self.client_side.recv(65536)
+            conn.flush()
+        received += self.receive_all(len(payload) - len(received))
+        self.assertEqual(received, payload)
+        self.assertEqual(conn.out_bytes, 0)
+
+    # кадры, накопленные за проход, уходят одним вызовом; при частичной отправке порядок байт сохраняется
+    def test_coalescing(self):
+        conn = Connection(self.server_side, None, limit=10 ** 7)
+        frames = [bytes([i]) * 500 for i in range(100)]
+        for frame in frames[:4]:
+            conn.enqueue(frame)
+        self.assertTrue(conn.flush())
+        self.assertEqual((conn.send_calls, conn.sent_frames), (1, 4))
+        for frame in frames[4:]:
+            conn.enqueue(frame)
+        received = self.receive_all(2000)
+        while conn.outbox:
+            conn.flush()
+            received += self.client_side.recv(65536)
+        received += self.receive_all(50000 - len(received))
+        self.assertEqual(received, b"".join(frames))
+        self.assertEqual(conn.sent_frames, 100)
+
+    def test_drop_policy(self):
+        conn = Connection(self.server_side, None, limit=100, policy=OUTBOX_POLICY_DROP)
+        self.assertTrue(conn.enqueue(b"x" * 80))
+        self.assertFalse(conn.enqueue(b"x" * 80))
+        self.assertEqual(conn.dropped, 1)
+        self.assertEqual(conn.out_bytes, 80)
+
+    def test_disconnect_policy(self):
+        conn = Connection(self.server_side, None, limit=100, policy=OUTBOX_POLICY_DISCONNECT)
+        conn.enqueue(b"x" * 80)
+        self.assertFalse(conn.enqueue(b"x" * 80))
+        self.assertTrue(conn.overflowed)
+
+    # при политике pause кадр принимается, а чтение от отправителя приостанавливается до разгрузки очереди
+    def test_pause_policy(self):
+        conn = Connection(self.server_side, None, limit=100, policy=OUTBOX_POLICY_PAUSE)
+        sender = Connection(None, None)
+        conn.enqueue(b"x" * 80, sender)
+        self.assertTrue(conn.enqueue(b"x" * 80, sender))
+        self.assertIn(conn, sender.blocked_by)
+        self.assertTrue(conn.flush())
+        self.assertFalse(sender.blocked_by)
+        self.assertEqual(len(self.receive_all(160)), 160)
+
+
+
+# Регистрация соединений в селекторе сервера: запись ожидается, только пока очередь не пуста
+class TestSelector(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(DEFAULT_IP_ADDRESS, DEFAULT_PORT, MemoryStorage())
+        self.pairs = []
+
+    def tearDown(self):
+        for pair in self.pairs:
+            for sock in pair:
+                sock.close()
+        self.server.selector.close()
+
+    # Соединение, как его создаёт accept_clients. Возвращает его и второй конец канала.
+    def connect(self, limit=OUTBOX_LIMIT, policy=DEFAULT_OUTBOX_POLICY):
+        server_side, client_side = socket.socketpair()
+        self.pairs.append((server_side, client_side))
+        server_side.setblocking(False)
+        server_side.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        conn = Connection(server_side, None, limit, policy, self.server.changes)
+        self.server.clients[conn.fd] = conn
+        self.server.selector.register(server_side, selectors.EVENT_READ, conn)
+        conn.events = selectors.EVENT_READ
+        return conn, client_side
+
+    # События, с которыми соединение зарегистрировано в селекторе (0 - не зарегистрировано)
+    def registered(self, conn):
+        key = self.server.selector.get_map().get(conn.fd)
+        if key is None:
+            return 0
+        self.assertIs(key.data, conn)
+        return key.events
+
+    def test_write_interest(self):
+        conn, client_side = self.connect(limit=10 ** 7)
+        conn.enqueue(b"x" * 100)
+        self.server.update_clients()
+        self.assertEqual(self.registered(conn), selectors.EVENT_READ)
+        client_side.recv(100)
+
+        # буфер сокета заполнен - ждём готовности к записи, после отправки остатка снова только чтение
+        conn.enqueue(b"x" * 10 ** 6)
+        self.server.update_clients()
+        self.assertTrue(conn.outbox)
+        self.assertEqual(conn.events, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        self.assertEqual(self.registered(conn), conn.events)
+        while conn.outbox:
+            client_side.recv(65536)
+            self.server.flush_client(conn)
+            self.server.update_clients()
+        self.assertEqual(self.registered(conn), selectors.EVENT_READ)
+
+    # приостановленный отправитель снимается с селектора, после разгрузки очереди получателя возвращается
+    def test_paused_sender(self):
+        recipient, client_side = self.connect(limit=1000, policy=OUTBOX_POLICY_PAUSE)
+        sender, _ = self.connect()
+        recipient.enqueue(b"x" * 10 ** 5)
+        recipient.enqueue(b"x" * 100, sender)
+        self.assertIn(recipient, sender.blocked_by)
+        self.server.update_clients()
+        self.assertEqual((sender.events, self.registered(sender)), (0, 0))
+        self.assertEqual(self.registered(recipient), selectors.EVENT_READ | selectors.EVENT_WRITE)
+        while recipient.outbox:
+            client_side.recv(65536)
+            self.server.flush_client(recipient)
+            self.server.update_clients()
+        self.assertFalse(sender.blocked_by)
+        self.assertEqual(self.registered(sender), selectors.EVENT_READ)
+
+    # мягкое отключение: чтение снимается сразу, запись - до отправки очереди, затем соединение удаляется
+    def test_drop(self):
+        conn, client_side = self.connect()
+        conn.enqueue(b"x" * 10 ** 5)
+        self.server.drop_client(conn)
+        self.server.update_clients()
+        self.assertEqual(self.registered(conn), selectors.EVENT_WRITE)
+        while conn.outbox:
+            client_side.recv(65536)
+            self.server.flush_client(conn)
+            self.server.update_clients()
+        self.assertEqual(self.registered(conn), 0)
+        self.assertNotIn(conn.fd, self.server.clients)
+
+        conn, _ = self.connect()
+        conn.enqueue(b"x" * 10 ** 5)
+        self.server.update_clients()
+        self.server.drop_client(conn, abort=True)
+        self.assertEqual((conn.events, self.registered(conn)), (0, 0))
+        self.assertNotIn(conn.fd, self.server.clients)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import json
+import unittest
+
+from app.common.errors import IncorrectDataRecivedError
+from app.common.framing import FrameDecoder, choose_framing, encode_frame
+from app.common.variables import *
+
+
+def encode(message, framing):
+    return encode_frame(json.dumps(message).encode(ENCODING), framing)
+
+
+# Тесты потокового разборщика кадров
+class TestFrameDecoder(unittest.TestCase):
+    messages = [
+        {ACTION: MESSAGE, SENDER: "a", DESTINATION: "b", TIME: 1.1, MESSAGE_TEXT: "привет"},
+        {ACTION: MESSAGE, SENDER: "b", DESTINATION: "a", TIME: 1.2, MESSAGE_TEXT: "x" * 5000},
+        {RESPONSE: 200},
+    ]
+
+    # все сообщения одним блоком - за один feed разбираются все
+    def test_coalesced(self):
+        for framing in FRAMINGS:
+            decoder = FrameDecoder(framing)
+            decoder.feed(b"".join(encode(message, framing) for message in self.messages))
+            self.assertEqual(list(decoder), self.messages)
+            self.assertEqual(decoder.buffered, 0)
+
+    # поток, порезанный по одному байту - неполные кадры ждут продолжения
+    def test_partial_reads(self):
+        for framing in FRAMINGS:
+            decoder = FrameDecoder(framing)
+            data = b"".join(encode(message, framing) for message in self.messages)
+            received = []
+            for i in range(len(data)):
+                decoder.feed(data[i : i + 1])
+                received.extend(decoder)
+            self.assertEqual(received, self.messages)
+
+    # смена формата после ответа на presence, остаток буфера разбирается по новому формату
+    def test_switch_framing(self):
+        decoder = FrameDecoder()
+        decoder.feed(encode({RESPONSE: 200, FRAMING: FRAMING_LENGTH}, FRAMING_LEGACY) + encode(self.messages[0], FRAMING_LENGTH))
+        response = decoder.next_message()
+        decoder.framing = response[FRAMING]
+        self.assertEqual(list(decoder), [self.messages[0]])
+
+    # слишком длинный кадр отклоняется, даже если пришёл целиком одним блоком
+    def test_too_long_frame(self):
+        for framing in FRAMINGS:
+            decoder = FrameDecoder(framing, max_length=10)
+            decoder.feed(encode(self.messages[0], framing))
+            self.assertRaises(IncorrectDataRecivedError, decoder.next_message)
+        # недошедший объект legacy - как только принято больше max_length
+        decoder = FrameDecoder(max_length=100)
+        data = encode(self.messages[1], FRAMING_LEGACY)
+        decoder.feed(data[:60])
+        self.assertIsNone(decoder.next_message())
+        decoder.feed(data[60:120])
+        self.assertRaises(IncorrectDataRecivedError, decoder.next_message)
+
+    # недошедший объект legacy не склеивается и не сканируется заново при каждом feed
+    def test_legacy_incremental(self):
+        decoder = FrameDecoder()
+        data = encode(self.messages[1], FRAMING_LEGACY) + encode(self.messages[2], FRAMING_LEGACY)
+        for i in range(0, len(data) - 100, 100):
+            decoder.feed(data[i : i + 100])
+            self.assertIsNone(decoder.next_message())
+            self.assertEqual((decoder._scanned, len(decoder._chunks)), (i // 100, i // 100))
+        decoder.feed(data[i + 100 :])
+        self.assertEqual(list(decoder), self.messages[1:])
+
+    def test_not_dict(self):
+        decoder = FrameDecoder(FRAMING_NEWLINE)
+        decoder.feed(b"[1, 2]\n")
+        self.assertRaises(IncorrectDataRecivedError, decoder.next_message)
+
+    def test_choose_framing(self):
+        self.assertEqual(choose_framing([FRAMING_NEWLINE, FRAMING_LENGTH]), FRAMING_NEWLINE)
+        self.assertEqual(choose_framing(["unknown"]), FRAMING_LEGACY)
+        self.assertEqual(choose_framing(None), FRAMING_LEGACY)
+
+
+if __name__ == "__main__":
+    unittest.main()
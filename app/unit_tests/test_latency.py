@@ -0,0 +1,70 @@
+import unittest
+from functools import partial
+
+from app.common.framing import FrameDecoder
+from app.common.latency import HOP_ACK, HOP_DELIVERY, HOP_SERVER, HOP_UPLINK, LatencyTracker
+from app.common.metrics import HdrHistogram
+from app.common.utils import encode_message
+from app.common.variables import *
+from app.connection_cls import Connection
+from app.db.memory_storage import MemoryStorage
+from app.server_cls import Server
+
+SAMPLE = {ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", TIME: 1.5, MESSAGE_TEXT: "hi"}
+
+
+# Тесты подтверждений с отметками времени сервера и гистограмм задержек
+class TestLatency(unittest.TestCase):
+    def test_hdr_histogram(self):
+        histogram = HdrHistogram()
+        for micros in range(1, 100001):
+            histogram.record(micros / 1000000)
+        histogram.record(-1)
+        self.assertEqual(histogram.total, 100001)
+        for q in (0.5, 0.99, 0.999):
+            self.assertAlmostEqual(histogram.quantile(q), q / 10, delta=q / 10 / 64)
+        self.assertEqual(histogram.quantile(1), 0.1)
+        self.assertLess(len(histogram.counts), 1000)
+
+    def test_tracker(self):
+        tracker = LatencyTracker()
+        tracker.record_ack({ACTION: ACK, TIME: 10.0, RECEIVED: 10.001, DISPATCHED: 10.003}, now=10.005)
+        tracker.record_ack({ACTION: ACK, TIME: None, RECEIVED: 10.001, DISPATCHED: 10.003})
+        tracker.record_delivery(dict(SAMPLE, **{TIME: 10.0}), now=10.01)
+        hops = tracker.hops
+        self.assertEqual([hops[hop].total for hop in (HOP_UPLINK, HOP_SERVER, HOP_ACK, HOP_DELIVERY)], [1, 1, 1, 1])
+        self.assertAlmostEqual(hops[HOP_SERVER].quantile(0.5), 0.002, delta=0.0001)
+        self.assertAlmostEqual(hops[HOP_DELIVERY].quantile(0.5), 0.01, delta=0.0002)
+        self.assertEqual(len(tracker.report()), 4)
+
+    # подтверждение получает соединение, приславшее сообщение, и при пересылке кадра, и при полном разборе
+    def test_server_ack(self):
+        server = Server(DEFAULT_IP_ADDRESS, DEFAULT_PORT, MemoryStorage())
+        for name in ("test1", "test2"):
+            client = Connection(None, None)
+            client.name = name
+            client.framing = FRAMING_LENGTH
+            server.names[name] = client
+        sender = server.names["test1"]
+        sender.acks = True
+        server.received = 2.0
+        parsed = {TIME: 1.6, ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", MESSAGE_TEXT: "hi"}
+        sender.decoder.feed(encode_message(SAMPLE, FRAMING_LENGTH) + encode_message(parsed, FRAMING_LENGTH))
+        for message in sender.decoder.messages(partial(server.relay_frame, sender)):
+            server.process_client_message(message, sender)
+        # имя за тот же проход занято новым соединением - подтверждение всё равно уходит приславшему сообщения
+        server.names["test1"] = Connection(None, None)
+        server.names["test1"].acks = True
+        for message, origin in server.messages:
+            server.deliver(message, origin)
+        self.assertFalse(server.names["test1"].outbox)
+        decoder = FrameDecoder(FRAMING_LENGTH)
+        decoder.feed(b"".join(sender.outbox))
+        acks = list(decoder)
+        self.assertEqual([(ack[ACTION], ack[TIME], ack[RECEIVED]) for ack in acks], [(ACK, 1.5, 2.0), (ACK, 1.6, 2.0)])
+        self.assertTrue(all(ack[DISPATCHED] >= ack[RECEIVED] for ack in acks))
+        self.assertEqual(len(server.names["test2"].outbox), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
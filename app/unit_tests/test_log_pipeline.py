@@ -0,0 +1,60 @@
+import logging
+import threading
+import unittest
+
+from app.common.variables import *
+from app.logs.pipeline import LogPipeline
+
+
+# Обработчик для тестов: запоминает сообщения, может задержать поток записи
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def emit(self, record):
+        self.gate.wait()
+        self.messages.append(self.format(record))
+
+
+# Тесты асинхронного вывода лога
+class TestLogPipeline(unittest.TestCase):
+    def create(self, policy, size=10):
+        handler = ListHandler()
+        pipeline = LogPipeline([handler], size=size, policy=policy, batch=4)
+        logger = logging.getLogger(f"test-pipeline-{policy}")
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.handlers = [pipeline]
+        return logger, pipeline, handler
+
+    def test_order(self):
+        logger, pipeline, handler = self.create(LOG_POLICY_BLOCK)
+        data = {"n": 0}
+        for i in range(50):
+            data["n"] = i
+            logger.info("запись %s", data)
+        pipeline.flush()
+        # аргументы подставлены в момент вызова
+        self.assertEqual(handler.messages, [f"запись {{'n': {i}}}" for i in range(50)])
+        self.assertEqual((pipeline.written, pipeline.dropped), (50, 0))
+        pipeline.close()
+        logger.info("после остановки")
+        self.assertEqual(handler.messages[-1], "после остановки")
+
+    def test_drop(self):
+        logger, pipeline, handler = self.create(LOG_POLICY_DROP, size=2)
+        handler.gate.clear()
+        for i in range(20):
+            logger.info("запись %d", i)
+        handler.gate.set()
+        pipeline.flush()
+        self.assertGreater(pipeline.dropped, 0)
+        self.assertEqual(len(handler.messages) + pipeline.dropped, 20)
+        pipeline.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from app.db.memory_storage import MemoryStorage
+from app.db.storage import create_storage
+
+
+# Тесты хранилища в памяти
+class TestMemoryStorage(unittest.TestCase):
+    def setUp(self):
+        self.storage = create_storage("memory")
+
+    def test_sessions(self):
+        self.assertIsInstance(self.storage, MemoryStorage)
+        for i in range(5):
+            self.storage.user_login(f"user{i % 2}", "127.0.0.1", 7000 + i)
+        self.storage.user_logout("user0")
+        self.storage.user_logout("unknown")
+        self.assertEqual(sorted(name for name, last_login in self.storage.user_list()), ["user0", "user1"])
+        self.assertEqual([row[:3] for row in self.storage.active_user_list()], [("user1", "127.0.0.1", 7003)])
+        self.assertEqual([row[3] for row in self.storage.login_history("user0")], [7000, 7002, 7004])
+        self.assertEqual(self.storage.login_history("unknown"), [])
+        self.assertIsNone(self.storage.retention)
+
+    def test_history_page(self):
+        for i in range(7):
+            self.storage.user_login("user", "127.0.0.1", 7000 + i)
+        ports, after = [], None
+        while True:
+            rows, after = self.storage.login_history_page(after=after, limit=3)
+            ports.extend(row[3] for row in rows)
+            if after is None:
+                break
+        self.assertEqual(ports, list(range(7000, 7007)))
+        moment = self.storage.history[3].date_time
+        before = sum(record.date_time < moment for record in self.storage.history)
+        self.assertEqual(len(self.storage.login_history(until=moment)), before)
+        self.assertEqual(len(self.storage.login_history("user", since=moment)), 7 - before)
+
+
+if __name__ == "__main__":
+    unittest.main()
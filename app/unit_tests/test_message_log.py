@@ -0,0 +1,156 @@
+import os
+import socket
+import tempfile
+import unittest
+
+from app.common.variables import *
+from app.connection_cls import Connection
+from app.db.memory_storage import MemoryStorage
+from app.db.message_log import MessageLog
+from app.server_cls import Server
+
+
+# Тесты журнала недоставленных сообщений
+class TestMessageLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def drain(self, log, recipient):
+        while log.pending(recipient):
+            log.ack(recipient, log.read_batch(recipient, 1000)[1])
+
+    def test_read_batch(self):
+        log = MessageLog(self.directory)
+        for i in range(10):
+            log.append("test1", b"message %d" % i)
+        log.append("test2", b"other")
+        self.assertEqual(log.pending("test1"), 10)
+        batch, position = log.read_batch("test1", 20)
+        self.assertEqual(batch, [b"message 0", b"message 1", b"message 2"])
+        self.assertEqual(log.pending("test1"), 7)
+        self.assertEqual(log.read_batch("test1", 1)[0], [b"message 3"])
+        log.ack("test1", position)
+        self.assertEqual(log.pending("test1"), 6)
+        self.assertEqual(log.read_batch("test2", 1)[0], [b"other"])
+        self.assertEqual(log.pending("test2"), 0)
+        self.assertEqual(log.read_batch("test2", 1), ([], None))
+        log.close()
+
+    # выданные без подтверждения сообщения возвращаются в выдачу и после rewind, и после перезапуска
+    def test_rewind(self):
+        log = MessageLog(self.directory)
+        for i in range(5):
+            log.append("test1", b"message %d" % i)
+        log.ack("test1", log.read_batch("test1", 1)[1])
+        log.read_batch("test1", 1)
+        self.assertEqual((len(log.reading["test1"]), len(log.index["test1"])), (1, 3))
+        log.rewind("test1")
+        self.assertEqual(log.pending("test1"), 4)
+        self.assertEqual(log.read_batch("test1", 1)[0], [b"message 1"])
+        log.close()
+        log = MessageLog(self.directory)
+        self.assertEqual(log.pending("test1"), 4)
+        log.close()
+
+    # после перезапуска остаются только недоставленные сообщения, недописанный хвост отбрасывается
+    def test_recovery(self):
+        log = MessageLog(self.directory)
+        for i in range(5):
+            log.append("test1", b"message %d" % i)
+        log.ack("test1", log.read_batch("test1", 1)[1])
+        log.close()
+        with open(os.path.join(self.directory, "00000001.seg"), "ab") as file:
+            file.write(b"\x01\x00")
+        log = MessageLog(self.directory)
+        self.assertEqual(log.pending("test1"), 4)
+        self.assertEqual(log.read_batch("test1", 10 ** 6)[0], [b"message %d" % i for i in range(1, 5)])
+        log.close()
+
+    # полностью доставленные сегменты удаляются
+    def test_compact(self):
+        log = MessageLog(self.directory, segment_size=100)
+        for i in range(50):
+            log.append("test1", b"x" * 20)
+        self.assertGreater(len(log.segments()), 1)
+        self.drain(log, "test1")
+        self.assertEqual(log.segments(), [log.segment])
+        log.close()
+
+    # получатель, который не возвращается, не мешает удалять следующие сегменты, а в его сегменте остаётся
+    # только его сообщение; отметки о доставке других получателей при этом не теряются
+    def test_compact_stuck_recipient(self):
+        log = MessageLog(self.directory, segment_size=1000)
+        for i in range(10):
+            log.append("test1", b"first %d" % i)
+        log.append("test2", b"stuck")
+        for i in range(200):
+            log.append("test1", b"x" * 20)
+        self.assertGreater(len(log.segments()), 3)
+        self.drain(log, "test1")
+        self.assertEqual(log.segments(), [1, log.segment])
+        self.assertLess(os.path.getsize(log.segment_path(1)), 300)
+        log.close()
+        log = MessageLog(self.directory)
+        self.assertEqual(log.pending("test1"), 0)
+        self.assertEqual(log.read_batch("test2", 1)[0], [b"stuck"])
+        log.close()
+
+    # сегмент с отметкой о доставке удалён раньше сегмента с доставленными сообщениями - отметка переносится
+    def test_carry_acks(self):
+        log = MessageLog(self.directory, segment_size=100)
+        for recipient in ("test1", "test1", "test2", "test2", "test1"):
+            log.append(recipient, b"x" * 20)
+        for i in range(20):
+            log.append("test1", b"x" * 20)
+        self.drain(log, "test1")
+        for i in range(20):
+            log.append("test3", b"x" * 20)
+        self.drain(log, "test3")
+        self.assertEqual(log.segments(), [1, log.segment])
+        log.close()
+        log = MessageLog(self.directory)
+        self.assertEqual((log.pending("test1"), log.pending("test2")), (0, 2))
+        log.close()
+
+
+# Выдача журнала клиенту: доставка отмечается только после отправки кадров
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log = MessageLog(self.tmp.name)
+        for i in range(3):
+            self.log.append("test1", b'{"action": "msg", "message": "%d"}' % i)
+        self.server = Server(DEFAULT_IP_ADDRESS, DEFAULT_PORT, MemoryStorage(), message_log=self.log)
+        self.sock, self.peer = socket.socketpair()
+        self.sock.setblocking(False)
+        self.client = Connection(self.sock, None, changes=self.server.changes)
+        self.client.name = "test1"
+        self.server.clients[self.client.fd] = self.client
+
+    def tearDown(self):
+        self.peer.close()
+        self.log.close()
+        self.tmp.cleanup()
+
+    def test_ack_after_flush(self):
+        self.server.start_replay(self.client, "test1")
+        self.server.update_clients()
+        self.assertFalse(self.client.outbox)
+        self.assertFalse(self.client.replayed)
+        self.assertEqual(self.log.index.get("test1"), None)
+
+    # соединение разорвано до отправки - сообщения снова ждут получателя
+    def test_rewind_on_abort(self):
+        self.server.start_replay(self.client, "test1")
+        self.server.refill(self.client)
+        self.assertEqual(self.log.pending("test1"), 0)
+        self.server.drop_client(self.client, abort=True)
+        self.assertEqual(self.log.pending("test1"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import queue
+import unittest
+import urllib.error
+import urllib.request
+
+from app.common.metrics import REGISTRY, Registry, start_metrics_server
+from app.common.variables import *
+from app.db.memory_storage import MemoryStorage
+from app.logs.config_server_log import pipeline as log_pipeline
+from app.server_cls import Server
+
+
+# Тесты реестра метрик и HTTP-сервера метрик в формате Prometheus
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_render(self):
+        requests = self.registry.counter("jim_requests_total", "Requests", action="msg")
+        requests.inc()
+        requests.inc(2)
+        self.assertIs(self.registry.counter("jim_requests_total", "Requests", action="msg"), requests)
+        self.registry.counter("jim_requests_total", "Requests", action='a"b')
+        self.registry.gauge("jim_connections", "Connections", lambda: 5)
+        text = self.registry.render()
+        self.assertEqual(text.count("# TYPE jim_requests_total counter"), 1)
+        self.assertIn('jim_requests_total{action="msg"} 3\n', text)
+        self.assertIn('jim_requests_total{action="a\\"b"} 0\n', text)
+        self.assertIn("jim_connections 5\n", text)
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("jim_loop_seconds", "Loop", bounds=(0.001, 0.01))
+        for value in (0.0005, 0.001, 0.005, 0.5):
+            histogram.observe(value)
+        cumulative, total_sum, count = histogram.collect()
+        self.assertEqual((cumulative, count), ([2, 3, 4], 4))
+        self.assertAlmostEqual(total_sum, 0.5065)
+        quantiles = [histogram.quantile(q) for q in (0.5, 0.75, 1)]
+        self.assertEqual(quantiles, [0.001, 0.01, float("inf")])
+        text = self.registry.render()
+        self.assertIn('jim_loop_seconds_bucket{le="0.01"} 3\n', text)
+        self.assertIn('jim_loop_seconds_bucket{le="+Inf"} 4\n', text)
+        self.assertIn("jim_loop_seconds_count 4\n", text)
+
+    def test_http(self):
+        self.registry.counter("jim_connections_accepted_total", "Accepted").inc()
+        server = start_metrics_server(0, registry=self.registry)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+            with urllib.request.urlopen(url + "/metrics", timeout=5) as response:
+                self.assertTrue(response.headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+                self.assertIn("jim_connections_accepted_total 1\n", response.read().decode())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + "/other", timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    # метрики-функции сервера читают текущее состояние: очередь лога заменяется при запуске потока записи
+    def test_server_gauges(self):
+        Server(DEFAULT_IP_ADDRESS, DEFAULT_PORT, MemoryStorage())
+        gauges = {name: metric for name, kind, _, labels, metric in REGISTRY.collect() if kind == "gauge"}
+        saved = log_pipeline.queue
+        log_pipeline.queue = queue.Queue()
+        try:
+            for i in range(5):
+                log_pipeline.queue.put(i)
+            self.assertEqual(gauges["jim_log_queue"].collect(), 5)
+        finally:
+            log_pipeline.queue = saved
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import tempfile
+import threading
+import time
+import unittest
+
+from app.common.profiling import CallProfiler, MemoryTracer, SamplingProfiler, dump_report
+from app.common.variables import *
+from app.db.memory_storage import MemoryStorage
+from app.server_cls import Server
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+# Тесты профилирования из консоли сервера
+class TestProfiling(unittest.TestCase):
+    def test_sampling(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_loop, args=(stop,))
+        thread.start()
+        profiler = SamplingProfiler(thread.ident, interval=0.001)
+        profiler.start()
+        time.sleep(0.2)
+        profiler.stop()
+        stop.set()
+        thread.join()
+        self.assertGreater(profiler.samples, 10)
+        hot = [key for key in profiler.total if key.endswith("(busy_loop)")]
+        self.assertEqual(len(hot), 1)
+        self.assertGreater(profiler.total[hot[0]], profiler.samples * 0.9)
+        self.assertTrue(any("busy_loop" in line for line in profiler.report(5)))
+
+    # cProfile включается и выключается в потоке цикла сервера между проходами
+    def test_call_profiler_in_listener(self):
+        server = Server(DEFAULT_IP_ADDRESS, DEFAULT_PORT, MemoryStorage())
+        profiler = CallProfiler()
+        server.call_soon(profiler.start)
+        server.run_calls()
+        sum(range(10))
+        server.call_soon(profiler.stop)
+        server.call_soon(lambda: 1 / 0)
+        server.run_calls()
+        self.assertFalse(server.calls)
+        self.assertTrue(any("function calls" in line for line in profiler.report(5)))
+
+    def test_memory(self):
+        tracer = MemoryTracer()
+        tracer.start()
+        try:
+            self.assertTrue(tracer.running)
+            data = [bytes(1000) for _ in range(1000)]
+            lines = tracer.diff(5)
+            self.assertIn("test_profiling.py", lines[1])
+        finally:
+            tracer.stop()
+        self.assertFalse(tracer.running)
+        with tempfile.TemporaryDirectory() as directory:
+            path = dump_report("memory", lines, directory)
+            with open(path, encoding=ENCODING) as file:
+                self.assertEqual(file.read().splitlines(), lines)
+        del data
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+from functools import partial
+
+from app.common.codecs import CODECS, get_codec, msgpack, pack_keys
+from app.common.framing import FrameDecoder, encode_frame
+from app.common.utils import encode_message
+from app.common.variables import *
+from app.connection_cls import Connection, Relay
+from app.db.memory_storage import MemoryStorage
+from app.server_cls import Server
+
+MESSAGE = {ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", TIME: 1.1, MESSAGE_TEXT: "hi"}
+
+
+# Тесты пересылки сообщений без разбора
+class TestRelay(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(DEFAULT_IP_ADDRESS, DEFAULT_PORT, MemoryStorage())
+        for name in ("test1", "test2"):
+            client = Connection(None, None)
+            client.name = name
+            client.framing = FRAMING_LENGTH
+            self.server.names[name] = client
+
+    def receive(self, name, frame):
+        sender = self.server.names[name]
+        sender.decoder.feed(frame)
+        for message in sender.decoder.messages(partial(self.server.relay_frame, sender)):
+            self.server.process_client_message(message, sender)
+        for message, sender in self.server.messages:
+            self.server.deliver(message, sender)
+        self.server.messages.clear()
+        recipient = self.server.names["test2"]
+        decoder = FrameDecoder(recipient.framing, codec=recipient.codec)
+        decoder.feed(b"".join(recipient.outbox))
+        return list(decoder)
+
+    def test_route(self):
+        for codec in CODECS.values():
+            self.assertEqual(codec.route(codec.encode(MESSAGE)), ("test1", "test2"))
+            self.assertIsNone(codec.route(codec.encode({ACTION: PRESENCE, TIME: 1.1})))
+
+    # кадр пересылается как есть, без повторного кодирования
+    def test_relay(self):
+        frame = encode_message(MESSAGE, FRAMING_LENGTH)
+        self.server.relay_frame(self.server.names["test1"], frame, memoryview(frame)[4:])
+        self.assertIsInstance(self.server.messages[0][0], Relay)
+        self.server.messages.clear()
+        self.assertEqual(self.receive("test1", frame), [MESSAGE])
+        self.assertIsInstance(self.server.names["test2"].outbox[0], memoryview)
+
+    # отправитель не совпадает с именем соединения - сообщение отклоняется и быстрым путём, и при полном разборе,
+    # в том числе с повтором ключа from, который получатель прочитал бы по последнему значению
+    def test_spoofed_sender(self):
+        reordered = {TIME: 1.1, ACTION: MESSAGE, SENDER: "test1", DESTINATION: "test2", MESSAGE_TEXT: "hi"}
+        repeated = get_codec(CODEC_JSON).encode(dict(MESSAGE, **{SENDER: "test2"}))[:-1] + b', "from": "test1"}'
+        frames = (
+            encode_message(MESSAGE, FRAMING_LENGTH)
+            + encode_message(reordered, FRAMING_LENGTH)
+            + encode_frame(repeated, FRAMING_LENGTH)
+        )
+        received = self.receive("test2", frames)
+        self.assertFalse(self.server.messages)
+        self.assertEqual([message[RESPONSE] for message in received], [400, 400, 400])
+
+    # повтор ключа маршрутизации, в том числе экранированными символами или строкой вместо целого ключа msgpack
+    def test_repeated_route_keys(self):
+        codec = get_codec(CODEC_JSON)
+        payload = codec.encode(MESSAGE)[:-1]
+        for repeated in (payload + b', "to": "test3"}', payload + b', "\\u0066rom": "test3"}'):
+            self.assertIsNone(codec.route(repeated))
+        quoted = codec.encode(dict(MESSAGE, **{MESSAGE_TEXT: 'Привет, "from"'}))
+        self.assertEqual(codec.route(quoted), ("test1", "test2"))
+        if CODEC_MSGPACK in CODECS:
+            codec = get_codec(CODEC_MSGPACK)
+            payload = codec.encode(dict(MESSAGE, extra="from"))
+            self.assertEqual(codec.route(payload), ("test1", "test2"))
+            repeated = msgpack.packb(dict(pack_keys(MESSAGE), **{SENDER: "test3"}), use_bin_type=True)
+            self.assertEqual(codec.decode(repeated)[SENDER], "test3")
+            self.assertIsNone(codec.route(repeated))
+            self.assertIsNone(codec.route(payload + b"\xc0"))
+
+    # пакет разбирается на отдельные сообщения, некорректные и от чужого имени отбрасываются
+    def test_batch(self):
+        spoofed = dict(MESSAGE, **{SENDER: "test2"})
+        batch = {
+            ACTION: BATCH,
+            TIME: 1.1,
+            MESSAGES: [MESSAGE, {ACTION: MESSAGE}, spoofed, dict(MESSAGE, **{MESSAGE_TEXT: "2"})],
+        }
+        self.assertEqual(
+            self.receive("test1", encode_message(batch, FRAMING_LENGTH)), [MESSAGE, dict(MESSAGE, **{MESSAGE_TEXT: "2"})]
+        )
+
+    @unittest.skipUnless(CODEC_MSGPACK in CODECS, "msgpack не установлен")
+    def test_other_codec(self):
+        self.server.names["test2"].codec = get_codec(CODEC_MSGPACK)
+        self.assertEqual(self.receive("test1", encode_message(MESSAGE, FRAMING_LENGTH)), [MESSAGE])
+        self.assertIsInstance(self.server.names["test2"].outbox[0], bytes)
+
+    # текст, который не кодируется кодеком получателя (одиночный суррогат в MessagePack), не останавливает
+    # сервер: сообщение отбрасывается, отправителю уходит ответ 400 - и адресно, и в комнату
+    @unittest.skipUnless(CODEC_MSGPACK in CODECS, "msgpack не установлен")
+    def test_encode_error(self):
+        sender, recipient = self.server.names["test1"], self.server.names["test2"]
+        recipient.codec = get_codec(CODEC_MSGPACK)
+        self.server.rooms["#room"] = {sender, recipient}
+        for destination in ("test2", "#room"):
+            message = dict(MESSAGE, **{DESTINATION: destination, MESSAGE_TEXT: "\ud800"})
+            self.assertEqual(self.receive("test1", encode_message(message, FRAMING_LENGTH)), [])
+        decoder = FrameDecoder(FRAMING_LENGTH)
+        decoder.feed(b"".join(sender.outbox))
+        self.assertEqual([message[RESPONSE] for message in decoder], [400, 400])
+        self.assertEqual(self.receive("test1", encode_message(MESSAGE, FRAMING_LENGTH)), [MESSAGE])
+
+
+if __name__ == "__main__":
+    unittest.main()
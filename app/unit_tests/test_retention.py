@@ -0,0 +1,53 @@
+import contextlib
+import datetime
+import io
+import os
+import tempfile
+import unittest
+
+from app.db.server_db import ServerStorage
+
+
+# Тесты сворачивания старой истории входов в дневные сводки
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        database = "sqlite:///" + os.path.join(self.tmp.name, "server.db3")
+        self.storage = ServerStorage(database=database, write_behind=False, retention_days=30)
+        self.now = datetime.datetime(2026, 3, 1, 12, 0)
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp.cleanup()
+
+    def login(self, name, ip, days_ago, hour=10):
+        login_time = self.now.replace(hour=hour) - datetime.timedelta(days=days_ago)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.storage.submit(self.storage.apply_login, name, ip, 7777, login_time)
+
+    def test_compact(self):
+        self.login("user", "10.0.0.1", 40, hour=9)
+        self.login("user", "10.0.0.2", 40, hour=18)
+        self.login("user", "10.0.0.1", 40, hour=20)
+        self.login("other", "10.0.0.3", 35)
+        self.login("user", "10.0.0.1", 5)
+        retention = self.storage.retention
+        self.assertEqual(retention.compact(self.now), (4, 2))
+        self.assertEqual(len(self.storage.login_history()), 1)
+        day = retention.daily("user")
+        self.assertEqual(len(day), 1)
+        self.assertEqual(day[0].logins, 3)
+        self.assertEqual(day[0].ips, "10.0.0.1 10.0.0.2")
+        self.assertEqual(day[0].first_login.hour, 9)
+        self.assertEqual(day[0].last_login.hour, 20)
+        # запоздавшие записи за уже свёрнутый день добавляются к сводке
+        self.login("user", "10.0.0.4", 40, hour=23)
+        self.assertEqual(retention.compact(self.now), (1, 1))
+        day = retention.daily("user")[0]
+        self.assertEqual((day.logins, day.ips, day.last_login.hour), (4, "10.0.0.1 10.0.0.2 10.0.0.4", 23))
+        self.assertEqual(len(retention.daily(since=self.now - datetime.timedelta(days=36))), 1)
+        self.assertEqual(retention.compact(self.now), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
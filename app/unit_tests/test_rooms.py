@@ -0,0 +1,53 @@
+import unittest
+
+from app.common.framing import FrameDecoder
+from app.common.variables import *
+from app.connection_cls import Connection
+from app.db.memory_storage import MemoryStorage
+from app.server_cls import Server
+
+
+# Тесты комнат и рассылки сообщения участникам
+class TestRooms(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(DEFAULT_IP_ADDRESS, DEFAULT_PORT, MemoryStorage())
+        self.users = dict()
+        for name, framing in (("test1", FRAMING_LENGTH), ("test2", FRAMING_LENGTH), ("test3", FRAMING_NEWLINE)):
+            client = Connection(None, None)
+            client.name = name
+            client.framing = framing
+            self.server.names[name] = client
+            self.users[name] = client
+            self.server.process_client_message({ACTION: JOIN, TIME: 1.1, ROOM: "#room"}, client)
+            client.outbox.clear()
+            client.out_bytes = 0
+
+    def received(self, client):
+        decoder = FrameDecoder(client.framing)
+        decoder.feed(b"".join(client.outbox))
+        return list(decoder)
+
+    # сообщение кодируется один раз на формат кадров, отправителю не возвращается
+    def test_fan_out(self):
+        message = {ACTION: MESSAGE, SENDER: "test1", DESTINATION: "#room", TIME: 1.1, MESSAGE_TEXT: "hi"}
+        self.server.process_message(message, self.users["test1"])
+        self.assertFalse(self.users["test1"].outbox)
+        self.assertEqual(self.received(self.users["test2"]), [message])
+        self.assertEqual(self.received(self.users["test3"]), [message])
+        self.users["test1"].framing = FRAMING_LENGTH
+        self.server.process_message(dict(message, **{SENDER: "test3"}), self.users["test3"])
+        self.assertIs(self.users["test1"].outbox[0], self.users["test2"].outbox[-1])
+
+    def test_leave(self):
+        self.server.process_client_message({ACTION: LEAVE, TIME: 1.1, ROOM: "#room"}, self.users["test2"])
+        self.server.storage.user_login("test3", "127.0.0.1", 7003)
+        self.server.drop_client(self.users["test3"])
+        self.assertEqual(self.server.rooms["#room"], {self.users["test1"]})
+        # отключение без exit тоже завершает сессию
+        self.assertEqual(self.server.storage.active_user_list(), [])
+        self.server.drop_client(self.users["test1"])
+        self.assertNotIn("#room", self.server.rooms)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from app.db.sessions import ActiveSessions
+from app.db.storage import create_storage
+
+
+# Тесты активных сессий в памяти и их снимков
+class TestSessions(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.login_time = datetime.datetime(2026, 3, 1, 12, 0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_snapshots(self):
+        first = ActiveSessions(self.tmp.name, "worker-0")
+        second = ActiveSessions(self.tmp.name, "worker-1")
+        first.login("user1", "127.0.0.1", 7001, self.login_time)
+        first.login("user2", "127.0.0.1", 7002, self.login_time)
+        second.login("user3", "127.0.0.1", 7003, self.login_time)
+        first.logout("user2")
+        first.logout("unknown")
+        self.assertEqual(first.rows(), [("user1", "127.0.0.1", 7001, self.login_time)])
+        # снимок пишется только при изменениях
+        self.assertTrue(first.save())
+        self.assertFalse(first.save())
+        self.assertEqual(first.load_all(), [("user1", "127.0.0.1", 7001, self.login_time)])
+        second.save()
+        self.assertEqual(sorted(row[0] for row in first.load_all()), ["user1", "user3"])
+        second.close()
+        self.assertEqual(len(first.load_all()), 1)
+        # главный процесс при старте удаляет снимки прошлого запуска
+        storage = create_storage("memory", sessions_dir=self.tmp.name)
+        self.assertEqual(storage.active_user_list(shared=True), [])
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import socket
+import tempfile
+import unittest
+
+from app.common.framing import FrameDecoder
+from app.common.utils import encode_message
+from app.common.variables import *
+from app.connection_cls import Connection
+from app.db.memory_storage import MemoryStorage
+from app.db.message_log import MessageLog
+from app.shard_server_cls import ShardWorker
+
+
+# Тесты обработчика 1: обработчики 0 и 2 изображают вторые концы каналов socketpair, порт не слушается
+class TestShardWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log = MessageLog(self.tmp.name)
+        channels = dict()
+        self.remote = dict()
+        for peer_id in (0, 2):
+            channels[peer_id], self.remote[peer_id] = socket.socketpair()
+        storage = MemoryStorage()
+        self.worker = ShardWorker(
+            DEFAULT_IP_ADDRESS, DEFAULT_PORT, storage, OUTBOX_LIMIT, DEFAULT_OUTBOX_POLICY, 1, channels, self.log
+        )
+        self.decoders = {peer_id: FrameDecoder(FRAMING_LENGTH) for peer_id in self.remote}
+
+    def tearDown(self):
+        for sock in self.remote.values():
+            sock.close()
+        for peer in self.worker.peers.values():
+            peer.sock.close()
+        self.worker.selector.close()
+        self.log.close()
+        self.tmp.cleanup()
+
+    def connect(self, name):
+        client = Connection(None, None)
+        client.name = name
+        client.framing = FRAMING_LENGTH
+        self.worker.names[name] = client
+        return client
+
+    # кадры от обработчика peer_id
+    def peer_send(self, peer_id, *messages):
+        self.remote[peer_id].sendall(b"".join(encode_message(message, FRAMING_LENGTH) for message in messages))
+        self.worker.read_client(self.worker.peers[peer_id])
+
+    # что обработчик отправил в канал к peer_id
+    def peer_receive(self, peer_id):
+        self.worker.update_clients()
+        try:
+            self.decoders[peer_id].feed(self.remote[peer_id].recv(READ_CHUNK_SIZE, socket.MSG_DONTWAIT))
+        except BlockingIOError:
+            return []
+        return list(self.decoders[peer_id])
+
+    def message(self, destination, text):
+        return {ACTION: MESSAGE, SENDER: "local", DESTINATION: destination, TIME: 1.1, MESSAGE_TEXT: text}
+
+    def test_directory(self):
+        self.peer_send(0, {ACTION: DIRECTORY_ADD, ACCOUNT_NAME: "test1"})
+        self.peer_send(2, {ACTION: DIRECTORY_ADD, ACCOUNT_NAME: "test2"})
+        self.assertEqual(self.worker.directory, {"test1": 0, "test2": 2})
+        # удаление имени принимается только от обработчика, у которого оно зарегистрировано
+        self.peer_send(2, {ACTION: DIRECTORY_DEL, ACCOUNT_NAME: "test1"})
+        self.peer_send(2, {ACTION: DIRECTORY_DEL, ACCOUNT_NAME: "test2"})
+        self.assertEqual(self.worker.directory, {"test1": 0})
+
+    # одно имя в двух обработчиках: остаётся регистрация в обработчике с меньшим номером
+    def test_duplicate_name(self):
+        self.peer_send(2, {ACTION: DIRECTORY_ADD, ACCOUNT_NAME: "test1"})
+        self.peer_send(0, {ACTION: DIRECTORY_ADD, ACCOUNT_NAME: "test1"})
+        self.peer_send(2, {ACTION: DIRECTORY_ADD, ACCOUNT_NAME: "test1"})
+        self.assertEqual(self.worker.directory, {"test1": 0})
+
+        local = self.connect("test2")
+        self.peer_send(2, {ACTION: DIRECTORY_ADD, ACCOUNT_NAME: "test2"})
+        self.assertIs(self.worker.names["test2"], local)
+        self.assertNotIn("test2", self.worker.directory)
+
+        self.peer_send(0, {ACTION: DIRECTORY_ADD, ACCOUNT_NAME: "test2"})
+        self.assertNotIn("test2", self.worker.names)
+        self.assertEqual(self.worker.directory["test2"], 0)
+        decoder = FrameDecoder(FRAMING_LENGTH)
+        decoder.feed(b"".join(local.outbox))
+        self.assertEqual([message[RESPONSE] for message in decoder], [400])
+        self.assertIn({ACTION: DIRECTORY_DEL, ACCOUNT_NAME: "test2"}, self.peer_receive(2))
+
+    # сообщение пользователю другого обработчика уходит в канал к нему, пересланное доставляется локально
+    def test_forward(self):
+        self.peer_send(0, {ACTION: DIRECTORY_ADD, ACCOUNT_NAME: "test1"})
+        self.worker.process_message(self.message("test1", "туда"))
+        self.assertEqual(self.peer_receive(0), [self.message("test1", "туда")])
+        self.assertEqual(self.peer_receive(2), [])
+
+        local = self.connect("test2")
+        self.peer_send(0, self.message("test2", "обратно"))
+        decoder = FrameDecoder(FRAMING_LENGTH)
+        decoder.feed(b"".join(local.outbox))
+        self.assertEqual(list(decoder), [self.message("test2", "обратно")])
+        self.assertEqual(self.peer_receive(0), [])
+
+    # пока в журнале есть сообщения для пользователя, новые тоже идут в журнал и не обгоняют старые
+    def test_offline_pending(self):
+        self.worker.process_message(self.message("test1", "первое"))
+        self.assertEqual(self.log.pending("test1"), 1)
+        self.peer_send(0, {ACTION: DIRECTORY_ADD, ACCOUNT_NAME: "test1"})
+        self.worker.process_message(self.message("test1", "второе"))
+        self.assertEqual(self.log.pending("test1"), 2)
+        received = self.peer_receive(0)
+        self.assertEqual([message[MESSAGE_TEXT] for message in received], ["первое", "второе"])
+        self.assertIsNone(self.log.index.get("test1"))
+        self.worker.process_message(self.message("test1", "третье"))
+        self.assertEqual(self.log.pending("test1"), 0)
+        self.assertEqual([message[MESSAGE_TEXT] for message in self.peer_receive(0)], ["третье"])
+
+    # канал к обработчику закрыт: поздние изменения справочника не принимаются, сообщения уходят в журнал
+    def test_lost_peer(self):
+        self.peer_send(0, {ACTION: DIRECTORY_ADD, ACCOUNT_NAME: "test1"})
+        self.remote[0].close()
+        self.worker.read_client(self.worker.peers[0])
+        self.assertNotIn(0, self.worker.peers)
+        self.assertEqual(self.worker.directory, {})
+
+        self.worker.directory_add("test2", 0)
+        self.assertEqual(self.worker.directory, {})
+        self.worker.directory["test1"] = 0
+        self.worker.process_message(self.message("test1", "в журнал"))
+        self.assertEqual(self.worker.directory, {})
+        self.assertEqual(self.log.pending("test1"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import datetime
+import os
+import tempfile
+import threading
+import unittest
+
+from app.db.server_db import ServerStorage
+
+
+# Тесты отложенной записи в базу данных сервера
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.database = "sqlite:///" + os.path.join(self.tmp.name, "server.db3")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    # события пишутся пачками, после flush видны в базе
+    def test_write_behind(self):
+        storage = ServerStorage(database=self.database, commit_interval=1)
+        for i in range(100):
+            storage.user_login(f"user{i % 10}", "127.0.0.1", 7000 + i)
+        storage.user_logout("user0")
+        storage.flush()
+        self.assertEqual(storage.pending(), 0)
+        # выход пишется только в память
+        self.assertEqual(storage.written, 100)
+        self.assertLess(storage.commits, 100)
+        self.assertEqual(len(storage.user_list()), 10)
+        self.assertEqual(len(storage.active_user_list()), 9)
+        self.assertEqual(len(storage.login_history("user1")), 10)
+        storage.close()
+
+    # при закрытии очередь дописывается, дальше запись идёт сразу
+    def test_close(self):
+        storage = ServerStorage(database=self.database, commit_interval=10)
+        storage.user_login("user", "127.0.0.1", 7777)
+        storage.close()
+        self.assertEqual(len(storage.active_user_list()), 1)
+        storage.user_logout("user")
+        self.assertEqual(len(storage.active_user_list()), 0)
+
+    # активные сессии видны сразу, до записи в базу; справочник имён ограничен по размеру
+    def test_user_cache(self):
+        storage = ServerStorage(database=self.database, commit_interval=10, cache_size=2)
+        storage.user_login("user1", "127.0.0.1", 7001)
+        storage.user_login("user2", "127.0.0.1", 7002)
+        storage.user_logout("user1")
+        self.assertEqual([row[:3] for row in storage.active_user_list()], [("user2", "127.0.0.1", 7002)])
+        storage.user_login("user3", "127.0.0.1", 7003)
+        storage.flush()
+        self.assertEqual(list(storage.user_ids), ["user2", "user3"])
+        self.assertEqual(len(storage.login_history("user1")), 1)
+        self.assertEqual(list(storage.user_ids), ["user3", "user1"])
+        storage.close()
+        # при старте справочник заполняется последними входившими
+        storage = ServerStorage(database=self.database, cache_size=2)
+        self.assertEqual(list(storage.user_ids), ["user2", "user3"])
+        self.assertEqual(storage.active_user_list(), [])
+        storage.close()
+
+    # журнал WAL и отдельная сессия у каждого потока
+    def test_sessions(self):
+        storage = ServerStorage(database=self.database)
+        self.assertEqual(storage.session.execute("PRAGMA journal_mode").scalar(), "wal")
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(storage.session))
+        thread.start()
+        thread.join()
+        self.assertIsNot(sessions[0], storage.session)
+        storage.close()
+
+    # постраничная история по курсору, фильтр по периоду и потоковое чтение
+    def test_login_history_pages(self):
+        storage = ServerStorage(database=self.database, write_behind=False)
+        for i in range(25):
+            storage.user_login("user" if i % 5 else "other", "127.0.0.1", 7000 + i)
+        rows, after, pages = [], None, 0
+        while True:
+            page, after = storage.login_history_page("user", after, limit=7)
+            rows.extend(page)
+            pages += 1
+            if after is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual([row.port for row in rows], [7000 + i for i in range(25) if i % 5])
+        times = [row.date_time for row in rows]
+        middle = storage.login_history("user", since=times[5], until=times[10])
+        self.assertEqual(len(middle), 5)
+        self.assertEqual(len(list(storage.iter_login_history(batch=4))), 25)
+        self.assertEqual(storage.login_history_page("nobody"), ([], None))
+        self.assertIsNone(storage.history_query(until=datetime.datetime(2000, 1, 1)).first())
+        storage.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import logging
+import unittest
+
+import app.common.tracing as tracing
+from app.common.tracing import ARG_REPR_LIMIT, trace
+from app.common.variables import *
+
+
+# Обработчик для тестов: запоминает записи лога без форматирования
+class RecordHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+# Аргумент, который считает, сколько раз его выводили в лог
+class Counted:
+    def __init__(self):
+        self.reprs = 0
+
+    def __repr__(self):
+        self.reprs += 1
+        return "counted"
+
+
+# Тесты декоратора трассировки
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        # Режим трассировки читается при декорировании, тесты не зависят от JIM_TRACE окружения
+        self.addCleanup(setattr, tracing, "TRACE_MODE", tracing.TRACE_MODE)
+        tracing.TRACE_MODE = TRACE_ON
+        self.handler = RecordHandler()
+        self.logger = logging.getLogger("test-tracing")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.handlers = [self.handler]
+
+    def traced(self, sample=1.0):
+        @trace(sample, logger=self.logger)
+        def divide(a, b=1):
+            return a / b
+
+        return divide
+
+    # результат и исключение проходят через обёртку без изменений
+    def test_passthrough(self):
+        divide = self.traced()
+        self.assertEqual(divide.__name__, "divide")
+        self.assertEqual(divide(6, b=3), 2)
+        with self.assertRaises(ZeroDivisionError):
+            divide(1, b=0)
+        self.assertEqual(len(self.handler.records), 2)
+        self.assertTrue(self.handler.records[0].getMessage().endswith(".divide(6, b=3)"))
+
+    # длинные аргументы обрезаются, строка аргументов собирается только при форматировании записи
+    def test_lazy_args(self):
+        divide = self.traced()
+        argument = Counted()
+        with self.assertRaises(TypeError):
+            divide(argument)
+        self.assertEqual(argument.reprs, 0)
+        self.handler.records[0].getMessage()
+        self.assertEqual(argument.reprs, 1)
+        with self.assertRaises(TypeError):
+            divide("x" * 1000)
+        self.assertIn(f"'{'x' * (ARG_REPR_LIMIT - 4)}...", self.handler.records[1].getMessage())
+
+    # уровень выключен - запись не создаётся и аргументы не трогаются
+    def test_level_disabled(self):
+        divide = self.traced()
+        self.logger.setLevel(logging.INFO)
+        argument = Counted()
+        with self.assertRaises(TypeError):
+            divide(argument)
+        self.assertEqual(divide(4, b=2), 2)
+        self.assertEqual((self.handler.records, argument.reprs), ([], 0))
+
+    # записывается каждый 1 / sample вызов, начиная с первого
+    def test_sampling(self):
+        divide = self.traced(0.1)
+        for i in range(25):
+            self.assertEqual(divide(i), i)
+        self.assertEqual([record.args[1].args[0] for record in self.handler.records], [0, 10, 20])
+
+        self.handler.records.clear()
+        divide = self.traced(TRACE_IO_SAMPLE)
+        for i in range(250):
+            divide(i)
+        self.assertEqual(len(self.handler.records), 3)
+
+    # sample = 0 и режим off - функция не оборачивается
+    def test_off(self):
+        def divide(a, b=1):
+            return a / b
+
+        self.assertIs(trace(0)(divide), divide)
+        tracing.TRACE_MODE = TRACE_OFF
+        self.assertIs(trace(logger=self.logger)(divide), divide)
+
+
+if __name__ == "__main__":
+    unittest.main()
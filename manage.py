@@ -1,11 +1,17 @@
 import argparse
 
 from app.client_cls import Client
-from app.common.variables import (DEFAULT_IP_ADDRESS, DEFAULT_PORT,
-                                  DEFAULT_SERVER)
-from app.db.server_db import ServerStorage
+from app.common.variables import (ARCHIVE_PATH, COMPRESSION_THRESHOLD,
+                                  DEFAULT_IP_ADDRESS, DEFAULT_OUTBOX_POLICY,
+                                  DEFAULT_PORT, DEFAULT_SERVER,
+                                  DEFAULT_SERVER_MODE, DEFAULT_STORAGE,
+                                  DEFAULT_WORKERS, HISTORY_RETENTION_DAYS,
+                                  MESSAGE_LOG_DIR, METRICS_PORT, OUTBOX_LIMIT,
+                                  OUTBOX_POLICIES, SERVER_MODES, SESSIONS_DIR,
+                                  STORAGE_BACKENDS)
+from app.db.storage import create_storage
 
-from app.server_cls import Server
+from app.server_cls import create_server
 
 
 def parse_args():
@@ -14,6 +20,18 @@ def parse_args():
     parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
     parser.add_argument("-a", "--addr", type=str, default=DEFAULT_IP_ADDRESS)
     parser.add_argument("-n", "--name", type=str, default=None)
+    parser.add_argument("-m", "--mode", type=str, default=DEFAULT_SERVER_MODE, choices=SERVER_MODES)
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--outbox-limit", type=int, default=OUTBOX_LIMIT)
+    parser.add_argument("--outbox-policy", type=str, default=DEFAULT_OUTBOX_POLICY, choices=OUTBOX_POLICIES)
+    parser.add_argument("--offline-dir", type=str, default=MESSAGE_LOG_DIR)
+    parser.add_argument("--compress-threshold", type=int, default=COMPRESSION_THRESHOLD)
+    parser.add_argument("--history-days", type=int, default=HISTORY_RETENTION_DAYS)
+    parser.add_argument("--archive-db", type=str, default=ARCHIVE_PATH)
+    parser.add_argument("--sessions-dir", type=str, default=SESSIONS_DIR)
+    parser.add_argument("--storage", type=str, default=DEFAULT_STORAGE, choices=STORAGE_BACKENDS)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT)
+    parser.add_argument("--acks", action="store_true")
     return parser
 
 
@@ -26,10 +44,10 @@ def start():
 if __name__ == "__main__":
     ns = start()
     if ns.type == "server":
-        db = ServerStorage()
-        server = Server(ns.addr, ns.port, db)
+        db = create_storage(ns.storage, retention_days=ns.history_days, sessions_dir=ns.sessions_dir)
+        server = create_server(ns, db)
 
         server.start()
     elif ns.type == "client":
-        client = Client(ns.addr, ns.port, ns.name)
+        client = Client(ns.addr, ns.port, ns.name, ns.acks)
         client.start()